@@ -1,20 +1,249 @@
-from sqlalchemy import PrimaryKeyConstraint
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+
+from sqlalchemy import ForeignKeyConstraint, Index, PrimaryKeyConstraint, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
 from sqlmodel import SQLModel, Field
 from sqlmodel import create_engine
 
-from app.schemas import BaseOrder, BaseRecipient, BaseNotifiedState
-from app.settings import settings
+from app.logger import logger
+from app.schemas import (
+    BaseOrder,
+    BaseRecipient,
+    BaseNotifiedState,
+    BaseRate,
+    BaseAppliedRate,
+    NotifiedStatus,
+    BaseDatasetVersion,
+    BaseOrderTombstone,
+    BaseOrdersDailyTotal,
+    Date,
+)
+from app.settings import PoolSettings, get_settings
+
+# role of engine, which is used by code without own role
+DEFAULT_ROLE = "default"
+
+# pool settings' timeouts and postgres session options, which are set from them
+SESSION_TIMEOUTS = ("statement_timeout", "idle_in_transaction_session_timeout")
+
+_engines: dict[str, Engine] = {}
+_engines_lock = threading.Lock()
+
+
+@dataclass
+class CheckoutStats:
+    """Connections checkouts of single pool and time spent waiting for them"""
+
+    checkouts: int = 0
+    wait_time: float = 0
+    max_wait_time: float = 0
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool, which counts checkouts wait time and logs slow ones"""
+
+    slow_checkout = 0.1
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkout_stats = CheckoutStats()
+        self._stats_lock = threading.Lock()
+
+    def recreate(self) -> "TimedQueuePool":
+        # pool is recreated on dispose, stats are kept
+        pool = super().recreate()
+        pool.slow_checkout = self.slow_checkout
+        pool.checkout_stats, pool._stats_lock = self.checkout_stats, self._stats_lock
+        return pool
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+
+        try:
+            return super()._do_get()
+        finally:
+            wait_time = time.perf_counter() - started_at
+
+            with self._stats_lock:
+                self.checkout_stats.checkouts += 1
+                self.checkout_stats.wait_time += wait_time
+                self.checkout_stats.max_wait_time = max(
+                    self.checkout_stats.max_wait_time, wait_time
+                )
+
+            if wait_time >= self.slow_checkout:
+                logger.warning(
+                    f"Connection of {self.logging_name} pool was waited for {wait_time:.3f}s, "
+                    f"{self.checkedout()} of {self.size()} + {self._max_overflow} checked out"
+                )
+
+
+def set_session_timeouts(engine: Engine, pool_settings: PoolSettings):
+    """
+    Set postgres timeouts of pool settings for every connection. Pgbouncer's transaction
+    pooling shares server connections, so there they are set locally in every transaction
+    """
+
+    timeouts = {
+        name: int(getattr(pool_settings, name) * 1000)
+        for name in SESSION_TIMEOUTS
+        if getattr(pool_settings, name) is not None
+    }
+
+    if not len(timeouts):
+        return
+
+    if pool_settings.pgbouncer:
+
+        @event.listens_for(engine, "begin")
+        def set_local_timeouts(connection):
+            for name, value in timeouts.items():
+                connection.exec_driver_sql(f"SET LOCAL {name} = {value}")
+
+    else:
+
+        @event.listens_for(engine, "connect")
+        def set_timeouts(dbapi_connection, connection_record):
+            with dbapi_connection.cursor() as cursor:
+                for name, value in timeouts.items():
+                    cursor.execute(f"SET {name} = {value}")
+
+            # keep settings after rollback of first transaction
+            dbapi_connection.commit()
+
+
+def get_engine(role: str = DEFAULT_ROLE) -> Engine:
+    """
+    Return engine of given role, it is created with role's pool settings on first call.
+    Requests beyond pool size and overflow wait up to pool timeout in queue
+    """
+
+    with _engines_lock:
+        if role in _engines:
+            return _engines[role]
+
+        settings = get_settings()
+        pool_settings = settings.get_pool_settings(role)
+
+        engine = create_engine(
+            settings.database_dsn,
+            poolclass=TimedQueuePool,
+            pool_size=pool_settings.pool_size,
+            max_overflow=pool_settings.max_overflow,
+            pool_timeout=pool_settings.pool_timeout,
+            pool_recycle=pool_settings.pool_recycle,
+            pool_pre_ping=pool_settings.pool_pre_ping,
+            pool_logging_name=role,
+        )
+
+        engine.pool.slow_checkout = pool_settings.slow_checkout
+        set_session_timeouts(engine, pool_settings)
+
+        _engines[role] = engine
+
+    logger.info(f"Created {role} engine with {pool_settings}")
+    return engine
+
+
+def get_checkout_stats() -> dict[str, CheckoutStats]:
+    """Return checkout stats of created engines' pools by roles"""
+
+    with _engines_lock:
+        return {role: engine.pool.checkout_stats for role, engine in _engines.items()}
+
+
+def __getattr__(name: str):
+    # engine of default role is created on first access of module's engine attribute
+    if name == "engine":
+        return get_engine()
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-engine = create_engine(settings.database_dsn)
+
+# name of orders dataset in dataset_versions table
+ORDERS_DATASET = "orders"
+
+# dataset, which version is the latest of pruned tombstones, changes
+# since older versions miss deleted orders
+PRUNED_TOMBSTONES_DATASET = "pruned_order_tombstones"
+
+# source of orders, which are refreshed from single google sheet
+DEFAULT_SOURCE = "default"
 
 
 class DatabaseOrder(BaseOrder, SQLModel, table=True):
     """Database order model"""
 
     __tablename__ = "orders"
+    __table_args__ = (
+        # keyset pagination by table_id
+        Index("orders_table_id_order_id_idx", "table_id", "order_id"),
+        Index("orders_supply_date_idx", "supply_date"),
+        Index("orders_version_idx", "version"),
+        Index("orders_source_idx", "source"),
+    )
 
     order_id: int = Field(primary_key=True)
 
+    # source partition, which is refreshed independently of the others
+    source: str = Field(
+        default=DEFAULT_SOURCE,
+        nullable=False,
+        sa_column_kwargs={"server_default": DEFAULT_SOURCE},
+    )
+
+    # dataset version of last order change
+    version: int = Field(default=0, nullable=False, sa_column_kwargs={"server_default": "0"})
+
+
+class DatabaseOrderTombstone(BaseOrderTombstone, SQLModel, table=True):
+    """Database deleted order model"""
+
+    __tablename__ = "order_tombstones"
+    __table_args__ = (
+        Index("order_tombstones_version_idx", "version"),
+        Index("order_tombstones_deleted_at_idx", "deleted_at"),
+    )
+
+    order_id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+
+    # time of deletion, tombstones are pruned by it
+    deleted_at: datetime = Field(default_factory=datetime.now, nullable=False)
+
+
+class DatabaseOrdersDailyTotal(BaseOrdersDailyTotal, SQLModel, table=True):
+    """Database orders totals for single supply date, maintained by refresher"""
+
+    __tablename__ = "orders_daily_totals"
+
+    supply_date: Date = Field(primary_key=True)
+
+
+class DatabaseDatasetVersion(BaseDatasetVersion, SQLModel, table=True):
+    """Database dataset version model"""
+
+    __tablename__ = "dataset_versions"
+
+    name: str = Field(primary_key=True)
+
+
+class DatabaseRate(BaseRate, SQLModel, table=True):
+    """Database currency rate model"""
+
+    __tablename__ = "rates"
+    __table_args__ = (PrimaryKeyConstraint("currency_id", "rate_date"),)
+
+
+class DatabaseAppliedRate(BaseAppliedRate, SQLModel, table=True):
+    """Database applied currency rate model"""
+
+    __tablename__ = "applied_rates"
+    __table_args__ = (PrimaryKeyConstraint("source", "currency_id"),)
+
 
 class DatabaseRecipient(BaseRecipient, SQLModel, table=True):
     """Database recipient model"""
@@ -34,4 +263,40 @@ class DatabaseNotifiedState(BaseNotifiedState, SQLModel, table=True):
             "recipient_provider",
             "recipient_provider_id",
         ),
+        # states are deleted with their orders and recipients
+        ForeignKeyConstraint(
+            ["order_id"],
+            ["orders.order_id"],
+            name="notified_order_id_fkey",
+            ondelete="CASCADE",
+        ),
+        ForeignKeyConstraint(
+            ["recipient_provider", "recipient_provider_id"],
+            ["recipients.provider", "recipients.provider_id"],
+            name="notified_recipient_fkey",
+            ondelete="CASCADE",
+        ),
+        # per-recipient lookups and cascade deletes of recipients
+        Index(
+            "notified_recipient_idx",
+            "recipient_provider",
+            "recipient_provider_id",
+            "order_id",
+        ),
+        # lookups of expired sending states
+        Index(
+            "notified_sending_at_idx",
+            "sending_at",
+            postgresql_where=text("status = 'sending'"),
+        ),
+    )
+
+    # existing states have been created before sending statuses
+    status: NotifiedStatus = Field(
+        default=NotifiedStatus.sent,
+        nullable=False,
+        sa_column_kwargs={"server_default": NotifiedStatus.sent.name},
     )
+
+    # time of marking state as sending, sending states are expired by it
+    sending_at: datetime = Field(default=None, nullable=True)
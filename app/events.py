@@ -0,0 +1,128 @@
+import json
+import select
+import threading
+import time
+from queue import Full, Queue
+from typing import Any, Union
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from sqlalchemy import func
+from sqlalchemy import select as sa_select
+from sqlalchemy.engine import Connection
+from sqlmodel import Session
+
+from app.logger import logger
+
+ORDERS_CHANNEL = "orders"
+RECIPIENTS_CHANNEL = "recipients"
+
+
+def publish(session: Union[Session, Connection], channel: str, payload: dict[str, Any]):
+    """Notify channel listeners with json payload, notification is delivered on commit"""
+    session.execute(sa_select(func.pg_notify(channel, json.dumps(payload))))
+
+
+class Listener:
+    """
+    Single LISTEN connection, which fans channels notifications out to subscribers as
+    (channel, payload) tuples. Connection is opened in background thread on first subscription
+    and reopened on errors. Every channel gets None payload, when notifications could be
+    missed: after connection is opened and after subscriber's queue overflow
+    """
+
+    poll_timeout = 5
+    reconnect_delay = 5
+    queue_size = 100
+
+    def __init__(self, dsn: str, channels: list[str]):
+        self._dsn = dsn
+        self._channels = channels
+        self._name = ", ".join(channels)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self) -> Queue:
+        """Return queue, which receives channels and raw payloads of notifications"""
+
+        queue = Queue(self.queue_size)
+
+        with self._lock:
+            self._subscribers.add(queue)
+
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=f"listener-{self._name}", daemon=True
+                )
+                self._thread.start()
+
+        return queue
+
+    def unsubscribe(self, queue: Queue):
+        """Stop sending notifications to given queue"""
+
+        with self._lock:
+            self._subscribers.discard(queue)
+
+    def _fan_out(self, channel: str, payload: str | None):
+        """
+        Put notification into every subscriber's queue. Queue of subscriber, which lags
+        behind, is replaced with None payloads of every channel
+        """
+
+        with self._lock:
+            subscribers = list(self._subscribers)
+
+        for queue in subscribers:
+            try:
+                queue.put_nowait((channel, payload))
+            except Full:
+                with queue.mutex:
+                    queue.queue.clear()
+
+                for missed_channel in self._channels:
+                    queue.put_nowait((missed_channel, None))
+
+    def _listen(self):
+        """Open connection, listen channels and fan notifications out until connection fails"""
+
+        connection = psycopg2.connect(self._dsn)
+        connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+
+        try:
+            with connection.cursor() as cursor:
+                for channel in self._channels:
+                    cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+
+            logger.info(f"Listening {self._name} channel(s)")
+
+            for channel in self._channels:
+                self._fan_out(channel, None)
+
+            while True:
+                if select.select([connection], [], [], self.poll_timeout) == ([], [], []):
+                    continue
+
+                connection.poll()
+
+                while connection.notifies:
+                    notify = connection.notifies.pop(0)
+                    self._fan_out(notify.channel, notify.payload)
+        finally:
+            connection.close()
+
+    def _run(self):
+        """Listen channels forever, reconnect after any errors, subscribers must not hang"""
+
+        while True:
+            try:
+                self._listen()
+            except psycopg2.Error as e:
+                logger.error(f"Listener of {self._name} channel(s) failed: {e}")
+            except Exception as e:
+                # e.g. select on dead socket, connection is reopened as after database errors
+                logger.error(f"Listener of {self._name} channel(s) failed: {e}", exc_info=e)
+
+            time.sleep(self.reconnect_delay)
@@ -0,0 +1,338 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.database import get_checkout_stats
+from app.logger import logger
+from app.settings import get_settings
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+_enabled = False
+_metrics: list["Metric"] = []
+
+# tick, which is tracked in current thread
+_local = threading.local()
+
+
+class Metric(ABC):
+    """
+    Abstract metric with values by labels. Values are changed only when metrics are enabled,
+    otherwise every change returns immediately
+    """
+
+    type: str = None
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _get_key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        """Return values key of given labels"""
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _format_labels(self, key: tuple[str, ...], *extra: tuple[str, str]) -> str:
+        """Format labels of values key and extra labels as prometheus does"""
+
+        pairs = [*zip(self.labels, key), *extra]
+
+        if not len(pairs):
+            return ""
+
+        escaped = ((k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+        return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+    @abstractmethod
+    def _render_values(self) -> list[str]:
+        """Must return sample lines of all values"""
+
+    def render(self) -> list[str]:
+        """Return metric's lines in prometheus text format"""
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+        with self._lock:
+            return lines + self._render_values()
+
+
+class Counter(Metric):
+    """Monotonically increasing counter"""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: str):
+        """Increase counter of given labels"""
+
+        if not _enabled:
+            return
+
+        key = self._get_key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_values(self) -> list[str]:
+        return [f"{self.name}{self._format_labels(k)} {v}" for k, v in self._values.items()]
+
+
+class Histogram(Metric):
+    """Histogram of observed values with cumulative buckets"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = TIME_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels: str):
+        """Put value into histogram of given labels"""
+
+        if not _enabled:
+            return
+
+        key = self._get_key(labels)
+
+        with self._lock:
+            # bucket counts, +Inf bucket is the last one, and sum of values
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0))
+
+            for i, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    counts[i] += 1
+
+            counts[-1] += 1
+            self._values[key] = (counts, total + value)
+
+    def _render_values(self) -> list[str]:
+        lines = []
+
+        for key, (counts, total) in self._values.items():
+            for bucket, count in zip((*self.buckets, "+Inf"), counts):
+                labels = self._format_labels(key, ("le", str(bucket)))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {counts[-1]}")
+
+        return lines
+
+
+TICK_SECONDS = Histogram("tick_seconds", "Duration of refresher's and notifier's ticks", ("job",))
+STAGE_SECONDS = Histogram(
+    "tick_stage_seconds", "Time of ticks' stages, without nested stages", ("job", "stage")
+)
+TICK_STATEMENTS = Histogram(
+    "tick_statements", "SQL statements executed by ticks", ("job",), COUNT_BUCKETS
+)
+STATEMENTS = Counter("db_statements_total", "SQL statements executed by engines", ("role",))
+
+JOB_SECONDS = Histogram("scheduler_job_seconds", "Duration of scheduler's job runs", ("job",))
+JOB_FAILURES = Counter("scheduler_job_failures_total", "Failed scheduler's job runs", ("job",))
+
+REFRESHER_ROWS = Counter("refresher_rows_total", "Extracted source rows", ("extractor", "source"))
+REFRESHER_INVALID_ROWS = Counter(
+    "refresher_invalid_rows_total",
+    "Extracted source rows, which are invalid",
+    ("extractor", "source"),
+)
+REFRESHER_CHANGES = Counter(
+    "refresher_orders_changes_total", "Refreshed orders changes", ("source", "change")
+)
+REFRESHER_SOURCE_FAILURES = Counter(
+    "refresher_source_failures_total", "Failed refreshes of single sources", ("source",)
+)
+
+NOTIFIER_SEND_SECONDS = Histogram(
+    "notifier_send_seconds", "Duration of notification sending with retries", ("provider",)
+)
+NOTIFIER_NOTIFICATIONS = Counter(
+    "notifier_notifications_total", "Dispatched notifications", ("provider", "result")
+)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds",
+    "Duration of backend requests until response is sent",
+    ("endpoint", "method", "status"),
+)
+
+
+class _Tick:
+    """Durations of stages and executed statements of single tick"""
+
+    def __init__(self):
+        self.durations = {}
+        self.nested_durations = []
+        self.statements = 0
+
+
+def is_enabled() -> bool:
+    """Check if metrics are collected"""
+    return _enabled
+
+
+@contextmanager
+def track_tick(job: str) -> Iterator[None]:
+    """
+    Track block as job's tick: observe its duration, durations of its stages
+    and SQL statements executed in current thread meanwhile
+    """
+
+    if not _enabled:
+        yield
+        return
+
+    tick = _local.tick = _Tick()
+    started_at = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        _local.tick = None
+
+        TICK_SECONDS.observe(time.perf_counter() - started_at, job=job)
+        TICK_STATEMENTS.observe(tick.statements, job=job)
+
+        for name, duration in tick.durations.items():
+            STAGE_SECONDS.observe(duration, job=job, stage=name)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Count block's time as stage of tracked tick, time of nested stages is counted
+    only by them. Block must not yield from generator
+    """
+
+    tick = getattr(_local, "tick", None)
+
+    if tick is None:
+        yield
+        return
+
+    tick.nested_durations.append(0)
+    started_at = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started_at
+        own_duration = duration - tick.nested_durations.pop()
+        tick.durations[name] = tick.durations.get(name, 0) + own_duration
+
+        if len(tick.nested_durations):
+            tick.nested_durations[-1] += duration
+
+
+def _count_statement(connection, *_):
+    """Count statement executed by engine and by tracked tick of current thread"""
+
+    STATEMENTS.inc(role=connection.engine.pool.logging_name or "unknown")
+    tick = getattr(_local, "tick", None)
+
+    if tick is not None:
+        tick.statements += 1
+
+
+def _render_pool_stats() -> list[str]:
+    """Return lines of engines' pools checkout stats, which are collected by pools"""
+
+    stats = get_checkout_stats()
+
+    # every family's samples directly follow its own help and type lines
+    families = (
+        ("db_pool_checkouts_total", "Connections checked out from engines' pools", "checkouts"),
+        (
+            "db_pool_checkout_wait_seconds_total",
+            "Time waited for connections checkouts",
+            "wait_time",
+        ),
+    )
+
+    lines = []
+
+    for name, documentation, attribute in families:
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} counter")
+
+        for role, role_stats in stats.items():
+            lines.append(f'{name}{{role="{role}"}} {getattr(role_stats, attribute)}')
+
+    return lines
+
+
+def render() -> str:
+    """Render all metrics in prometheus text format"""
+
+    lines = [line for metric in _metrics for line in metric.render()]
+    return "\n".join(lines + _render_pool_stats()) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve rendered metrics at /metrics"""
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        data = render().encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *_):
+        pass
+
+
+def setup(serve: bool = False):
+    """
+    Enable metrics if they are enabled in settings, optionally serve them at local
+    http endpoint in background thread. Repeated calls do nothing
+    """
+
+    global _enabled
+
+    settings = get_settings()
+
+    if _enabled or not settings.metrics_enabled:
+        return
+
+    _enabled = True
+    event.listen(Engine, "before_cursor_execute", _count_statement)
+
+    if serve:
+        address = (settings.metrics_host, settings.metrics_port)
+
+        # e.g. port is taken by another script, which runs on the same host
+        try:
+            server = ThreadingHTTPServer(address, MetricsHandler)
+        except OSError as e:
+            logger.error(f"Unable to serve metrics at {address[0]}:{address[1]}: {e}")
+            return
+
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+
+        logger.info(f"Serving metrics at {address[0]}:{address[1]}")
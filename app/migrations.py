@@ -0,0 +1,288 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import AddConstraint
+from sqlmodel import SQLModel
+
+from app.database import (
+    DEFAULT_SOURCE,
+    PRUNED_TOMBSTONES_DATASET,
+    DatabaseAppliedRate,
+    DatabaseDatasetVersion,
+    DatabaseOrder,
+    DatabaseNotifiedState,
+    DatabaseOrderTombstone,
+    DatabaseOrdersDailyTotal,
+)
+from app.logger import logger
+
+# any constant, which is the same for all migrating processes
+MIGRATIONS_LOCK_KEY = 4_218_935
+
+migrations_table = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+@dataclass
+class Migration:
+    """Schema migration, which is applied in its own transaction"""
+
+    version: int
+    name: str
+    apply: Callable[[Connection], None]
+
+
+MIGRATIONS: list[Migration] = []
+
+
+def migration(version: int) -> Callable:
+    """Register decorated function as migration with given version"""
+
+    def decorator(function: Callable[[Connection], None]) -> Callable[[Connection], None]:
+        MIGRATIONS.append(Migration(version, function.__name__, function))
+        return function
+
+    return decorator
+
+
+def prune_notified_states(connection: Connection, batch_size: int = None) -> int:
+    """
+    Delete notified states of deleted orders and recipients, up to batch_size
+    states if given. Return number of deleted states
+    """
+
+    limit = "" if batch_size is None else "LIMIT :batch_size"
+
+    statement = text(
+        f"""
+        DELETE FROM notified WHERE ctid IN (
+            SELECT notified.ctid FROM notified
+            WHERE NOT EXISTS (
+                SELECT 1 FROM orders WHERE orders.order_id = notified.order_id
+            )
+            OR NOT EXISTS (
+                SELECT 1 FROM recipients
+                WHERE recipients.provider = notified.recipient_provider
+                AND recipients.provider_id = notified.recipient_provider_id
+            )
+            {limit}
+        )
+        """
+    )
+
+    return connection.execute(statement, {"batch_size": batch_size}).rowcount
+
+
+def prune_order_tombstones(
+    connection: Connection, deleted_before: datetime, batch_size: int = None
+) -> int:
+    """
+    Delete tombstones of orders deleted before given time, up to batch_size tombstones
+    if given, and raise pruned tombstones' version. Return number of deleted tombstones
+    """
+
+    limit = "" if batch_size is None else "LIMIT :batch_size"
+
+    statement = text(
+        f"""
+        DELETE FROM order_tombstones WHERE ctid IN (
+            SELECT ctid FROM order_tombstones WHERE deleted_at < :deleted_before {limit}
+        )
+        RETURNING version
+        """
+    )
+
+    params = {"deleted_before": deleted_before, "batch_size": batch_size}
+    versions = connection.execute(statement, params).scalars().all()
+
+    if len(versions):
+        statement = insert(DatabaseDatasetVersion.__table__)
+        statement = statement.values(name=PRUNED_TOMBSTONES_DATASET, version=max(versions))
+        statement = statement.on_conflict_do_update(
+            index_elements=[DatabaseDatasetVersion.name],
+            set_={
+                "version": func.greatest(
+                    DatabaseDatasetVersion.__table__.c.version, statement.excluded.version
+                )
+            },
+        )
+        connection.execute(statement)
+
+    return len(versions)
+
+
+@migration(1)
+def create_tables(connection: Connection):
+    """Create missing tables, existing ones are changed by the next migrations"""
+    SQLModel.metadata.create_all(connection)
+
+
+@migration(2)
+def add_notified_status(connection: Connection):
+    """Add sending and sent statuses to notified states, existing ones have been sent"""
+    connection.execute(
+        text("ALTER TABLE notified ADD COLUMN IF NOT EXISTS status VARCHAR NOT NULL DEFAULT 'sent'")
+    )
+
+
+@migration(3)
+def add_orders_version(connection: Connection):
+    """Add dataset version of last order change"""
+    connection.execute(
+        text("ALTER TABLE orders ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0")
+    )
+
+
+@migration(4)
+def create_indexes(connection: Connection):
+    """Create indexes, which are missing in tables created before them"""
+
+    # indexes as of this migration, later ones are created by their own migrations,
+    # since their columns may not exist yet
+    statements = (
+        "CREATE INDEX IF NOT EXISTS orders_table_id_order_id_idx ON orders (table_id, order_id)",
+        "CREATE INDEX IF NOT EXISTS orders_supply_date_idx ON orders (supply_date)",
+        "CREATE INDEX IF NOT EXISTS orders_version_idx ON orders (version)",
+        "CREATE INDEX IF NOT EXISTS notified_recipient_idx "
+        "ON notified (recipient_provider, recipient_provider_id, order_id)",
+    )
+
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+@migration(5)
+def fill_daily_totals(connection: Connection):
+    """Fill daily totals of orders, which have been refreshed before totals"""
+
+    connection.execute(DatabaseOrdersDailyTotal.__table__.delete())
+    connection.execute(
+        text(
+            """
+            INSERT INTO orders_daily_totals (supply_date, orders_count, price_usd, price_rub)
+            SELECT supply_date, count(*), sum(price_usd), sum(price_rub)
+            FROM orders GROUP BY supply_date
+            """
+        )
+    )
+
+
+@migration(6)
+def add_notified_foreign_keys(connection: Connection):
+    """
+    Prune orphaned notified states and add cascade foreign keys without validation,
+    which would lock notified table for writes
+    """
+
+    logger.info(f"Pruned {prune_notified_states(connection)} orphaned notified state(s)")
+
+    for constraint in DatabaseNotifiedState.__table__.foreign_key_constraints:
+        statement = text("SELECT 1 FROM pg_constraint WHERE conname = :name")
+
+        if connection.execute(statement, {"name": constraint.name}).scalar() is None:
+            add_constraint = AddConstraint(constraint).compile(dialect=connection.dialect)
+            connection.execute(text(f"{add_constraint} NOT VALID"))
+
+
+@migration(7)
+def validate_notified_foreign_keys(connection: Connection):
+    """Validate notified foreign keys, writes are not blocked meanwhile"""
+
+    for constraint in DatabaseNotifiedState.__table__.foreign_key_constraints:
+        connection.execute(text(f"ALTER TABLE notified VALIDATE CONSTRAINT {constraint.name}"))
+
+
+@migration(8)
+def add_orders_source(connection: Connection):
+    """Add orders source partition, existing orders come from the default source"""
+
+    connection.execute(
+        text(
+            "ALTER TABLE orders ADD COLUMN IF NOT EXISTS "
+            f"source VARCHAR NOT NULL DEFAULT '{DEFAULT_SOURCE}'"
+        )
+    )
+
+    for index in DatabaseOrder.__table__.indexes:
+        if index.name == "orders_source_idx":
+            index.create(connection, checkfirst=True)
+
+
+@migration(9)
+def create_applied_rates(connection: Connection):
+    """Create applied rates table, rates of existing orders are saved by their next refresh"""
+    DatabaseAppliedRate.__table__.create(connection, checkfirst=True)
+
+
+@migration(10)
+def add_notified_sending_at(connection: Connection):
+    """Add time of marking notified states as sending, existing sending states are expired"""
+
+    connection.execute(text("ALTER TABLE notified ADD COLUMN IF NOT EXISTS sending_at TIMESTAMP"))
+
+    for index in DatabaseNotifiedState.__table__.indexes:
+        if index.name == "notified_sending_at_idx":
+            index.create(connection, checkfirst=True)
+
+
+@migration(11)
+def add_order_tombstones_deleted_at(connection: Connection):
+    """Add time of orders deletion, existing tombstones are kept for the whole retention"""
+
+    connection.execute(
+        text(
+            "ALTER TABLE order_tombstones ADD COLUMN IF NOT EXISTS "
+            "deleted_at TIMESTAMP NOT NULL DEFAULT now()"
+        )
+    )
+
+    for index in DatabaseOrderTombstone.__table__.indexes:
+        if index.name == "order_tombstones_deleted_at_idx":
+            index.create(connection, checkfirst=True)
+
+
+def migrate(engine: Engine):
+    """
+    Apply pending migrations in versions order. Concurrent processes wait for each other
+    with advisory lock, so every migration is applied once
+    """
+
+    with engine.connect() as connection:
+        with connection.begin():
+            connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+
+        try:
+            with connection.begin():
+                migrations_table.create(connection, checkfirst=True)
+                applied_versions = set(
+                    connection.execute(select(migrations_table.c.version)).scalars()
+                )
+
+            for pending in sorted(MIGRATIONS, key=lambda m: m.version):
+                if pending.version in applied_versions:
+                    continue
+
+                with connection.begin():
+                    pending.apply(connection)
+                    connection.execute(
+                        migrations_table.insert().values(
+                            version=pending.version,
+                            name=pending.name,
+                            applied_at=datetime.now(),
+                        )
+                    )
+
+                logger.info(f"Applied migration {pending.version} {pending.name}")
+        finally:
+            with connection.begin():
+                statement = text("SELECT pg_advisory_unlock(:key)")
+                connection.execute(statement, {"key": MIGRATIONS_LOCK_KEY})
@@ -1,13 +1,23 @@
 from abc import ABC, abstractmethod
-from datetime import datetime
+from datetime import datetime, timedelta
+from itertools import groupby
 from typing import Iterable
 
+from sqlalchemy import or_
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.engine import Engine
 from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session
 
+from app import events
 from app.database import DatabaseRecipient, DatabaseOrder, DatabaseNotifiedState
-from app.schemas import Provider, BaseRecipient, NotificationData
+from app.schemas import (
+    Provider,
+    BaseRecipient,
+    NotificationData,
+    NotificationScope,
+    NotifiedStatus,
+)
 
 
 class BaseBackend(ABC):
@@ -29,8 +39,37 @@ class BaseBackend(ABC):
     def mark_notification_sent(self, notification: NotificationData):
         """Must mark notification at the backend as sent"""
 
-    def get_notifications_for_provider(self, provider: Provider) -> Iterable[NotificationData]:
-        """Yield all actual notifications for given provider"""
+    @abstractmethod
+    def mark_notifications_sending(self, notifications: list[NotificationData]):
+        """
+        Must mark notifications at the backend as being sent, before sending them.
+        Such notifications must not be yielded again until they are marked or expired
+        """
+
+    @abstractmethod
+    def mark_notifications_sent(
+        self,
+        sent_notifications: list[NotificationData],
+        failed_notifications: list[NotificationData],
+    ):
+        """Must mark sending notifications as sent and forget failed ones to resend them"""
+
+    @abstractmethod
+    def expire_sending_notifications(self, timeout: timedelta) -> list[BaseRecipient]:
+        """
+        Must forget notifications, which are being sent longer than timeout, e.g. after crash
+        between marking and sending them, to resend them. Return recipients of expired ones
+        """
+
+    def get_notifications_for_provider(
+        self,
+        provider: Provider,
+        scope: NotificationScope = None,
+    ) -> Iterable[NotificationData]:
+        """
+        Yield all actual notifications for given provider. Scope is a hint to narrow the scan,
+        notifications beyond scope are actual too, so this implementation ignores it
+        """
 
         for recipient in self._get_provider_recipients(provider):
             notification = self._get_recipient_notification(recipient)
@@ -47,13 +86,18 @@ class DatabaseBackend(BaseBackend):
         self._session = None
 
     def save_recipient(self, provider: Provider, provider_id: str):
-        """Create recipient if it doesn't exist"""
+        """Create recipient if it doesn't exist, publish it to recipients channel on commit"""
 
         with Session(self._engine) as self._session:
             recipient = DatabaseRecipient(provider=provider, provider_id=provider_id)
 
             try:
                 self._session.add(recipient)
+                self._session.flush()
+
+                payload = {"provider": provider, "provider_id": provider_id}
+                events.publish(self._session, events.RECIPIENTS_CHANNEL, payload)
+
                 self._session.commit()
             except IntegrityError:
                 # skip if recipient already exists
@@ -71,19 +115,17 @@ class DatabaseBackend(BaseBackend):
         for recipient, None if there are no actual orders
         """
 
-        # select orders and full join notified states
+        # select orders and outer join notified states of target recipient
         query = self._session.query(DatabaseOrder)
         order_condition = DatabaseOrder.order_id == DatabaseNotifiedState.order_id
-        query = query.outerjoin(DatabaseNotifiedState, order_condition)
+        provider_condition = DatabaseNotifiedState.recipient_provider == recipient.provider
+        provider_id_condition = DatabaseNotifiedState.recipient_provider_id == recipient.provider_id
+        notified_condition = order_condition & provider_condition & provider_id_condition
+        query = query.outerjoin(DatabaseNotifiedState, notified_condition)
 
         # filter only records without notified state
         query = query.where(DatabaseNotifiedState.order_id.is_(None))
 
-        # join target recipient
-        provider_condition = DatabaseRecipient.provider == recipient.provider
-        provider_id_condition = DatabaseRecipient.provider_id == recipient.provider_id
-        query = query.join(DatabaseRecipient, provider_condition & provider_id_condition)
-
         # put all unsent orders in two queries - today's supplies and overdue supplies
         today_orders_query = query.where(DatabaseOrder.supply_date == datetime.now().date())
         overdue_orders_query = query.where(DatabaseOrder.supply_date < datetime.now().date())
@@ -94,28 +136,220 @@ class DatabaseBackend(BaseBackend):
         if len(today_orders) or len(overdue_orders):
             return NotificationData(recipient, today_orders, overdue_orders)
 
-    def mark_notification_sent(self, notification: NotificationData):
+    @staticmethod
+    def _get_notified_states(
+        notification: NotificationData,
+        status: NotifiedStatus = NotifiedStatus.sent,
+    ) -> list[DatabaseNotifiedState]:
         """Create DatabaseNotifiedState entries for recipient and all orders in notification"""
 
-        with Session(self._engine) as self._session:
-            notified_states = []
+        notified_states = []
+        sending_at = datetime.now() if status == NotifiedStatus.sending else None
+
+        for order in notification.today_orders + notification.overdue_orders:
+            notified_state = DatabaseNotifiedState(
+                order_id=order.order_id,
+                recipient_provider=notification.recipient.provider,
+                recipient_provider_id=notification.recipient.provider_id,
+                status=status,
+                sending_at=sending_at,
+            )
+            notified_states.append(notified_state)
+
+        return notified_states
+
+    def mark_notification_sent(self, notification: NotificationData):
+        """Save sent notified states for notification"""
+
+        # use own session, notifications may be still yielded within self._session
+        with Session(self._engine) as session:
+            session.add_all(self._get_notified_states(notification))
+            session.commit()
+
+    def mark_notifications_sending(self, notifications: list[NotificationData]):
+        """
+        Save sending notified states for all notifications with single multi-row insert.
+        States of orders, which are deleted meanwhile, are skipped
+        """
+
+        notified_states = []
+
+        for notification in notifications:
+            states = self._get_notified_states(notification, NotifiedStatus.sending)
+            notified_states.extend(state.dict() for state in states)
+
+        if not len(notified_states):
+            return
+
+        order_ids = {state["order_id"] for state in notified_states}
+
+        with Session(self._engine) as session:
+            # existing orders are locked against deletes till commit, so foreign keys hold
+            query = session.query(DatabaseOrder.order_id)
+            query = query.where(DatabaseOrder.order_id.in_(order_ids))
+            existing_ids = {order_id for order_id, in query.with_for_update(key_share=True)}
+
+            notified_states = [s for s in notified_states if s["order_id"] in existing_ids]
+
+            if len(notified_states):
+                statement = insert(DatabaseNotifiedState.__table__).on_conflict_do_nothing()
+                session.execute(statement, notified_states)
+
+            session.commit()
+
+    @staticmethod
+    def _get_keys_condition(notifications: list[NotificationData]):
+        """
+        Return condition of notified states of all orders and recipients of notifications.
+        Orders are matched by a list per recipient, as long lists of keys' tuples exceed
+        postgres' expression depth
+        """
 
-            for order in notification.today_orders + notification.overdue_orders:
-                notified_state = DatabaseNotifiedState(
-                    order_id=order.order_id,
-                    recipient_provider=notification.recipient.provider,
-                    recipient_provider_id=notification.recipient.provider_id,
-                )
-                notified_states.append(notified_state)
+        conditions = []
 
-            self._session.add_all(notified_states)
-            self._session.commit()
+        for notification in notifications:
+            orders = notification.today_orders + notification.overdue_orders
 
-    def get_notifications_for_provider(self, provider: Provider) -> Iterable[NotificationData]:
+            condition = DatabaseNotifiedState.recipient_provider == notification.recipient.provider
+            condition &= (
+                DatabaseNotifiedState.recipient_provider_id == notification.recipient.provider_id
+            )
+            condition &= DatabaseNotifiedState.order_id.in_([o.order_id for o in orders])
+            conditions.append(condition)
+
+        return or_(*conditions)
+
+    def mark_notifications_sent(
+        self,
+        sent_notifications: list[NotificationData],
+        failed_notifications: list[NotificationData],
+    ):
+        """Update sending states of sent notifications and delete failed ones in one transaction"""
+
+        with Session(self._engine) as session:
+            sending_condition = DatabaseNotifiedState.status == NotifiedStatus.sending
+
+            if len(failed_notifications):
+                condition = sending_condition & self._get_keys_condition(failed_notifications)
+
+                query = session.query(DatabaseNotifiedState).where(condition)
+                query.delete(synchronize_session=False)
+
+            if len(sent_notifications):
+                condition = sending_condition & self._get_keys_condition(sent_notifications)
+
+                query = session.query(DatabaseNotifiedState).where(condition)
+                values = {"status": NotifiedStatus.sent, "sending_at": None}
+                query.update(values, synchronize_session=False)
+
+            session.commit()
+
+    def expire_sending_notifications(self, timeout: timedelta) -> list[BaseRecipient]:
+        """Delete sending states, which are older than timeout or have no time, in one query"""
+
+        expired_at = datetime.now() - timeout
+
+        condition = DatabaseNotifiedState.status == NotifiedStatus.sending
+        condition &= or_(
+            DatabaseNotifiedState.sending_at.is_(None),
+            DatabaseNotifiedState.sending_at < expired_at,
+        )
+
+        statement = DatabaseNotifiedState.__table__.delete().where(condition)
+        statement = statement.returning(
+            DatabaseNotifiedState.recipient_provider,
+            DatabaseNotifiedState.recipient_provider_id,
+        )
+
+        with Session(self._engine) as session:
+            recipients = set(session.execute(statement).all())
+            session.commit()
+
+        return [BaseRecipient(provider=p, provider_id=i) for p, i in sorted(recipients)]
+
+    def get_notifications_for_provider(
+        self,
+        provider: Provider,
+        scope: NotificationScope = None,
+    ) -> Iterable[NotificationData]:
         """
         Yield all actual notifications for given provider.
         This method wraps parent's method with session context
         """
 
         with Session(self._engine) as self._session:
-            yield from super().get_notifications_for_provider(provider)
+            yield from super().get_notifications_for_provider(provider, scope)
+
+
+class BulkDatabaseBackend(DatabaseBackend):
+    """
+    Database backend implementation, which selects all unsent orders for all
+    provider's recipients with single query through server-side cursor
+    """
+
+    chunk_size = 1000
+
+    def get_notifications_for_provider(
+        self,
+        provider: Provider,
+        scope: NotificationScope = None,
+    ) -> Iterable[NotificationData]:
+        """
+        Yield actual notifications for given provider, grouped from single query. Partial scope
+        limits notifications to orders changed since its version and all orders of its recipients
+        """
+
+        now_date = datetime.now().date()
+
+        with Session(self._engine) as session:
+            # select every provider's recipient with every today's or overdue order
+            query = session.query(DatabaseRecipient.provider_id, DatabaseOrder)
+            query = query.join(DatabaseOrder, DatabaseOrder.supply_date <= now_date)
+            query = query.where(DatabaseRecipient.provider == provider)
+
+            # outer join notified states of the same recipient and order
+            order_condition = DatabaseOrder.order_id == DatabaseNotifiedState.order_id
+            provider_condition = DatabaseNotifiedState.recipient_provider == provider
+            provider_id_condition = (
+                DatabaseNotifiedState.recipient_provider_id == DatabaseRecipient.provider_id
+            )
+            notified_condition = order_condition & provider_condition & provider_id_condition
+            query = query.outerjoin(DatabaseNotifiedState, notified_condition)
+
+            # filter only records without notified state
+            query = query.where(DatabaseNotifiedState.order_id.is_(None))
+
+            if scope is not None and not scope.full:
+                scope_conditions = []
+
+                if scope.since_version is not None:
+                    scope_conditions.append(DatabaseOrder.version > scope.since_version)
+
+                if provider_ids := scope.get_provider_ids(provider):
+                    scope_conditions.append(DatabaseRecipient.provider_id.in_(provider_ids))
+
+                if not len(scope_conditions):
+                    return
+
+                query = query.where(or_(*scope_conditions))
+
+            # rows of every recipient must go in a row to be grouped
+            query = query.order_by(
+                DatabaseRecipient.provider_id,
+                DatabaseOrder.supply_date,
+                DatabaseOrder.order_id,
+            )
+
+            rows = query.yield_per(self.chunk_size)
+
+            for provider_id, recipient_rows in groupby(rows, key=lambda row: row[0]):
+                recipient = BaseRecipient(provider=provider, provider_id=provider_id)
+                notification = NotificationData(recipient, [], [])
+
+                for _, order in recipient_rows:
+                    if order.supply_date == now_date:
+                        notification.today_orders.append(order)
+                    else:
+                        notification.overdue_orders.append(order)
+
+                yield notification
@@ -0,0 +1,95 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Iterable
+
+from app import metrics
+from app.logger import logger
+from app.notifier.providers import BaseProvider, PartiallySentError
+from app.schemas import NotificationData
+
+
+@dataclass
+class DispatchResult:
+    """Dispatch result data class"""
+
+    sent: list[NotificationData] = field(default_factory=list)
+    failed: list[NotificationData] = field(default_factory=list)
+
+
+class Dispatcher:
+    """
+    Send notifications concurrently through thread pool. Failed notification
+    is logged and skipped without stopping the rest
+    """
+
+    def __init__(self, workers: int = 8, max_pending: int = None):
+        self._workers = workers
+        self._max_pending = max_pending or workers * 4
+
+    @staticmethod
+    def _send_notification(provider: BaseProvider, notification: NotificationData):
+        """Send notification through provider, observe its latency"""
+
+        started_at = time.perf_counter()
+
+        try:
+            provider.send_notification(notification)
+        finally:
+            duration = time.perf_counter() - started_at
+            metrics.NOTIFIER_SEND_SECONDS.observe(duration, provider=provider.name.value)
+
+    @staticmethod
+    def _handle_done(
+        provider: BaseProvider,
+        done: set[Future],
+        pending: dict[Future, NotificationData],
+        result: DispatchResult,
+    ):
+        """
+        Put done notifications into result, log failed ones. Sent part of partially
+        sent notification goes into sent ones, the rest of it into failed ones
+        """
+
+        for future in done:
+            notification = pending.pop(future)
+            error = future.exception()
+
+            if error is None:
+                result.sent.append(notification)
+                metrics.NOTIFIER_NOTIFICATIONS.inc(provider=provider.name.value, result="sent")
+            elif isinstance(error, PartiallySentError):
+                recipient_id = notification.recipient.provider_id
+                logger.error(f"Notified {recipient_id} partially: {error}", exc_info=error)
+                result.sent.append(error.sent)
+                result.failed.append(error.unsent)
+                metrics.NOTIFIER_NOTIFICATIONS.inc(provider=provider.name.value, result="partial")
+            else:
+                recipient_id = notification.recipient.provider_id
+                logger.error(f"Unable to notify {recipient_id}: {error}", exc_info=error)
+                result.failed.append(notification)
+                metrics.NOTIFIER_NOTIFICATIONS.inc(provider=provider.name.value, result="failed")
+
+    def dispatch(
+        self,
+        provider: BaseProvider,
+        notifications: Iterable[NotificationData],
+    ) -> DispatchResult:
+        """Send notifications through provider, keep bounded number of them in flight"""
+
+        result = DispatchResult()
+        pending = {}
+
+        with ThreadPoolExecutor(self._workers) as executor:
+            for notification in notifications:
+                future = executor.submit(self._send_notification, provider, notification)
+                pending[future] = notification
+
+                if len(pending) >= self._max_pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    self._handle_done(provider, done, pending, result)
+
+            done, _ = wait(pending)
+            self._handle_done(provider, done, pending, result)
+
+        return result
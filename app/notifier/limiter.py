@@ -0,0 +1,76 @@
+import time
+from threading import Lock
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Every acquire reserves a token, even a future one,
+    so concurrent callers are served in order of their calls
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self._rate = rate
+        self._capacity = capacity
+
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = Lock()
+
+    def _reserve(self) -> float:
+        """Reserve token, return delay until it becomes available"""
+
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated_at
+
+            self._tokens = min(self._capacity, self._tokens + elapsed * self._rate) - 1
+            self._updated_at = now
+
+            return max(0.0, -self._tokens / self._rate)
+
+    def acquire(self):
+        """Block until reserved token becomes available"""
+
+        delay = self._reserve()
+
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds: float):
+        """Make tokens unavailable for given seconds, next reservations wait until then"""
+
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated_at
+
+            tokens = min(self._capacity, self._tokens + elapsed * self._rate)
+            self._tokens = min(tokens, -seconds * self._rate)
+            self._updated_at = now
+
+
+class RateLimiter:
+    """Thread-safe rate limiter with global and per key limits"""
+
+    def __init__(self, rate: float, key_rate: float, capacity: float = 1, key_capacity: float = 1):
+        self._bucket = TokenBucket(rate, capacity)
+
+        self._key_rate = key_rate
+        self._key_capacity = key_capacity
+        self._key_buckets = {}
+        self._lock = Lock()
+
+    def acquire(self, key: str):
+        """Block until both key's and global limits allow one more call"""
+
+        with self._lock:
+            if key not in self._key_buckets:
+                self._key_buckets[key] = TokenBucket(self._key_rate, self._key_capacity)
+
+            key_bucket = self._key_buckets[key]
+
+        key_bucket.acquire()
+        self._bucket.acquire()
+
+    def pause(self, seconds: float):
+        """Pause global limit for given seconds, e.g. on flood control"""
+        self._bucket.pause(seconds)
@@ -1,26 +1,92 @@
+import time
+from datetime import timedelta
+from itertools import islice
+
+from app import metrics
 from app.logger import logger
 from app.notifier.backends import BaseBackend
+from app.notifier.dispatcher import Dispatcher
 from app.notifier.providers import BaseProvider
+from app.schemas import BaseRecipient, NotificationScope
 
 
 class Notifier:
     """Notify all given providers with data from given backend"""
 
-    def __init__(self, providers: list[BaseProvider], backend: BaseBackend):
+    def __init__(
+        self,
+        providers: list[BaseProvider],
+        backend: BaseBackend,
+        workers: int = 8,
+        batch_size: int = 100,
+        sending_timeout: timedelta = timedelta(minutes=10),
+    ):
         self._providers = providers
         self._backend = backend
+        self._dispatcher = Dispatcher(workers)
+        self._batch_size = batch_size
+        self._sending_timeout = sending_timeout
+
+    def send_notifications(self, scope: NotificationScope = None) -> list[BaseRecipient]:
+        """
+        Send notifications for every recipient in given scope, all by default, for every
+        provider by batches. Every batch is marked as sending before dispatch, then its sent
+        and failed notifications are marked. Notifications, which are left sending longer than
+        sending_timeout, are expired first and their recipients are put into scope to be
+        notified again. Return recipients of failed notifications
+        """
+
+        with metrics.track_tick("notifier"):
+            return self._send_notifications(scope)
+
+    def _send_notifications(self, scope: NotificationScope = None) -> list[BaseRecipient]:
+        """Send notifications within tracked tick"""
+
+        with metrics.stage("mark"):
+            expired_recipients = self._backend.expire_sending_notifications(self._sending_timeout)
+
+        if len(expired_recipients):
+            logger.warning(
+                f"Expired sending notification(s) of {len(expired_recipients)} recipient(s)"
+            )
+
+            if scope is not None and not scope.full:
+                scope.recipients.update((r.provider, r.provider_id) for r in expired_recipients)
 
-    def send_notifications(self):
-        """Send notifications for every recipient for every provider and mark them as sent"""
+        failed_recipients = []
 
         for provider in self._providers:
-            notifications = self._backend.get_notifications_for_provider(provider.name)
-            notifications_counter = 0
+            notifications = self._backend.get_notifications_for_provider(provider.name, scope)
+            notifications = iter(notifications)
+            sent_counter, failed_counter = 0, 0
+            started_at = time.monotonic()
+
+            while True:
+                with metrics.stage("query"):
+                    batch = list(islice(notifications, self._batch_size))
+
+                if not len(batch):
+                    break
+
+                with metrics.stage("mark"):
+                    self._backend.mark_notifications_sending(batch)
+
+                with metrics.stage("send"):
+                    result = self._dispatcher.dispatch(provider, batch)
+
+                with metrics.stage("mark"):
+                    self._backend.mark_notifications_sent(result.sent, result.failed)
+
+                sent_counter += len(result.sent)
+                failed_counter += len(result.failed)
+                failed_recipients.extend(notification.recipient for notification in result.failed)
 
-            for notification in notifications:
-                provider.send_notification(notification)
-                self._backend.mark_notification_sent(notification)
+            elapsed = time.monotonic() - started_at
+            throughput = sent_counter / elapsed if elapsed else 0
 
-                notifications_counter += 1
+            logger.info(
+                f"Sent {sent_counter} actual notification(s) via {provider.name}, "
+                f"{failed_counter} failed, {elapsed:.2f}s ({throughput:.1f}/s)"
+            )
 
-            logger.info(f"Sent {notifications_counter} actual notification(s) via {provider.name}")
+        return failed_recipients
@@ -1,12 +1,30 @@
+import dataclasses
+import time
 from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING
 
-import telebot
-from telebot.types import Message
+import requests
 
+from app.logger import logger
 from app.notifier.backends import BaseBackend
+from app.notifier.limiter import RateLimiter
 from app.notifier.serializers import TelegramNotificationSerializer
 from app.schemas import Provider, NotificationData
 
+# telebot is imported by telegram clients on creation, it is slow to import
+if TYPE_CHECKING:
+    from telebot.types import Message
+
+
+class PartiallySentError(Exception):
+    """Notification is sent partially: some of its messages are delivered, the rest failed"""
+
+    def __init__(self, sent: NotificationData, unsent: NotificationData, error: Exception):
+        super().__init__(f"{error} (some messages are sent already)")
+        self.sent = sent
+        self.unsent = unsent
+        self.error = error
+
 
 class BaseProvider(ABC):
     """Abstract notifications' provider class"""
@@ -19,19 +37,109 @@ class BaseProvider(ABC):
 
 
 class TelegramProvider(BaseProvider):
-    """Telegram provider implementation"""
+    """
+    Telegram provider implementation. Thread-safe, respects telegram's global
+    and per chat limits, retries messages on flood control and temporary errors
+    """
 
     name: Provider = Provider.telegram
 
+    # telegram bots api limits, messages per second
+    messages_rate = 30
+    chat_messages_rate = 1
+
+    max_retries = 3
+    retry_delay = 1
+
     def __init__(self, bot_token: str):
         """Connect to telegram bots api with bot_token through telebot"""
+
+        import telebot
+
         self._bot = telebot.TeleBot(bot_token)
+        self._limiter = RateLimiter(self.messages_rate, self.chat_messages_rate)
+
+    def _get_retry_after(self, error: Exception) -> float | None:
+        """Return flood control's retry_after of error, None if error is not flood control"""
+
+        from telebot.apihelper import ApiTelegramException
+
+        if isinstance(error, ApiTelegramException) and error.error_code == 429:
+            return error.result_json.get("parameters", {}).get("retry_after", self.retry_delay)
+
+    def _get_retry_delay(self, error: Exception, attempt: int) -> float | None:
+        """Return delay before next attempt, None if error is not temporary"""
+
+        from telebot.apihelper import ApiHTTPException, ApiTelegramException
+
+        if isinstance(error, ApiTelegramException):
+            if error.error_code == 429:
+                return self._get_retry_after(error)
+            if error.error_code >= 500:
+                return self.retry_delay * 2**attempt
+        elif isinstance(error, ApiHTTPException):
+            if error.result.status_code >= 500:
+                return self.retry_delay * 2**attempt
+        elif isinstance(error, requests.RequestException):
+            return self.retry_delay * 2**attempt
+
+    def _send_message(self, chat_id: str, message: str):
+        """Send single message to chat within limits, retry it on temporary errors"""
+
+        for attempt in range(self.max_retries + 1):
+            self._limiter.acquire(chat_id)
+
+            try:
+                self._bot.send_message(chat_id, message, parse_mode="HTML")
+                return
+            except Exception as e:
+                delay = self._get_retry_delay(e, attempt)
+
+                if delay is None or attempt == self.max_retries:
+                    raise
+
+                logger.warning(f"Unable to send message to {chat_id} ({e}), retry in {delay}s")
+
+                # flood control is global, so every worker waits before its next message
+                if self._get_retry_after(e) is not None:
+                    self._limiter.pause(delay)
+                else:
+                    time.sleep(delay)
+
+    @staticmethod
+    def _filter_orders(notification: NotificationData, order_ids: set[int]) -> NotificationData:
+        """Return copy of notification with given orders only"""
+
+        return dataclasses.replace(
+            notification,
+            today_orders=[o for o in notification.today_orders if o.order_id in order_ids],
+            overdue_orders=[o for o in notification.overdue_orders if o.order_id in order_ids],
+        )
 
     def send_notification(self, notification: NotificationData):
-        """Send serialized notification to recipient"""
+        """
+        Send serialized notification to recipient, split into several messages if needed.
+        Raise PartiallySentError with sent and unsent orders if some messages are delivered
+        """
+
+        sent_ids = set()
+
+        for message, order_ids in TelegramNotificationSerializer(notification).serialize_parts():
+            try:
+                self._send_message(notification.recipient.provider_id, message)
+            except Exception as e:
+                if not len(sent_ids):
+                    raise
 
-        message = TelegramNotificationSerializer(notification).serialize()
-        self._bot.send_message(notification.recipient.provider_id, message, parse_mode="HTML")
+                all_ids = {
+                    o.order_id for o in notification.today_orders + notification.overdue_orders
+                }
+                sent = self._filter_orders(notification, sent_ids)
+                unsent = self._filter_orders(notification, all_ids - sent_ids)
+
+                raise PartiallySentError(sent, unsent, e) from e
+
+            sent_ids.update(order_ids)
 
 
 class BasePollingClient(ABC):
@@ -59,12 +167,14 @@ class TelegramPollingClient(BasePollingClient):
     def __init__(self, backend: BaseBackend, bot_token: str):
         """Connect to telegram bots api with bot_token and register _save_recipient as handler"""
 
+        import telebot
+
         super().__init__(backend)
 
         self._bot = telebot.TeleBot(bot_token)
         self._bot.register_message_handler(self._save_recipient)
 
-    def _save_recipient(self, message: Message):
+    def _save_recipient(self, message: "Message"):
         """Save any contacted recipient to backend"""
         self.save_recipient(str(message.chat.id))
 
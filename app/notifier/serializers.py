@@ -1,6 +1,8 @@
 from abc import ABC, abstractmethod
+from datetime import date
+from functools import lru_cache
 
-from app.schemas import NotificationData, BaseOrder
+from app.schemas import NotificationData
 
 
 class BaseNotificationSerializer(ABC):
@@ -15,37 +17,113 @@ class BaseNotificationSerializer(ABC):
 
 
 class TelegramNotificationSerializer(BaseNotificationSerializer):
-    """Telegram notification serializer implementation"""
+    """
+    Telegram notification serializer implementation. Messages are rendered once
+    for every distinct set of orders and split to fit telegram's message length limit
+    """
 
-    def _order2string(self, order: BaseOrder, include_date: bool = False):
+    max_message_length = 4096
+
+    today_header = "Сегодня ожидают поставки следующие заказы:"
+    overdue_header = "У следующих заказов истек срок поставки:"
+
+    @staticmethod
+    @lru_cache(maxsize=100_000)
+    def _order2string(order_id: int, supply_date: date, include_date: bool = False) -> str:
         """Convert order to string"""
 
-        order_str = f"<code>{order.order_id}</code>"
+        order_str = f"<code>{order_id}</code>"
 
         if include_date:
-            date_str = order.supply_date.strftime("%d.%m.%Y")
+            date_str = supply_date.strftime("%d.%m.%Y")
             order_str = f"{order_str} ({date_str})"
 
         return order_str
 
-    def serialize(self) -> str:
-        """Serialize NotificationData in representative telegram message"""
+    @staticmethod
+    def _join(*lines: str) -> str:
+        """Join non-empty lines"""
+        return "\n".join(line for line in lines if line)
+
+    @classmethod
+    def _split_sections(
+        cls,
+        sections: list[tuple[str, list[tuple[int, str]]]],
+    ) -> list[tuple[str, tuple[int, ...]]]:
+        """
+        Join sections' headers and comma separated orders' strings into messages,
+        start next message with section's header when current one exceeds length limit.
+        Every message goes with ids of its orders
+        """
+
+        messages = []
+        message, message_ids = "", []
+
+        for header, orders_strings in sections:
+            line, line_ids = "", []
+
+            for order_id, order_str in orders_strings:
+                extended_line = f"{line}, {order_str}" if line else order_str
+
+                if len(cls._join(message, header, extended_line)) <= cls.max_message_length:
+                    line = extended_line
+                    line_ids.append(order_id)
+                    continue
+
+                if line:
+                    messages.append((cls._join(message, header, line), (*message_ids, *line_ids)))
+                elif message:
+                    messages.append((message, tuple(message_ids)))
 
-        message_lines = []
+                message, message_ids = "", []
+                line, line_ids = order_str, [order_id]
 
-        if len(self._notification.today_orders):
-            message_lines.append("Сегодня ожидают поставки следующие заказы:")
+            message = cls._join(message, header, line)
+            message_ids.extend(line_ids)
 
-            orders_strings = [self._order2string(o) for o in self._notification.today_orders]
-            message_lines.append(", ".join(orders_strings))
+        if message:
+            messages.append((message, tuple(message_ids)))
 
-        if len(self._notification.overdue_orders):
-            message_lines.append("У следующих заказов истек срок поставки:")
+        return messages
 
-            orders = self._notification.overdue_orders.copy()
-            orders.sort(key=lambda o: o.supply_date)
+    @classmethod
+    @lru_cache(maxsize=128)
+    def _render(
+        cls,
+        today_orders: tuple[tuple[int, date], ...],
+        overdue_orders: tuple[tuple[int, date], ...],
+    ) -> tuple[tuple[str, tuple[int, ...]], ...]:
+        """Render messages with their orders' ids for given orders' ids and supply dates"""
 
-            orders_strings = [self._order2string(o, include_date=True) for o in orders]
-            message_lines.append(", ".join(orders_strings))
+        sections = []
 
-        return "\n".join(message_lines)
+        if len(today_orders):
+            orders_strings = [(o[0], cls._order2string(*o)) for o in today_orders]
+            sections.append((cls.today_header, orders_strings))
+
+        if len(overdue_orders):
+            orders_strings = [
+                (o[0], cls._order2string(*o, include_date=True)) for o in overdue_orders
+            ]
+            sections.append((cls.overdue_header, orders_strings))
+
+        return tuple(cls._split_sections(sections))
+
+    def serialize_parts(self) -> list[tuple[str, tuple[int, ...]]]:
+        """Serialize NotificationData in telegram messages with ids of their orders"""
+
+        today_orders = tuple((o.order_id, o.supply_date) for o in self._notification.today_orders)
+
+        overdue_orders = self._notification.overdue_orders.copy()
+        overdue_orders.sort(key=lambda o: o.supply_date)
+        overdue_orders = tuple((o.order_id, o.supply_date) for o in overdue_orders)
+
+        return list(self._render(today_orders, overdue_orders))
+
+    def serialize_messages(self) -> list[str]:
+        """Serialize NotificationData in representative telegram messages"""
+        return [message for message, _ in self.serialize_parts()]
+
+    def serialize(self) -> str:
+        """Serialize NotificationData in representative telegram message"""
+        return "\n".join(self.serialize_messages())
@@ -0,0 +1,87 @@
+import json
+import time
+from datetime import datetime, timedelta
+from queue import Empty
+
+from app import events
+from app.logger import logger
+from app.schemas import BaseRecipient, NotificationScope
+
+
+class NotificationTrigger:
+    """
+    Collect orders and recipients events into notifications scope. Refreshed orders put
+    their dataset versions into scope, new recipients put themselves. Full scope is due at
+    start, at date rollover and when events could be missed. Failed recipients are retried
+    after retry_delay
+    """
+
+    retry_delay = timedelta(seconds=30)
+
+    def __init__(self, listener: events.Listener):
+        self._queue = listener.subscribe()
+        self._date = datetime.now().date()
+        self._full_scope_due = True
+        self._retry_recipients = set()
+        self._retry_at = None
+
+    def _collect_event(self, scope: NotificationScope, channel: str, payload: str | None):
+        """Put single event into scope"""
+
+        if payload is None:
+            logger.info(f"Events of {channel} channel could be missed, full scope is due")
+            self._full_scope_due = True
+        elif channel == events.ORDERS_CHANNEL:
+            # orders changed in this version have exactly this version
+            version = json.loads(payload)["version"] - 1
+
+            if scope.since_version is None or version < scope.since_version:
+                scope.since_version = version
+        elif channel == events.RECIPIENTS_CHANNEL:
+            recipient = json.loads(payload)
+            scope.recipients.add((recipient["provider"], recipient["provider_id"]))
+
+    def get_scope(self) -> NotificationScope:
+        """Return scope of all events since last call, empty scope costs no database queries"""
+
+        scope = NotificationScope()
+
+        while True:
+            try:
+                channel, payload = self._queue.get_nowait()
+            except Empty:
+                break
+
+            self._collect_event(scope, channel, payload)
+
+        # today's orders become actual at midnight
+        today = datetime.now().date()
+
+        if today != self._date:
+            self._date = today
+            self._full_scope_due = True
+
+        if self._retry_at is not None and time.monotonic() >= self._retry_at:
+            scope.recipients |= self._retry_recipients
+            self._retry_recipients, self._retry_at = set(), None
+
+        if self._full_scope_due:
+            self._full_scope_due = False
+            return NotificationScope(full=True)
+
+        return scope
+
+    def reset(self):
+        """Make full scope due, as events of failed run are lost"""
+        self._full_scope_due = True
+
+    def retry(self, recipients: list[BaseRecipient]):
+        """Put given recipients into scope after retry delay"""
+
+        if not len(recipients):
+            return
+
+        self._retry_recipients.update((r.provider, r.provider_id) for r in recipients)
+
+        if self._retry_at is None:
+            self._retry_at = time.monotonic() + self.retry_delay.total_seconds()
@@ -1,48 +1,286 @@
 from abc import ABC, abstractmethod
+from collections import Counter
 from datetime import datetime
+from decimal import Decimal
+from typing import Iterable, Optional
 
+from sqlalchemy import (
+    Column,
+    MetaData,
+    Numeric,
+    Table,
+    and_,
+    delete,
+    exists,
+    func,
+    literal,
+    select,
+    union,
+    update,
+)
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.engine import Engine
 from sqlmodel import Session
 
-from app.database import DatabaseOrder, DatabaseNotifiedState
-from app.schemas import BaseOrder
+from app import events
+from app.database import (
+    DEFAULT_SOURCE,
+    ORDERS_DATASET,
+    DatabaseAppliedRate,
+    DatabaseOrder,
+    DatabaseNotifiedState,
+    DatabaseOrderTombstone,
+    DatabaseDatasetVersion,
+    DatabaseOrdersDailyTotal,
+)
+from app.refresher import cbrf
+from app.schemas import BaseOrder, Money, OrdersDiff
 
 
 class BaseBackend(ABC):
-    """Abstract backend"""
+    """
+    Abstract backend. Orders are partitioned by their sources, every source
+    is refreshed independently and never touches orders of the others. Order ids
+    are unique across sources, so order of another source is rejected, not moved
+    """
 
     @abstractmethod
-    def _clear_unlisted_orders(self, listed_ids: list[int]):
-        """Must clear all unlisted orders from backend"""
+    def _clear_unlisted_orders(self, listed_ids: list[int], source: str):
+        """Must clear all unlisted orders of source from backend"""
 
     @abstractmethod
-    def _refresh_order(self, order: BaseOrder):
-        """Must refresh single order"""
+    def _delete_orders(self, order_ids: list[int], source: str):
+        """Must delete orders of source with given ids from backend"""
 
-    def refresh_orders(self, orders: list[BaseOrder]):
-        """Process all orders, then clear unlisted at this backend"""
+    @abstractmethod
+    def _refresh_order(self, order: BaseOrder, source: str) -> bool:
+        """Must refresh single order of source, or return False if it belongs to another one"""
+
+    @abstractmethod
+    def _save_applied_rate(self, usdrub_rate: Decimal, source: str):
+        """Must save rate, which source's orders are priced with"""
+
+    @abstractmethod
+    def get_fingerprints(self, source: str = DEFAULT_SOURCE) -> dict[int, tuple]:
+        """Must return fingerprints of all source's orders at this backend by their ids"""
+
+    @abstractmethod
+    def get_applied_rate(self, source: str = DEFAULT_SOURCE) -> Optional[Decimal]:
+        """Must return rate, which source's orders are priced with, or None if it is unknown"""
+
+    @abstractmethod
+    def reprice_orders(self, usdrub_rate: Decimal, source: str = DEFAULT_SOURCE) -> int:
+        """
+        Must recompute price_rub of all source's orders with given rate, save it as applied
+        and return count of repriced orders
+        """
+
+    def refresh_orders(self, orders: list[BaseOrder], source: str = DEFAULT_SOURCE) -> list[int]:
+        """
+        Process all orders of source, then clear its unlisted orders at this backend.
+        Return ids of rejected orders, which belong to other sources
+        """
 
         listed_ids = []
+        rejected_ids = []
 
         for order in orders:
-            self._refresh_order(order)
+            if not self._refresh_order(order, source):
+                rejected_ids.append(order.order_id)
+
             listed_ids.append(order.order_id)
 
-        self._clear_unlisted_orders(listed_ids)
+        self._clear_unlisted_orders(listed_ids, source)
+        return rejected_ids
+
+    def _apply_orders_diff(self, diff: OrdersDiff, source: str) -> list[int]:
+        """
+        Refresh inserted and updated orders, then delete removed at this backend.
+        Return ids of rejected orders, which belong to other sources
+        """
+
+        rejected_ids = []
+
+        for order in diff.inserted + diff.updated:
+            if not self._refresh_order(order, source):
+                rejected_ids.append(order.order_id)
+
+        if len(diff.deleted_ids):
+            self._delete_orders(diff.deleted_ids, source)
+
+        return rejected_ids
+
+    def apply_orders_diffs(
+        self,
+        diffs: Iterable[OrdersDiff],
+        source: str = DEFAULT_SOURCE,
+        usdrub_rate: Decimal = None,
+    ) -> list[int]:
+        """
+        Apply every given orders diff of source at this backend, then save given rate
+        of diffs' prices as applied one. Return ids of rejected orders, which belong
+        to other sources
+        """
+
+        rejected_ids = []
+
+        for diff in diffs:
+            if diff:
+                rejected_ids.extend(self._apply_orders_diff(diff, source))
+
+        if usdrub_rate is not None:
+            self._save_applied_rate(usdrub_rate, source)
+
+        return rejected_ids
 
 
 class DatabaseBackend(BaseBackend):
-    """Database backend implementation"""
+    """
+    Database backend implementation. Every transaction with changes increases orders
+    dataset version, changed orders and tombstones of deleted ones get that version.
+    Daily totals of changed supply dates are recomputed and changes summary is published
+    to orders channel on commit
+    """
 
     def __init__(self, engine: Engine):
         self._engine = engine
         self._session = None
+        self._version = None
+        self._changes = Counter()
+        self._changed_dates = set()
+
+    def _start_transaction(self):
+        """Reset state of previous transaction"""
+
+        self._version = None
+        self._changes = Counter()
+        self._changed_dates = set()
+
+    def _refresh_daily_totals(self):
+        """Recompute daily totals of changed supply dates from orders"""
+
+        supply_dates = list(self._changed_dates)
+        table = DatabaseOrdersDailyTotal.__table__
+
+        daily_totals = select(
+            DatabaseOrder.supply_date,
+            func.count(),
+            func.sum(DatabaseOrder.price_usd),
+            func.sum(DatabaseOrder.price_rub),
+        )
+        daily_totals = daily_totals.where(DatabaseOrder.supply_date.in_(supply_dates))
+        daily_totals = daily_totals.group_by(DatabaseOrder.supply_date)
+
+        columns = ["supply_date", "orders_count", "price_usd", "price_rub"]
+
+        self._session.flush()
+        self._session.execute(table.delete().where(table.c.supply_date.in_(supply_dates)))
+        self._session.execute(insert(table).from_select(columns, daily_totals))
+
+    def _commit(self):
+        """
+        Refresh daily totals and publish changes summary if anything changed,
+        then commit session
+        """
 
-    def _clear_unlisted_orders(self, listed_ids: list[int]):
-        """Clear unlisted orders from database"""
+        if len(self._changed_dates):
+            self._refresh_daily_totals()
 
-        condition = DatabaseOrder.order_id.not_in(listed_ids)
-        self._session.query(DatabaseOrder).where(condition).delete()
+        if self._version is not None:
+            events.publish(
+                self._session,
+                events.ORDERS_CHANNEL,
+                {
+                    "version": self._version,
+                    "upserted": self._changes["upserted"],
+                    "deleted": self._changes["deleted"],
+                },
+            )
+
+        self._session.commit()
+
+    def _get_version(self) -> int:
+        """Increase orders dataset version once per transaction and return it"""
+
+        if self._version is None:
+            table = DatabaseDatasetVersion.__table__
+
+            statement = insert(table).values(name=ORDERS_DATASET, version=1)
+            statement = statement.on_conflict_do_update(
+                index_elements=[table.c.name],
+                set_={"version": table.c.version + 1},
+            )
+
+            self._version = self._session.execute(statement.returning(table.c.version)).scalar()
+
+        return self._version
+
+    def _save_tombstones(self, order_ids: list[int]):
+        """Save tombstones of deleted orders with current version"""
+
+        if not len(order_ids):
+            return
+
+        version = self._get_version()
+
+        deleted_at = datetime.now()
+
+        statement = insert(DatabaseOrderTombstone.__table__)
+        statement = statement.on_conflict_do_update(
+            index_elements=[DatabaseOrderTombstone.order_id],
+            set_={"version": statement.excluded.version, "deleted_at": deleted_at},
+        )
+
+        tombstones = [
+            {"order_id": i, "version": version, "deleted_at": deleted_at} for i in order_ids
+        ]
+        self._session.execute(statement, tombstones)
+        self._changes.update(deleted=len(order_ids))
+
+    def _save_applied_rate(self, usdrub_rate: Decimal, source: str):
+        """Save rate, which source's orders are priced with"""
+
+        statement = insert(DatabaseAppliedRate.__table__)
+        statement = statement.values(source=source, currency_id=cbrf.USD_ID, value=usdrub_rate)
+        statement = statement.on_conflict_do_update(
+            index_elements=[DatabaseAppliedRate.source, DatabaseAppliedRate.currency_id],
+            set_={"value": statement.excluded.value},
+        )
+
+        self._session.execute(statement)
+
+    def _clear_tombstones(self, order_ids: list[int]):
+        """Clear tombstones of inserted again orders"""
+
+        query = self._session.query(DatabaseOrderTombstone)
+        query = query.where(DatabaseOrderTombstone.order_id.in_(order_ids))
+        query.delete(synchronize_session=False)
+
+    def _clear_unlisted_orders(self, listed_ids: list[int], source: str):
+        """Clear unlisted orders of source from database"""
+
+        query = self._session.query(DatabaseOrder.order_id)
+        query = query.where(DatabaseOrder.source == source)
+        query = query.where(DatabaseOrder.order_id.not_in(listed_ids))
+        unlisted_ids = [i for i, in query]
+
+        if len(unlisted_ids):
+            self._delete_orders(unlisted_ids, source)
+
+    def _delete_orders(self, order_ids: list[int], source: str):
+        """
+        Delete orders of source with given ids from database, save their tombstones.
+        Orders, which have moved to another source meanwhile, are kept
+        """
+
+        statement = delete(DatabaseOrder.__table__)
+        statement = statement.where(DatabaseOrder.order_id.in_(order_ids))
+        statement = statement.where(DatabaseOrder.source == source)
+        statement = statement.returning(DatabaseOrder.order_id, DatabaseOrder.supply_date)
+        deleted_orders = self._session.execute(statement).all()
+
+        self._changed_dates.update(supply_date for _, supply_date in deleted_orders)
+        self._save_tombstones([order_id for order_id, _ in deleted_orders])
 
     def _clear_notified_states(self, order: DatabaseOrder):
         """Clear all notified states for order"""
@@ -50,14 +288,24 @@ class DatabaseBackend(BaseBackend):
         condition = DatabaseNotifiedState.order_id == order.order_id
         self._session.query(DatabaseNotifiedState).where(condition).delete()
 
-    def _refresh_order(self, order: BaseOrder):
-        """Update order if it exists in database or create it"""
+    def _refresh_order(self, order: BaseOrder, source: str) -> bool:
+        """
+        Update order of source if it exists in database or create it.
+        Order of another source is not changed, return False for it
+        """
 
         db_order = self._session.query(DatabaseOrder).get(order.order_id)
 
+        if db_order is not None and db_order.source != source:
+            return False
+
         if db_order is None:
-            db_order = DatabaseOrder(**order.dict())
+            db_order = DatabaseOrder(**order.dict(), source=source)
+            previous_date = db_order.supply_date
+            self._clear_tombstones([order.order_id])
         else:
+            previous_date = db_order.supply_date
+
             # clear all notified states if supply_date changed
             # and order has not been supplied before today
             if order.supply_date != db_order.supply_date:
@@ -67,14 +315,292 @@ class DatabaseBackend(BaseBackend):
             for field, value in order.dict().items():
                 setattr(db_order, field, value)
 
+        # full sync passes unchanged orders too, they keep their version
+        if db_order not in self._session or self._session.is_modified(db_order):
+            db_order.version = self._get_version()
+            self._changes.update(upserted=1)
+            self._changed_dates.update((previous_date, db_order.supply_date))
+
         self._session.add(db_order)
+        return True
 
-    def refresh_orders(self, orders: list[BaseOrder]):
+    def refresh_orders(self, orders: list[BaseOrder], source: str = DEFAULT_SOURCE) -> list[int]:
         """
-        Process all orders, then clear unlisted at this backend. This method wraps
+        Process all orders of source, then clear its unlisted orders. This method wraps
         parent's method with session context and commit session at the end
         """
 
         with Session(self._engine) as self._session:
-            super().refresh_orders(orders)
-            self._session.commit()
+            self._start_transaction()
+            rejected_ids = super().refresh_orders(orders, source)
+            self._commit()
+
+        return rejected_ids
+
+    def get_fingerprints(self, source: str = DEFAULT_SOURCE) -> dict[int, tuple]:
+        """Return fingerprints of all source's database orders by their ids"""
+
+        columns = (
+            DatabaseOrder.order_id,
+            DatabaseOrder.table_id,
+            DatabaseOrder.price_usd,
+            DatabaseOrder.supply_date,
+            DatabaseOrder.price_rub,
+        )
+
+        with Session(self._engine) as session:
+            rows = session.execute(select(*columns).where(DatabaseOrder.source == source))
+            return {order_id: tuple(fingerprint) for order_id, *fingerprint in rows}
+
+    def get_applied_rate(self, source: str = DEFAULT_SOURCE) -> Optional[Decimal]:
+        """Return rate, which source's orders are priced with, or None if it is unknown"""
+
+        statement = select(DatabaseAppliedRate.value)
+        statement = statement.where(DatabaseAppliedRate.source == source)
+        statement = statement.where(DatabaseAppliedRate.currency_id == cbrf.USD_ID)
+
+        with Session(self._engine) as session:
+            return session.execute(statement).scalar()
+
+    def reprice_orders(self, usdrub_rate: Decimal, source: str = DEFAULT_SOURCE) -> int:
+        """
+        Recompute price_rub of source's orders with given rate by single statement, rounded
+        half away from zero as Money does. Repriced orders get new version and totals of
+        their supply dates are recomputed. Return count of repriced orders
+        """
+
+        # postgres rounds numeric half away from zero, as ROUND_HALF_UP does
+        scale = -Money.quant.as_tuple().exponent
+        price_rub = func.round(DatabaseOrder.price_usd * literal(usdrub_rate, Numeric), scale)
+        source_condition = DatabaseOrder.source == source
+        price_condition = DatabaseOrder.price_rub.is_distinct_from(price_rub)
+        changed = and_(source_condition, price_condition)
+
+        with Session(self._engine) as self._session:
+            self._start_transaction()
+            repriced_count = 0
+
+            # version must not increase, if prices are the same
+            if self._session.execute(select(exists().where(changed))).scalar():
+                statement = update(DatabaseOrder.__table__).where(changed)
+                statement = statement.values(price_rub=price_rub, version=self._get_version())
+                repriced_count = self._session.execute(statement).rowcount
+
+                changed_dates = select(DatabaseOrder.supply_date).distinct()
+                changed_dates = changed_dates.where(DatabaseOrder.version == self._version)
+                self._changed_dates.update(self._session.execute(changed_dates).scalars())
+                self._changes.update(upserted=repriced_count)
+
+            self._save_applied_rate(usdrub_rate, source)
+            self._commit()
+
+        return repriced_count
+
+    def _apply_orders_diff(self, diff: OrdersDiff, source: str) -> list[int]:
+        """
+        Apply orders diff at this backend. This method wraps parent's method,
+        flushes and forgets applied orders to keep session size bounded
+        """
+
+        rejected_ids = super()._apply_orders_diff(diff, source)
+
+        self._session.flush()
+        self._session.expunge_all()
+
+        return rejected_ids
+
+    def apply_orders_diffs(
+        self,
+        diffs: Iterable[OrdersDiff],
+        source: str = DEFAULT_SOURCE,
+        usdrub_rate: Decimal = None,
+    ) -> list[int]:
+        """
+        Apply every given orders diff of source at this backend in single transaction. This
+        method wraps parent's method with session context and commit session at the end
+        """
+
+        # session connects lazily, so nothing is sent to database for empty diffs without rate
+        with Session(self._engine) as self._session:
+            self._start_transaction()
+            rejected_ids = super().apply_orders_diffs(diffs, source, usdrub_rate)
+            self._commit()
+
+        return rejected_ids
+
+
+class BulkDatabaseBackend(DatabaseBackend):
+    """
+    Database backend implementation, which loads all orders into temporary staging
+    table and syncs them with a few set-based statements. Postgres only
+    """
+
+    staging_table = Table(
+        "orders_staging",
+        MetaData(),
+        *(Column(name, DatabaseOrder.__table__.c[name].type) for name in BaseOrder.__fields__),
+        prefixes=["TEMPORARY"],
+        postgresql_on_commit="DROP",
+    )
+
+    def __init__(self, engine: Engine):
+        super().__init__(engine)
+        self._staging_created = False
+
+    def _start_transaction(self):
+        """Reset state of previous transaction, staging table is dropped on its commit"""
+
+        super()._start_transaction()
+        self._staging_created = False
+
+    def _stage_orders(self, orders: list[BaseOrder]):
+        """
+        Load given orders into staging table with multi-row inserts. Staging table is
+        created once per transaction and cleared before every next load
+        """
+
+        if self._staging_created:
+            self._session.execute(self.staging_table.delete())
+        else:
+            self.staging_table.create(self._session.connection())
+            self._staging_created = True
+
+        # keep only last occurrence of every order, as per-row path does
+        staged_orders = {order.order_id: order.dict() for order in orders}
+
+        if len(staged_orders):
+            self._session.execute(self.staging_table.insert(), list(staged_orders.values()))
+
+    def _reject_foreign_staged_orders(self, source: str) -> list[int]:
+        """Remove staged orders, which belong to other sources, return their ids"""
+
+        staging = self.staging_table.c
+
+        statement = delete(self.staging_table)
+        statement = statement.where(staging.order_id == DatabaseOrder.order_id)
+        statement = statement.where(DatabaseOrder.source != source)
+        statement = statement.returning(staging.order_id)
+
+        return list(self._session.execute(statement).scalars())
+
+    def _clear_moved_notified_states(self):
+        """
+        Clear notified states for staged orders with changed supply_date,
+        which have not been supplied before today
+        """
+
+        staging = self.staging_table.c
+
+        moved_ids = select(DatabaseOrder.order_id).join(
+            self.staging_table, staging.order_id == DatabaseOrder.order_id
+        )
+        moved_ids = moved_ids.where(staging.supply_date != DatabaseOrder.supply_date)
+        moved_ids = moved_ids.where(DatabaseOrder.supply_date >= datetime.now().date())
+
+        query = self._session.query(DatabaseNotifiedState)
+        query.where(DatabaseNotifiedState.order_id.in_(moved_ids)).delete(synchronize_session=False)
+
+    def _upsert_staged_orders(self, source: str):
+        """
+        Insert new and update existing orders from staging table with given source
+        and current version. Staged orders of other sources must be rejected before
+        """
+
+        staging = self.staging_table.c
+
+        # both stored and staged supply dates of staged orders change their totals
+        stored_dates = select(DatabaseOrder.supply_date).join(
+            self.staging_table, staging.order_id == DatabaseOrder.order_id
+        )
+        supply_dates = union(select(staging.supply_date), stored_dates)
+        self._changed_dates.update(self._session.execute(supply_dates).scalars())
+
+        columns = [column.name for column in self.staging_table.columns] + ["source", "version"]
+        updated_columns = [column for column in columns if column != "order_id"]
+        staged_orders = select(self.staging_table, literal(source), literal(self._get_version()))
+
+        statement = insert(DatabaseOrder.__table__)
+        statement = statement.from_select(columns, staged_orders)
+        statement = statement.on_conflict_do_update(
+            index_elements=[DatabaseOrder.order_id],
+            set_={column: statement.excluded[column] for column in updated_columns},
+        )
+
+        result = self._session.execute(statement)
+        self._changes.update(upserted=result.rowcount)
+
+        staged_ids = select(staging.order_id)
+        query = self._session.query(DatabaseOrderTombstone)
+        query.where(DatabaseOrderTombstone.order_id.in_(staged_ids)).delete(
+            synchronize_session=False
+        )
+
+    def _clear_unstaged_orders(self, source: str):
+        """Clear orders of source, which are missing in staging table, save their tombstones"""
+
+        staged = exists().where(self.staging_table.c.order_id == DatabaseOrder.order_id)
+
+        statement = delete(DatabaseOrder.__table__).where(DatabaseOrder.source == source)
+        statement = statement.where(~staged)
+        statement = statement.returning(DatabaseOrder.order_id, DatabaseOrder.supply_date)
+        deleted_orders = self._session.execute(statement).all()
+
+        self._changed_dates.update(supply_date for _, supply_date in deleted_orders)
+        self._save_tombstones([order_id for order_id, _ in deleted_orders])
+
+    def refresh_orders(self, orders: list[BaseOrder], source: str = DEFAULT_SOURCE) -> list[int]:
+        """Stage all orders of source, then apply them to database in single transaction"""
+
+        with Session(self._engine) as self._session:
+            self._start_transaction()
+            self._stage_orders(orders)
+            rejected_ids = self._reject_foreign_staged_orders(source)
+
+            # notified states must be cleared before upsert overwrites old supply dates
+            self._clear_moved_notified_states()
+            self._upsert_staged_orders(source)
+            self._clear_unstaged_orders(source)
+
+            self._commit()
+
+        return rejected_ids
+
+    def _apply_orders_diff(self, diff: OrdersDiff, source: str) -> list[int]:
+        """Stage inserted and updated orders, apply them, then delete removed orders"""
+
+        rejected_ids = []
+
+        if len(diff.inserted) or len(diff.updated):
+            self._stage_orders(diff.inserted + diff.updated)
+            rejected_ids = self._reject_foreign_staged_orders(source)
+
+            self._clear_moved_notified_states()
+            self._upsert_staged_orders(source)
+
+        if len(diff.deleted_ids):
+            self._delete_orders(diff.deleted_ids, source)
+
+        return rejected_ids
+
+    def apply_orders_diffs(
+        self,
+        diffs: Iterable[OrdersDiff],
+        source: str = DEFAULT_SOURCE,
+        usdrub_rate: Decimal = None,
+    ) -> list[int]:
+        """Apply every given orders diff of source and save given rate in single transaction"""
+
+        rejected_ids = []
+
+        with Session(self._engine) as self._session:
+            self._start_transaction()
+
+            for diff in diffs:
+                rejected_ids.extend(self._apply_orders_diff(diff, source))
+
+            if usdrub_rate is not None:
+                self._save_applied_rate(usdrub_rate, source)
+
+            self._commit()
+
+        return rejected_ids
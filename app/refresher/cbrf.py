@@ -1,23 +1,46 @@
-from datetime import datetime
+from datetime import datetime, date
 from decimal import Decimal
-from functools import lru_cache
 from xml.etree import ElementTree
 
 import requests
 
 USD_ID = "R01235"
 
+BASE_URL = "https://www.cbr.ru/scripts"
+TIMEOUT = 10
 
-# use lru_cache to avoid spamming
-@lru_cache(maxsize=1)
-def get_usdrub_rate(date: datetime.date) -> Decimal:
-    """Get cbrf's USDRUB rate for given date"""
 
-    params = {"date_req": date.strftime("%d/%m/%Y")}
-    response = requests.get("https://www.cbr.ru/scripts/XML_daily.asp", params)
+def _parse_value(element: ElementTree.Element) -> Decimal:
+    """Parse rate value for single nominal unit from Valute or Record element"""
+
+    value = Decimal(element.find("Value").text.replace(",", "."))
+    nominal = Decimal(element.find("Nominal").text)
+
+    return value / nominal
+
+
+def get_rates(
+    currency_id: str,
+    first_date: date,
+    last_date: date,
+    base_url: str = BASE_URL,
+    timeout: float = TIMEOUT,
+) -> dict[date, Decimal]:
+    """Get cbrf's rates for given currency, which were set within given dates range"""
+
+    params = {
+        "date_req1": first_date.strftime("%d/%m/%Y"),
+        "date_req2": last_date.strftime("%d/%m/%Y"),
+        "VAL_NM_RQ": currency_id,
+    }
+    response = requests.get(f"{base_url}/XML_dynamic.asp", params, timeout=timeout)
     response.raise_for_status()
 
+    rates = {}
     tree = ElementTree.fromstring(response.content)
-    rate_str = tree.find(f".//Valute[@ID='{USD_ID}']/Value").text
 
-    return Decimal(rate_str.replace(",", "."))
+    for record in tree.iter("Record"):
+        record_date = datetime.strptime(record.get("Date"), "%d.%m.%Y").date()
+        rates[record_date] = _parse_value(record)
+
+    return rates
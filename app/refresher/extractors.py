@@ -1,48 +1,184 @@
 import os
 from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Iterable
 
-import gspread
-from pydantic import ValidationError
-
+from app import metrics
+from app.database import DEFAULT_SOURCE
 from app.logger import logger
-from app.refresher.serializers import GSOrderSerializer
+from app.refresher.serializers import GSOrdersBatchSerializer
 from app.schemas import BaseOrder
 
+# gspread is imported by extractor on first request, it is slow to import
+if TYPE_CHECKING:
+    import gspread
+
 
 class BaseExtractor(ABC):
-    """Abstract extractor class"""
+    """Abstract extractor class, extracted orders belong to extractor's source"""
+
+    source: str = DEFAULT_SOURCE
 
     @abstractmethod
     def extract_orders(self) -> list[BaseOrder]:
         """Must extract orders from target source"""
 
+    def extract_orders_chunks(self) -> Iterable[list[BaseOrder]]:
+        """Yield extracted orders by chunks, all orders in single chunk by default"""
+        yield self.extract_orders()
+
+    def is_modified(self) -> bool:
+        """Check if source may be modified since last extraction, always True by default"""
+        return True
+
+    def is_consistent(self) -> bool:
+        """
+        Check if last extraction has listed all orders of the same source's state,
+        so unlisted orders can be deleted. Always True by default
+        """
+        return True
+
 
 class GSExtractor(BaseExtractor):
-    """Google sheets extractor implementation"""
+    """
+    Google sheets extractor implementation. Authorizes once and reuses
+    its session between extractions, tracks spreadsheet's drive version.
+    Extracts worksheet with given title or the first one
+    """
 
     credentials_path = "../../data/service_account.json"
 
-    def __init__(self, sheet_key: str, header_height: int = 1):
-        """Open google sheet by sheet_key, requires data/service_account.json file"""
+    # table_id, order_id, price_usd and supply_date columns
+    first_column, last_column = "A", "D"
 
-        credentials_path = os.path.join(os.path.dirname(__file__), self.credentials_path)
-        account = gspread.service_account(credentials_path)
+    def __init__(
+        self,
+        sheet_key: str,
+        header_height: int = 1,
+        chunk_size: int = 1000,
+        timeout: float = 30,
+        worksheet: str = None,
+        source: str = DEFAULT_SOURCE,
+    ):
+        """Prepare google sheet extractor, connection is made lazily at first request"""
 
-        self._sheet = account.open_by_key(sheet_key).sheet1
+        self.source = source
+
+        self._sheet_key = sheet_key
+        self._worksheet = worksheet
         self._header_height = header_height
+        self._chunk_size = chunk_size
+        self._timeout = timeout
+
+        self._client = None
+        self._sheet = None
+        self._extracted_version = None
+        self._consistent = True
+
+    def _get_client(self) -> "gspread.Client":
+        """Authorize service account once, requires data/service_account.json file"""
+
+        if self._client is None:
+            import gspread
+
+            credentials_path = os.path.join(os.path.dirname(__file__), self.credentials_path)
+
+            self._client = gspread.service_account(credentials_path)
+            self._client.set_timeout(self._timeout)
+
+        return self._client
+
+    def _get_sheet(self) -> "gspread.Worksheet":
+        """Open google sheet by sheet_key and its worksheet once"""
+
+        if self._sheet is None:
+            spreadsheet = self._get_client().open_by_key(self._sheet_key)
+
+            if self._worksheet is None:
+                self._sheet = spreadsheet.sheet1
+            else:
+                self._sheet = spreadsheet.worksheet(self._worksheet)
+
+        return self._sheet
+
+    def _get_version(self) -> str:
+        """Get spreadsheet's drive file version, which increases on every change"""
+
+        from gspread.urls import DRIVE_FILES_API_V3_URL
+
+        url = f"{DRIVE_FILES_API_V3_URL}/{self._sheet_key}"
+        params = {"fields": "version", "supportsAllDrives": True}
+
+        return self._get_client().request("get", url, params=params).json()["version"]
+
+    def _get_row_count(self) -> int:
+        """Fetch actual worksheet's row count, it may change since sheet was opened"""
+
+        sheet = self._get_sheet()
+        params = {"fields": "sheets.properties(sheetId,gridProperties.rowCount)"}
+        metadata = sheet.spreadsheet.fetch_sheet_metadata(params)
+
+        properties = {m["properties"]["sheetId"]: m["properties"] for m in metadata["sheets"]}
+        return properties[sheet.id]["gridProperties"]["rowCount"]
+
+    def _serialize_orders(self, raw_orders: list[list[str]], first_row: int) -> list[BaseOrder]:
+        """Serialize raw orders in batch, skip invalid ones"""
+
+        with metrics.stage("serialize"):
+            orders, invalid_rows = GSOrdersBatchSerializer(raw_orders, first_row).serialize()
+
+        labels = {"extractor": "google_sheets", "source": self.source}
+        metrics.REFRESHER_ROWS.inc(len(raw_orders), **labels)
+        metrics.REFRESHER_INVALID_ROWS.inc(len(invalid_rows), **labels)
+
+        for invalid_row in invalid_rows:
+            logger.warning(
+                f"Invalid row {invalid_row.row} of {self.source} source data: "
+                f"{invalid_row.raw_order} ({invalid_row.error})"
+            )
+
+        return orders
+
+    def is_modified(self) -> bool:
+        """Check if spreadsheet's version differs from last extracted one"""
+        return self._extracted_version is None or self._get_version() != self._extracted_version
+
+    def is_consistent(self) -> bool:
+        """Check if spreadsheet has not changed while its last extraction"""
+        return self._consistent
 
     def extract_orders(self) -> list[BaseOrder]:
         """Extract serialized data from google sheet"""
 
-        orders = []
-        raw_orders = self._sheet.get_values()[self._header_height :]
+        # take version before values, so concurrent changes will be extracted next time
+        version = self._get_version()
 
-        for raw_order in raw_orders:
-            try:
-                order = GSOrderSerializer(raw_order).serialize()
-            except ValidationError:
-                logger.warning(f"Invalid row data: {raw_order}")
-            else:
-                orders.append(order)
+        raw_orders = self._get_sheet().get_values()[self._header_height :]
+        orders = self._serialize_orders(raw_orders, self._header_height + 1)
+
+        self._extracted_version = version
+        self._consistent = True
 
         return orders
+
+    def extract_orders_chunks(self) -> Iterable[list[BaseOrder]]:
+        """
+        Extract serialized data from google sheet by fixed-size ranges of used columns.
+        Ranges are not a single snapshot, so version is checked again after the last one
+        """
+
+        version = self._get_version()
+        sheet = self._get_sheet()
+        row_count = self._get_row_count()
+
+        for first_row in range(self._header_height + 1, row_count + 1, self._chunk_size):
+            last_row = first_row + self._chunk_size - 1
+            range_name = f"{self.first_column}{first_row}:{self.last_column}{last_row}"
+
+            yield self._serialize_orders(sheet.get_values(range_name), first_row)
+
+        # rows could shift between ranges, changed version also makes next check modified
+        self._extracted_version = version
+        self._consistent = self._get_version() == version
+
+        if not self._consistent:
+            logger.warning(f"Sheet of {self.source} source has changed while extraction")
@@ -0,0 +1,141 @@
+from abc import ABC, abstractmethod
+from datetime import date, timedelta
+from decimal import Decimal
+from xml.etree import ElementTree
+
+import requests
+from sqlalchemy import desc
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Engine
+from sqlmodel import Session
+
+from app.database import DatabaseRate
+from app.logger import logger
+from app.refresher import cbrf
+
+
+class RateNotFoundError(LookupError):
+    """Cbrf has no rate for requested date, e.g. its range is empty"""
+
+
+class BaseRateStore(ABC):
+    """Abstract currency rates store with in-process cache"""
+
+    def __init__(self):
+        self._cache = {}
+
+    @abstractmethod
+    def _get_rate(self, currency_id: str, rate_date: date) -> Decimal:
+        """Must return currency rate for given date"""
+
+    def get_rate(self, currency_id: str, rate_date: date) -> Decimal:
+        """Return currency rate for given date, cached in process"""
+
+        key = (currency_id, rate_date)
+
+        if key not in self._cache:
+            self._cache[key] = self._get_rate(currency_id, rate_date)
+
+        return self._cache[key]
+
+
+class DatabaseRateStore(BaseRateStore):
+    """
+    Cbrf's rates store, persisted in database. Missing rates are fetched from cbrf in bulk
+    for date range, last known rate can be used if cbrf is unavailable
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        base_url: str = cbrf.BASE_URL,
+        timeout: float = cbrf.TIMEOUT,
+        prefetch_days: int = 30,
+        use_last_known_rate: bool = False,
+    ):
+        super().__init__()
+
+        self._engine = engine
+        self._base_url = base_url
+        self._timeout = timeout
+        self._prefetch_days = prefetch_days
+        self._use_last_known_rate = use_last_known_rate
+
+    def _load_rate(self, currency_id: str, rate_date: date, last_known: bool = False) -> Decimal:
+        """Load stored rate for given date or last known rate before it, None if there is no one"""
+
+        with Session(self._engine) as session:
+            query = session.query(DatabaseRate.value)
+            query = query.where(DatabaseRate.currency_id == currency_id)
+
+            if last_known:
+                query = query.where(DatabaseRate.rate_date <= rate_date)
+                query = query.order_by(desc(DatabaseRate.rate_date))
+            else:
+                query = query.where(DatabaseRate.rate_date == rate_date)
+
+            return query.limit(1).scalar()
+
+    def _fetch_rates(self, currency_id: str, rate_date: date) -> dict[date, Decimal]:
+        """
+        Fetch rates for prefetch range, which ends with given date, save and return them.
+        Cbrf sets rates only for working days, so the rest days get last set rate
+        """
+
+        first_date = rate_date - timedelta(days=self._prefetch_days)
+        rates = cbrf.get_rates(currency_id, first_date, rate_date, self._base_url, self._timeout)
+
+        if not len(rates):
+            return {}
+
+        daily_rates = {}
+        current_date, current_value = min(rates), None
+
+        while current_date <= rate_date:
+            current_value = daily_rates[current_date] = rates.get(current_date, current_value)
+            current_date += timedelta(days=1)
+
+        values = [
+            {"currency_id": currency_id, "rate_date": d, "value": v} for d, v in daily_rates.items()
+        ]
+        statement = insert(DatabaseRate.__table__).values(values).on_conflict_do_nothing()
+
+        with Session(self._engine) as session:
+            session.execute(statement)
+            session.commit()
+
+        return daily_rates
+
+    def _get_rate(self, currency_id: str, rate_date: date) -> Decimal:
+        """Return stored rate, fetch missing rates from cbrf first"""
+
+        rate = self._load_rate(currency_id, rate_date)
+
+        if rate is None:
+            rate = self._fetch_rates(currency_id, rate_date).get(rate_date)
+
+        if rate is None:
+            raise RateNotFoundError(f"There is no cbrf's {currency_id} rate for {rate_date}")
+
+        return rate
+
+    def get_rate(self, currency_id: str, rate_date: date) -> Decimal:
+        """
+        Return currency rate for given date. Fallback to last known rate, if cbrf is
+        unavailable or has no rate and it's allowed, that rate is not cached to fetch
+        actual one next time
+        """
+
+        try:
+            return super().get_rate(currency_id, rate_date)
+        except (requests.RequestException, ElementTree.ParseError, RateNotFoundError) as e:
+            if not self._use_last_known_rate:
+                raise
+
+            rate = self._load_rate(currency_id, rate_date, last_known=True)
+
+            if rate is None:
+                raise
+
+            logger.warning(f"Unable to fetch {currency_id} rate ({e}), use last known {rate}")
+            return rate
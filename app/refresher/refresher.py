@@ -1,42 +1,361 @@
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from datetime import datetime
+from decimal import Decimal
+from typing import Iterable, Optional
 
+from app import metrics
 from app.logger import logger
 from app.refresher import cbrf
 from app.refresher.backends import BaseBackend
 from app.refresher.extractors import BaseExtractor
-from app.schemas import BaseOrder
+from app.refresher.rates import BaseRateStore
+from app.schemas import BaseOrder, Money, OrdersDiff
 
 
 class Refresher:
-    """Refresh orders from given extractor for given backend"""
+    """
+    Refresh orders from given extractor for given backend chunk by chunk. Keeps
+    fingerprints of applied orders between refreshes to hand the backend only changed orders.
+    Orders are refreshed as backend partition of extractor's source. When only rate changes,
+    stored orders are repriced by backend without extraction. Orders rejected by backend,
+    as they belong to another source, are retried by every next refresh
+    """
 
-    def __init__(self, extractor: BaseExtractor, backend: BaseBackend):
+    deleted_chunk_size = 1000
+
+    def __init__(self, extractor: BaseExtractor, backend: BaseBackend, rate_store: BaseRateStore):
         self._extractor = extractor
         self._backend = backend
+        self._rate_store = rate_store
+        self._fingerprints = None
+        self._usdrub_rate = None
+        self._rejected_ids = set()
+
+        self.source = extractor.source
 
     @staticmethod
-    def _update_orders(orders: list[BaseOrder]) -> list[BaseOrder]:
-        """Update orders with price_rub field, based on cbrf's rate and price_usd field"""
+    def _update_orders(orders: list[BaseOrder], usdrub_rate: Decimal) -> list[BaseOrder]:
+        """Update orders with price_rub field, based on given rate and price_usd field"""
+
+        for order in orders:
+            # validate price_rub explicitly, as the field is not validated on assignment
+            order.price_rub = Money.validate(order.price_usd * usdrub_rate)
+
+        return orders
 
-        updated_orders = []
-        now_date = datetime.now().date()
-        usdrub_rate = cbrf.get_usdrub_rate(now_date)
+    def _diff_orders(self, orders: list[BaseOrder], fingerprints: dict[int, tuple]) -> OrdersDiff:
+        """
+        Diff orders against already listed or last applied fingerprints,
+        put fingerprints of given orders into listed ones
+        """
+
+        diff = OrdersDiff()
 
         for order in orders:
-            order.price_rub = order.price_usd * usdrub_rate
+            fingerprint = order.get_fingerprint()
+            previous_fingerprint = fingerprints.get(order.order_id)
+
+            if previous_fingerprint is None:
+                previous_fingerprint = self._fingerprints.get(order.order_id)
+
+            if previous_fingerprint is None:
+                diff.inserted.append(order)
+            elif previous_fingerprint != fingerprint:
+                diff.updated.append(order)
+
+            fingerprints[order.order_id] = fingerprint
+
+        return diff
+
+    def _generate_diffs(
+        self,
+        chunks: Iterable[list[BaseOrder]],
+        usdrub_rate: Decimal,
+        fingerprints: dict[int, tuple],
+        counter: Counter,
+    ) -> Iterable[OrdersDiff]:
+        """
+        Extract, update and diff orders chunk by chunk, then yield deleted orders by chunks,
+        if extraction is consistent. Fill fingerprints of listed orders and count changes
+        in given counter
+        """
+
+        chunks = iter(chunks)
+
+        while True:
+            with metrics.stage("extract"):
+                orders = next(chunks, None)
+
+            if orders is None:
+                break
+
+            with metrics.stage("diff"):
+                orders = self._update_orders(orders, usdrub_rate)
+                diff = self._diff_orders(orders, fingerprints)
+
+            counter.update(inserted=len(diff.inserted), updated=len(diff.updated))
+            yield diff
+
+        # listed orders are known only after last chunk
+        if not self._extractor.is_consistent():
+            # unlisted orders may still be in source, they are checked by the next refresh
+            for order_id, fingerprint in self._fingerprints.items():
+                fingerprints.setdefault(order_id, fingerprint)
+
+            logger.warning(f"Source {self.source} has changed while extraction, nothing deleted")
+            return
+
+        deleted_ids = [i for i in self._fingerprints if i not in fingerprints]
+        counter.update(deleted=len(deleted_ids))
+
+        for i in range(0, len(deleted_ids), self.deleted_chunk_size):
+            yield OrdersDiff(deleted_ids=deleted_ids[i : i + self.deleted_chunk_size])
+
+    def refresh_orders(self):
+        """Extract, update and refresh changed orders, skip unmodified source with the same rate"""
+
+        with metrics.track_tick("refresher"):
+            self._refresh_orders()
+
+    def _load_applied_state(self):
+        """Load fingerprints and rate of stored orders from backend, if they are unknown"""
+
+        if self._fingerprints is None:
+            with metrics.stage("apply"):
+                self._fingerprints = self._backend.get_fingerprints(self.source)
+                self._usdrub_rate = self._backend.get_applied_rate(self.source)
+
+    def reprice_orders(self, usdrub_rate: Decimal):
+        """
+        Reprice stored orders of source at backend, if they are priced with known rate,
+        which differs from given one. Must be called before extraction
+        """
+
+        self._load_applied_state()
+
+        if self._usdrub_rate is None or self._usdrub_rate == usdrub_rate:
+            return
+
+        try:
+            with metrics.stage("reprice"):
+                repriced_count = self._backend.reprice_orders(usdrub_rate, self.source)
+
+            # fingerprints hold prices in backend's rounding
+            with metrics.stage("apply"):
+                self._fingerprints = self._backend.get_fingerprints(self.source)
+        except Exception:
+            self._fingerprints = None
+            raise
+
+        self._usdrub_rate = usdrub_rate
+        metrics.REFRESHER_CHANGES.inc(repriced_count, source=self.source, change="repriced")
+
+        logger.info(
+            f"Successfully repriced {repriced_count} order(s) of {self.source} source "
+            f"with {usdrub_rate} rate"
+        )
+
+    def extract_orders_chunks(self, usdrub_rate: Decimal) -> Optional[Iterable[list[BaseOrder]]]:
+        """
+        Return lazily extracted orders chunks of source, or None if source
+        is not modified, rate is the same and nothing is rejected since last refresh
+        """
+
+        is_applied = not self._rejected_ids and usdrub_rate == self._usdrub_rate
+
+        if self._fingerprints is not None and is_applied:
+            with metrics.stage("extract"):
+                is_modified = self._extractor.is_modified()
+
+            if not is_modified:
+                return None
+
+        return self._extractor.extract_orders_chunks()
+
+    def apply_orders_chunks(self, chunks: Iterable[list[BaseOrder]], usdrub_rate: Decimal):
+        """
+        Update and diff orders chunks, apply changed orders to source's partition
+        and save rate of their prices, if it is not applied yet
+        """
+
+        self._load_applied_state()
 
-            # we need recreate order to enforce price_rub field validation
-            updated_order = BaseOrder(**order.dict())
-            updated_orders.append(updated_order)
+        fingerprints = {}
+        counter = Counter()
+        diffs = self._generate_diffs(chunks, usdrub_rate, fingerprints, counter)
+        new_rate = usdrub_rate if usdrub_rate != self._usdrub_rate else None
 
-        return updated_orders
+        try:
+            # extraction and diffs are nested stages of lazily consumed diffs
+            with metrics.stage("apply"):
+                rejected_ids = self._backend.apply_orders_diffs(diffs, self.source, new_rate)
+        except Exception:
+            # applied state is unknown, reload it from backend next time
+            self._fingerprints = None
+            raise
+
+        # rejected orders are not applied, so they are inserted again by the next refresh
+        for order_id in rejected_ids:
+            fingerprints.pop(order_id, None)
+
+        if len(rejected_ids):
+            counter.update(rejected=len(rejected_ids))
+            counter.subtract(inserted=len(set(rejected_ids) - set(self._fingerprints)))
+            logger.warning(
+                f"Rejected {len(rejected_ids)} order(s) of {self.source} source, their ids "
+                f"belong to other sources: {sorted(rejected_ids)[:10]}"
+            )
+
+        self._fingerprints = fingerprints
+        self._usdrub_rate = usdrub_rate
+        self._rejected_ids = set(rejected_ids)
+
+        inserted, updated, deleted = counter["inserted"], counter["updated"], counter["deleted"]
+
+        for change, count in counter.items():
+            metrics.REFRESHER_CHANGES.inc(count, source=self.source, change=change)
+
+        logger.info(
+            f"Successfully refreshed {len(fingerprints)} order(s) of {self.source} source: "
+            f"{inserted} inserted, {updated} updated, {deleted} deleted"
+        )
+
+    def _refresh_orders(self):
+        """Refresh orders within tracked tick"""
+
+        with metrics.stage("rate_fetch"):
+            usdrub_rate = self._rate_store.get_rate(cbrf.USD_ID, datetime.now().date())
+
+        self.reprice_orders(usdrub_rate)
+        chunks = self.extract_orders_chunks(usdrub_rate)
+
+        if chunks is None:
+            logger.info(f"Source {self.source} is not modified, nothing to refresh")
+            return
+
+        self.apply_orders_chunks(chunks, usdrub_rate)
+
+
+class MultiSourceRefresher:
+    """
+    Refresh orders of several sources, every source is refreshed by its own Refresher
+    as separate backend partition. Sources are extracted concurrently through thread pool
+    and every one is applied as soon as it is extracted, so refresh takes about as long
+    as the slowest source. Sources are repriced before their extraction one by one.
+    Failed source keeps its orders without stopping the rest
+    """
+
+    def __init__(
+        self,
+        extractors: list[BaseExtractor],
+        backend: BaseBackend,
+        rate_store: BaseRateStore,
+        workers: int = 8,
+    ):
+        sources = [extractor.source for extractor in extractors]
+
+        if len(set(sources)) != len(sources):
+            raise ValueError(f"Extractors' sources must be unique, got {sources}")
+
+        self._refreshers = [Refresher(e, backend, rate_store) for e in extractors]
+        self._rate_store = rate_store
+        self._workers = workers
+
+    @staticmethod
+    def _extract_orders(
+        refresher: Refresher, usdrub_rate: Decimal
+    ) -> Optional[list[list[BaseOrder]]]:
+        """
+        Extract all orders chunks of modified source, so slow source is never
+        extracted within backend transaction. Return None for unmodified source
+        """
+
+        chunks = refresher.extract_orders_chunks(usdrub_rate)
+        return None if chunks is None else list(chunks)
+
+    @staticmethod
+    def _handle_failure(refresher: Refresher, error: Exception):
+        """Log and count failed refresh of source"""
+
+        metrics.REFRESHER_SOURCE_FAILURES.inc(source=refresher.source)
+        logger.error(f"Unable to refresh {refresher.source} source: {error}", exc_info=error)
+
+    def _reprice_orders(self, refresher: Refresher, usdrub_rate: Decimal) -> bool:
+        """Reprice stored orders of source, handle failed repricing and return False"""
+
+        try:
+            refresher.reprice_orders(usdrub_rate)
+        except Exception as e:
+            self._handle_failure(refresher, e)
+            return False
+
+        return True
+
+    def _apply_orders(self, refresher: Refresher, future: Future, usdrub_rate: Decimal) -> bool:
+        """Apply extracted orders of source, handle failed extraction or apply and return False"""
+
+        try:
+            chunks = future.result()
+
+            if chunks is None:
+                logger.info(f"Source {refresher.source} is not modified, nothing to refresh")
+            else:
+                refresher.apply_orders_chunks(chunks, usdrub_rate)
+        except Exception as e:
+            self._handle_failure(refresher, e)
+            return False
+
+        return True
 
     def refresh_orders(self):
-        """Extract, update and refresh orders"""
+        """
+        Extract, update and refresh changed orders of every source. Fails only
+        if every source has failed
+        """
+
+        with metrics.track_tick("refresher"):
+            self._refresh_orders()
+
+    def _refresh_orders(self):
+        """Refresh orders of every source within tracked tick"""
+
+        with metrics.stage("rate_fetch"):
+            usdrub_rate = self._rate_store.get_rate(cbrf.USD_ID, datetime.now().date())
+
+        failed_sources = []
+
+        with ThreadPoolExecutor(self._workers) as executor:
+            futures = {}
+
+            # backend is used by this thread only, extraction starts right after repricing
+            for refresher in self._refreshers:
+                if self._reprice_orders(refresher, usdrub_rate):
+                    future = executor.submit(self._extract_orders, refresher, usdrub_rate)
+                    futures[future] = refresher
+                else:
+                    failed_sources.append(refresher.source)
+
+            completed = as_completed(futures)
+
+            while True:
+                # extraction runs in workers, so waiting for it is extract stage
+                with metrics.stage("extract"):
+                    future = next(completed, None)
+
+                if future is None:
+                    break
+
+                refresher = futures[future]
 
-        orders = self._extractor.extract_orders()
-        orders = self._update_orders(orders)
+                if not self._apply_orders(refresher, future, usdrub_rate):
+                    failed_sources.append(refresher.source)
 
-        self._backend.refresh_orders(orders)
+        if len(failed_sources) and len(failed_sources) == len(self._refreshers):
+            raise RuntimeError(f"Unable to refresh any source: {', '.join(failed_sources)}")
 
-        logger.info(f"Successfully refreshed {len(orders)} order(s)")
+        if len(failed_sources):
+            logger.warning(
+                f"Refreshed {len(self._refreshers) - len(failed_sources)} source(s), "
+                f"failed {', '.join(failed_sources)}"
+            )
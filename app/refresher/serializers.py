@@ -1,7 +1,11 @@
 from abc import ABC, abstractmethod
-from typing import Any
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Any, Callable, Iterable
 
-from app.schemas import BaseOrder
+from pydantic.validators import decimal_validator, int_validator
+
+from app.schemas import BaseOrder, Date, Money
 
 
 class BaseOrderSerializer(ABC):
@@ -26,3 +30,91 @@ class GSOrderSerializer(BaseOrderSerializer):
         """Serialize google sheet's order to BaseOrder"""
         fields = ("table_id", "order_id", "price_usd", "supply_date")
         return BaseOrder.parse_obj(dict(zip(fields, self._raw_order)))
+
+
+@dataclass
+class InvalidRow:
+    """Invalid raw order data class"""
+
+    row: int
+    raw_order: Any
+    error: str
+
+
+class GSOrdersBatchSerializer:
+    """
+    Google sheets batch orders serializer. Validates whole columns with the same
+    semantics as BaseOrder fields, caches parsed dates and prices within the batch
+    """
+
+    fields = ("table_id", "order_id", "price_usd", "supply_date")
+
+    def __init__(self, raw_orders: list[list[str]], first_row: int = 1):
+        self._raw_orders = raw_orders
+        self._first_row = first_row
+
+    @staticmethod
+    def _validate_money(value: str) -> Decimal:
+        """Validate money value as pydantic does for Money field"""
+        return Money.validate(decimal_validator(value))
+
+    @staticmethod
+    def _validate_column(values: Iterable[str], validator: Callable, cache: bool) -> list:
+        """Validate column values, put raised errors instead of invalid values"""
+
+        validated_values = []
+        validated_cache = {}
+
+        for value in values:
+            if cache and value in validated_cache:
+                validated_values.append(validated_cache[value])
+                continue
+
+            try:
+                validated_value = validator(value)
+            except (ValueError, TypeError, ArithmeticError) as e:
+                validated_value = e
+
+            validated_values.append(validated_value)
+
+            if cache:
+                validated_cache[value] = validated_value
+
+        return validated_values
+
+    def serialize(self) -> tuple[list[BaseOrder], list[InvalidRow]]:
+        """Serialize google sheet's orders to BaseOrders, collect invalid rows"""
+
+        orders, invalid_rows = [], []
+        raw_orders, rows = [], []
+
+        for row, raw_order in enumerate(self._raw_orders, self._first_row):
+            if len(raw_order) < len(self.fields):
+                invalid_rows.append(InvalidRow(row, raw_order, "not enough values"))
+            else:
+                raw_orders.append(raw_order)
+                rows.append(row)
+
+        # transpose rows into columns of used fields only
+        table_ids, order_ids, prices_usd, supply_dates = (
+            [raw_order[i] for raw_order in raw_orders] for i in range(len(self.fields))
+        )
+
+        columns = (
+            self._validate_column(table_ids, int_validator, cache=False),
+            self._validate_column(order_ids, int_validator, cache=False),
+            self._validate_column(prices_usd, self._validate_money, cache=True),
+            self._validate_column(supply_dates, Date.validate, cache=True),
+        )
+
+        for row, raw_order, *values in zip(rows, raw_orders, *columns):
+            errors = [f"{f}: {v}" for f, v in zip(self.fields, values) if isinstance(v, Exception)]
+
+            if len(errors):
+                invalid_rows.append(InvalidRow(row, raw_order, ", ".join(errors)))
+            else:
+                orders.append(BaseOrder.construct(**dict(zip(self.fields, values))))
+
+        invalid_rows.sort(key=lambda r: r.row)
+
+        return orders, invalid_rows
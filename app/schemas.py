@@ -1,5 +1,5 @@
 import decimal
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import date, datetime
 from decimal import Decimal
 from enum import Enum
@@ -45,6 +45,13 @@ class Provider(str, Enum):
     telegram = "telegram"
 
 
+class NotifiedStatus(str, Enum):
+    """Notified states' statuses enum"""
+
+    sending = "sending"
+    sent = "sent"
+
+
 class BaseOrder(BaseModel):
     """Base order schema"""
 
@@ -54,6 +61,49 @@ class BaseOrder(BaseModel):
     price_rub: Money = None
     supply_date: Date
 
+    def get_fingerprint(self) -> tuple:
+        """Return order's content fingerprint, which changes with any stored field"""
+        return self.table_id, self.price_usd, self.supply_date, self.price_rub
+
+
+class BaseOrdersDailyTotal(BaseModel):
+    """Base orders totals schema for single supply date"""
+
+    supply_date: Date
+    orders_count: int
+    price_usd: Money
+    price_rub: Money = None
+
+
+class BaseDatasetVersion(BaseModel):
+    """Base dataset version schema, version increases with every dataset change"""
+
+    name: str
+    version: int
+
+
+class BaseOrderTombstone(BaseModel):
+    """Base deleted order schema with dataset version of deletion"""
+
+    order_id: int
+    version: int
+
+
+class BaseRate(BaseModel):
+    """Base currency rate schema"""
+
+    currency_id: str
+    rate_date: date
+    value: Decimal
+
+
+class BaseAppliedRate(BaseModel):
+    """Base schema of currency rate, which source's stored orders are priced with"""
+
+    source: str
+    currency_id: str
+    value: Decimal
+
 
 class BaseRecipient(BaseModel):
     """Base recipient schema"""
@@ -68,6 +118,7 @@ class BaseNotifiedState(BaseModel):
     order_id: int
     recipient_provider: Provider
     recipient_provider_id: str
+    status: NotifiedStatus = NotifiedStatus.sent
 
 
 @dataclass
@@ -77,3 +128,34 @@ class NotificationData:
     recipient: BaseRecipient
     today_orders: list[BaseOrder]
     overdue_orders: list[BaseOrder]
+
+
+@dataclass
+class NotificationScope:
+    """
+    Notifications scope data class: recipients of orders changed since given dataset version
+    and given recipients. Full scope includes all recipients
+    """
+
+    full: bool = False
+    since_version: int = None
+    recipients: set[tuple[Provider, str]] = field(default_factory=set)
+
+    def get_provider_ids(self, provider: Provider) -> list[str]:
+        """Return ids of scope's recipients of given provider"""
+        return [i for recipient_provider, i in self.recipients if recipient_provider == provider]
+
+    def __bool__(self) -> bool:
+        return self.full or self.since_version is not None or bool(self.recipients)
+
+
+@dataclass
+class OrdersDiff:
+    """Orders diff data class"""
+
+    inserted: list[BaseOrder] = field(default_factory=list)
+    updated: list[BaseOrder] = field(default_factory=list)
+    deleted_ids: list[int] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.inserted or self.updated or self.deleted_ids)
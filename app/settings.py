@@ -1,4 +1,31 @@
-from pydantic import BaseSettings, PostgresDsn
+from functools import lru_cache
+
+from pydantic import BaseModel, BaseSettings, PostgresDsn
+
+
+class PoolSettings(BaseModel):
+    """Database engine and connection pool settings, timeouts are in seconds"""
+
+    pool_size: int = 5
+    max_overflow: int = 5
+    pool_timeout: float = 10
+    pool_recycle: int = 1800
+    pool_pre_ping: bool = True
+    statement_timeout: float = None
+    # opt-in, notifier, refresher and orders streams keep transactions open over network calls
+    idle_in_transaction_session_timeout: float = None
+    slow_checkout: float = 0.1
+
+    # session options are set per transaction, pgbouncer's transaction pooling rejects them
+    pgbouncer: bool = False
+
+
+class SheetSourceSettings(BaseModel):
+    """Google sheet source of orders, worksheet is a title of its tab, the first one by default"""
+
+    source: str
+    sheet_key: str
+    worksheet: str = None
 
 
 class Settings(BaseSettings):
@@ -8,5 +35,48 @@ class Settings(BaseSettings):
     google_sheet_key: str = None
     telegram_bot_token: str = None
 
+    # several google sheets, which are refreshed as separate sources instead of google_sheet_key
+    google_sheets: list[SheetSourceSettings] = []
+    refresher_workers: int = 8
+
+    # default pool settings and overrides of some of them by role, e.g. {"backend": {...}}
+    database_pool: PoolSettings = PoolSettings()
+    database_pools: dict[str, dict] = {}
+
+    # prometheus metrics, scripts serve them at metrics_host:metrics_port, backend at /metrics
+    metrics_enabled: bool = False
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 9100
+
+    # days, tombstones of deleted orders are kept by prune script, orders changes
+    # since older versions require full reload
+    order_tombstones_retention_days: int = 30
+
+    notifier_workers: int = 8
+    notifier_batch_size: int = 100
+    # seconds, notifications left sending longer, e.g. after crash, are sent again
+    notifier_sending_timeout: int = 600
+
+    # cbrf's defaults are used if they are not set
+    cbrf_url: str = None
+    cbrf_timeout: float = None
+    cbrf_prefetch_days: int = 30
+    cbrf_use_last_known_rate: bool = False
+
+    def get_pool_settings(self, role: str) -> PoolSettings:
+        """Return default pool settings with overrides of given role"""
+        return PoolSettings(**{**self.database_pool.dict(), **self.database_pools.get(role, {})})
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Read and validate settings from environment on first call"""
+    return Settings()
+
+
+def __getattr__(name: str):
+    # settings are read on first access of module's settings attribute
+    if name == "settings":
+        return get_settings()
 
-settings = Settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,13 +1,33 @@
-from datetime import date
+import json
+import time
+from datetime import date, datetime
 from decimal import Decimal
-from typing import Any
+from functools import lru_cache
+from queue import Empty
+from typing import Any, Iterable, Optional
 
-from flask import Flask, jsonify
+from flask import Flask, Response, abort, g, jsonify, request
 from flask.json import JSONEncoder as BaseJSONEncoder
 from flask_cors import CORS
-from sqlmodel import Session, SQLModel
+from pydantic import BaseModel, ValidationError, conint, root_validator
+from sqlalchemy import tuple_
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.engine import Engine
+from sqlmodel import Session
 
-from app.database import engine, DatabaseOrder
+from app import events, metrics
+from app.webapp import formats
+from app.database import (
+    ORDERS_DATASET,
+    PRUNED_TOMBSTONES_DATASET,
+    get_engine,
+    DatabaseOrder,
+    DatabaseOrderTombstone,
+    DatabaseDatasetVersion,
+    DatabaseOrdersDailyTotal,
+)
+from app.schemas import BaseOrder
+from app.settings import get_settings
 
 
 class JSONEncoder(BaseJSONEncoder):
@@ -21,8 +41,100 @@ class JSONEncoder(BaseJSONEncoder):
         return super().default(value)
 
 
-# create database models if not exists
-SQLModel.metadata.create_all(engine)
+class OrdersPageQuery(BaseModel):
+    """Orders page query parameters"""
+
+    after_table_id: int = None
+    after_order_id: int = None
+    limit: conint(ge=1, le=1000) = 100
+
+    supply_date_from: date = None
+    supply_date_to: date = None
+    price_usd_min: Decimal = None
+    price_usd_max: Decimal = None
+    price_rub_min: Decimal = None
+    price_rub_max: Decimal = None
+    overdue: bool = False
+
+    @root_validator(skip_on_failure=True)
+    def validate_cursor(cls, values: dict) -> dict:
+        if values["after_order_id"] is not None and values["after_table_id"] is None:
+            raise ValueError("after_order_id requires after_table_id")
+        return values
+
+
+class OrdersChangesQuery(BaseModel):
+    """Orders changes query parameters"""
+
+    since: conint(ge=0)
+
+
+class OrdersJSONStream:
+    """
+    Orders json stream, which reads plain rows through server-side cursor and encodes
+    them chunk by chunk. Output is the same as compact jsonify with sorted keys
+    """
+
+    # jsonify sorts keys
+    fields = sorted(BaseOrder.__fields__)
+    chunk_size = 1000
+
+    def __init__(self, engine: Engine):
+        self._engine = engine
+        self._keys = [f'"{field}":' for field in self.fields]
+
+    @staticmethod
+    def _encode_value(value: Any) -> str:
+        """Encode single order value as JSONEncoder does"""
+
+        if value is None:
+            return "null"
+        if isinstance(value, Decimal):
+            return repr(float(value))
+        if isinstance(value, date):
+            return f'"{value.isoformat()}"'
+        return str(value)
+
+    def _encode_row(self, row: tuple) -> str:
+        """Encode row as json object"""
+
+        values = map(self._encode_value, row)
+        return "{" + ",".join(key + value for key, value in zip(self._keys, values)) + "}"
+
+    def __iter__(self) -> Iterable[str]:
+        """Yield json object with all orders sorted by table_id in results field"""
+
+        yield '{"results":['
+
+        separator, chunk = "", []
+
+        for row in iter_orders_rows(self._engine):
+            chunk.append(self._encode_row(row))
+
+            if len(chunk) >= self.chunk_size:
+                yield separator + ",".join(chunk)
+                separator, chunk = ",", []
+
+        if len(chunk):
+            yield separator + ",".join(chunk)
+
+        yield "]}\n"
+
+
+def iter_orders_rows(engine: Engine) -> Iterable[tuple]:
+    """
+    Yield all orders rows with values in OrdersJSONStream.fields order, sorted
+    by table_id and order_id, through server-side cursor
+    """
+
+    columns = [getattr(DatabaseOrder, field) for field in OrdersJSONStream.fields]
+
+    with Session(engine) as session:
+        query = session.query(*columns)
+        query = query.order_by(DatabaseOrder.table_id, DatabaseOrder.order_id)
+
+        yield from query.yield_per(OrdersJSONStream.chunk_size)
+
 
 app = Flask("backend")
 app.json_encoder = JSONEncoder
@@ -30,11 +142,370 @@ app.json_encoder = JSONEncoder
 # allow all cors for app
 CORS(app)
 
+# smaller responses are not worth compressing
+compression_min_size = 500
+
+events_keepalive_interval = 15
+
+
+@lru_cache(maxsize=1)
+def get_orders_listener() -> events.Listener:
+    """Create single LISTEN connection per process for all events streams"""
+    return events.Listener(get_settings().database_dsn, [events.ORDERS_CHANNEL])
+
+
+@app.errorhandler(PoolTimeoutError)
+def handle_pool_timeout(e: PoolTimeoutError) -> tuple[Response, int, dict]:
+    """Ask client to retry later, when connections queue is not drained in pool timeout"""
+    return jsonify(errors=[{"msg": "database is busy"}]), 503, {"Retry-After": "1"}
+
+
+def get_orders_version() -> int:
+    """Get current orders dataset version, zero if orders were never refreshed"""
+
+    with Session(get_engine("backend")) as session:
+        dataset_version = session.get(DatabaseDatasetVersion, ORDERS_DATASET)
+
+    return 0 if dataset_version is None else dataset_version.version
+
+
+def negotiate_encoder() -> Optional[formats.ColumnarOrdersEncoder]:
+    """Return columnar orders encoder for accepted mimetype or None for row-oriented json"""
+
+    mimetype = request.accept_mimetypes.best_match(
+        [formats.JSON_MIMETYPE, *formats.ENCODERS], default=formats.JSON_MIMETYPE
+    )
+
+    if mimetype in formats.ENCODERS:
+        return formats.ENCODERS[mimetype](OrdersJSONStream.fields)
+
+
+def make_orders_etag(
+    version: int,
+    encoder: Optional[formats.ColumnarOrdersEncoder],
+    today: date = None,
+) -> str:
+    """
+    Make etag of orders response, which changes with dataset version, differs by
+    response's mimetype and by today's date if response depends on it
+    """
+
+    mimetype = formats.JSON_MIMETYPE if encoder is None else encoder.mimetype
+    etag = f"{version}-{mimetype}"
+
+    if today is not None:
+        etag = f"{etag}-{today.isoformat()}"
+
+    return etag
+
+
+@app.before_first_request
+def setup_metrics():
+    """Enable metrics, they are served by /metrics endpoint"""
+    metrics.setup()
+
+
+@app.before_request
+def start_request_timer():
+    """Remember request's start for its latency metric"""
+    g.started_at = time.perf_counter()
+
+
+@app.after_request
+def observe_request_latency(response: Response) -> Response:
+    """Observe request's latency when response is sent, streamed ones included"""
+
+    # events streams last until clients disconnect
+    if not metrics.is_enabled() or response.mimetype == "text/event-stream":
+        return response
+
+    started_at = g.started_at
+    endpoint, method = request.endpoint or "unknown", request.method
+
+    def observe():
+        duration = time.perf_counter() - started_at
+        metrics.HTTP_REQUEST_SECONDS.observe(
+            duration, endpoint=endpoint, method=method, status=response.status_code
+        )
+
+    response.call_on_close(observe)
+    return response
+
+
+@app.after_request
+def compress_response(response: Response) -> Response:
+    """Compress orders responses with accepted content encoding, streams on the fly"""
+
+    if response.mimetype not in (formats.JSON_MIMETYPE, *formats.ENCODERS):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(formats.ENCODINGS)
+
+    if encoding is None or response.status_code != 200 or response.content_encoding:
+        return response
+
+    if response.is_streamed:
+        response.response = formats.compress_stream(response.response, encoding)
+    elif response.content_length >= compression_min_size:
+        response.set_data(formats.compress(response.get_data(), encoding))
+    else:
+        return response
+
+    response.content_encoding = encoding
+    return response
+
+
+def make_not_modified(
+    etag: str,
+    vary: Iterable[str] = ("Accept", "Accept-Encoding"),
+) -> Optional[Response]:
+    """Make 304 response if client already has response with given etag, it varies as 200 one"""
+
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        response.vary.update(vary)
+        return response
+
 
 @app.route("/give-me-everything-you-know/")
 def get_all_orders():
-    """Return all orders sorted by table_id inside json object"""
+    """
+    Stream all orders sorted by table_id inside json object or in accepted columnar format,
+    tagged with dataset version
+    """
 
-    with Session(engine) as session:
-        query = session.query(DatabaseOrder).order_by(DatabaseOrder.table_id)
-        return jsonify(results=[o.dict() for o in query])
+    encoder, engine = negotiate_encoder(), get_engine("backend")
+    etag = make_orders_etag(get_orders_version(), encoder)
+
+    not_modified = make_not_modified(etag)
+
+    if not_modified is not None:
+        return not_modified
+
+    # version is read before stream, so newer orders can only make client refetch them
+    if encoder is None:
+        response = Response(OrdersJSONStream(engine), mimetype=formats.JSON_MIMETYPE)
+    else:
+        response = Response(encoder.encode(iter_orders_rows(engine)), mimetype=encoder.mimetype)
+
+    response.set_etag(etag, weak=True)
+    response.vary.add("Accept")
+    return response
+
+
+@app.route("/orders/changes/")
+def get_orders_changes():
+    """
+    Return orders upserted and ids of orders deleted after given dataset version
+    with current dataset version, which is the since value of the next request.
+    Changes since version older than pruned tombstones require full reload, it is 410
+    """
+
+    try:
+        params = OrdersChangesQuery.parse_obj(request.args.to_dict())
+    except ValidationError as e:
+        return jsonify(errors=e.errors()), 400
+
+    columns = [getattr(DatabaseOrder, field) for field in OrdersJSONStream.fields]
+    encoder = negotiate_encoder()
+
+    with Session(get_engine("backend")) as session:
+        pruned_version = session.get(DatabaseDatasetVersion, PRUNED_TOMBSTONES_DATASET)
+
+        # ids of orders deleted after since may be pruned already
+        if pruned_version is not None and params.since < pruned_version.version:
+            msg = "changes since given version are pruned, full reload required"
+            return jsonify(errors=[{"msg": msg}], pruned_version=pruned_version.version), 410
+
+        dataset_version = session.get(DatabaseDatasetVersion, ORDERS_DATASET)
+        version = 0 if dataset_version is None else dataset_version.version
+        etag = make_orders_etag(version, encoder)
+
+        not_modified = make_not_modified(etag)
+
+        if not_modified is not None:
+            return not_modified
+
+        query = session.query(*columns).where(DatabaseOrder.version > params.since)
+        query = query.order_by(DatabaseOrder.table_id, DatabaseOrder.order_id)
+        upserted = query.all()
+
+        query = session.query(DatabaseOrderTombstone.order_id)
+        query = query.where(DatabaseOrderTombstone.version > params.since)
+        deleted = [i for i, in query.order_by(DatabaseOrderTombstone.order_id)]
+
+    if encoder is None:
+        upserted = [dict(zip(OrdersJSONStream.fields, row)) for row in upserted]
+        response = jsonify(version=version, upserted=upserted, deleted=deleted)
+    else:
+        # upserted orders are in batches field
+        encoded = b"".join(encoder.encode(upserted, version=version, deleted=deleted))
+        response = Response(encoded, mimetype=encoder.mimetype)
+
+    response.set_etag(etag, weak=True)
+    response.vary.add("Accept")
+    return response
+
+
+@app.route("/orders/aggregates/")
+def get_orders_aggregates():
+    """
+    Return orders count and prices totals overall, overdue and by supply date
+    from daily totals, which are maintained by refresher
+    """
+
+    today = datetime.now().date()
+    # overdue totals change with date as well as with dataset version
+    etag = f"{get_orders_version()}-{today.isoformat()}"
+
+    # aggregates are json only
+    not_modified = make_not_modified(etag, vary=("Accept-Encoding",))
+
+    if not_modified is not None:
+        return not_modified
+
+    with Session(get_engine("backend")) as session:
+        query = session.query(DatabaseOrdersDailyTotal)
+        daily_totals = query.order_by(DatabaseOrdersDailyTotal.supply_date).all()
+
+    def sum_totals(totals: list[DatabaseOrdersDailyTotal]) -> dict[str, Any]:
+        return {
+            "orders_count": sum(t.orders_count for t in totals),
+            "price_usd": sum((t.price_usd for t in totals), Decimal(0)),
+            "price_rub": sum((t.price_rub or Decimal(0) for t in totals), Decimal(0)),
+        }
+
+    response = jsonify(
+        total=sum_totals(daily_totals),
+        overdue=sum_totals([t for t in daily_totals if t.supply_date < today]),
+        by_supply_date=[t.dict() for t in daily_totals],
+    )
+    response.set_etag(etag, weak=True)
+    return response
+
+
+@app.route("/orders/events/")
+def stream_orders_events():
+    """
+    Stream orders changes summaries as server-sent events. Current dataset version
+    is sent first, so client can fetch changes since the version it already has
+    """
+
+    queue = get_orders_listener().subscribe()
+    version = get_orders_version()
+
+    def generate() -> Iterable[str]:
+        try:
+            yield f"event: orders\ndata: {json.dumps({'version': version})}\n\n"
+
+            while True:
+                try:
+                    _, payload = queue.get(timeout=events_keepalive_interval)
+                except Empty:
+                    # comment line keeps connection alive through proxies
+                    yield ": keepalive\n\n"
+                    continue
+
+                # summaries could be missed, send current version instead
+                if payload is None:
+                    payload = json.dumps({"version": get_orders_version()})
+
+                yield f"event: orders\ndata: {payload}\n\n"
+        finally:
+            get_orders_listener().unsubscribe(queue)
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/orders/")
+def get_orders_page():
+    """
+    Return orders page sorted by table_id and order_id inside json object, filtered by
+    query parameters. Next page starts after the last order of given page, see next field
+    """
+
+    try:
+        params = OrdersPageQuery.parse_obj(request.args.to_dict())
+    except ValidationError as e:
+        return jsonify(errors=e.errors()), 400
+
+    today = datetime.now().date()
+    encoder = negotiate_encoder()
+
+    # overdue orders change with date as well as with dataset version
+    etag = make_orders_etag(get_orders_version(), encoder, today if params.overdue else None)
+
+    not_modified = make_not_modified(etag)
+
+    if not_modified is not None:
+        return not_modified
+
+    columns = [getattr(DatabaseOrder, field) for field in OrdersJSONStream.fields]
+    query_conditions = []
+
+    # keyset pagination by table_id and order_id, which are index range scans
+    if params.after_order_id is not None:
+        cursor = (params.after_table_id, params.after_order_id)
+        query_conditions.append(tuple_(DatabaseOrder.table_id, DatabaseOrder.order_id) > cursor)
+    elif params.after_table_id is not None:
+        query_conditions.append(DatabaseOrder.table_id > params.after_table_id)
+
+    for column, value in (
+        (DatabaseOrder.supply_date, params.supply_date_from),
+        (DatabaseOrder.price_usd, params.price_usd_min),
+        (DatabaseOrder.price_rub, params.price_rub_min),
+    ):
+        if value is not None:
+            query_conditions.append(column >= value)
+
+    for column, value in (
+        (DatabaseOrder.supply_date, params.supply_date_to),
+        (DatabaseOrder.price_usd, params.price_usd_max),
+        (DatabaseOrder.price_rub, params.price_rub_max),
+    ):
+        if value is not None:
+            query_conditions.append(column <= value)
+
+    if params.overdue:
+        query_conditions.append(DatabaseOrder.supply_date < today)
+
+    with Session(get_engine("backend")) as session:
+        query = session.query(*columns).where(*query_conditions)
+        query = query.order_by(DatabaseOrder.table_id, DatabaseOrder.order_id)
+        rows = query.limit(params.limit).all()
+
+    next_page = None
+
+    if len(rows) == params.limit:
+        next_page = {
+            "after_table_id": rows[-1].table_id,
+            "after_order_id": rows[-1].order_id,
+        }
+
+    if encoder is None:
+        orders = [dict(zip(OrdersJSONStream.fields, row)) for row in rows]
+        response = jsonify(results=orders, next=next_page)
+    else:
+        # orders are in batches field
+        encoded = b"".join(encoder.encode(rows, next=next_page))
+        response = Response(encoded, mimetype=encoder.mimetype)
+
+    response.set_etag(etag, weak=True)
+    response.vary.add("Accept")
+    return response
+
+
+@app.route("/metrics")
+def get_metrics():
+    """Return metrics in prometheus text format, if they are enabled"""
+
+    if not metrics.is_enabled():
+        abort(404)
+
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,133 @@
+import json
+import zlib
+from abc import ABC, abstractmethod
+from datetime import date
+from decimal import Decimal
+from itertools import islice
+from typing import Any, Iterable
+
+import brotli
+import msgpack
+
+from app.schemas import Money
+
+JSON_MIMETYPE = "application/json"
+COLUMNAR_JSON_MIMETYPE = "application/vnd.orders.columnar+json"
+MSGPACK_MIMETYPE = "application/msgpack"
+
+# preferred first
+ENCODINGS = ["br", "gzip"]
+
+
+class ColumnarOrdersEncoder(ABC):
+    """
+    Abstract columnar orders encoder. Orders are encoded in batches with one array per
+    field, money as integer number of minimal units, see money_scale, dates as iso strings
+    """
+
+    mimetype: str
+    batch_size = 1000
+
+    def __init__(self, fields: list[str]):
+        self._fields = fields
+        self._money_scale = -Money.quant.as_tuple().exponent
+
+    def _encode_value(self, value: Any) -> Any:
+        """Encode single order value"""
+
+        if isinstance(value, Decimal):
+            return int(value.scaleb(self._money_scale))
+        if isinstance(value, date):
+            return value.isoformat()
+        return value
+
+    def _make_header(self, extra: dict[str, Any]) -> dict[str, Any]:
+        """Make document header with fields, money scale and given extra values"""
+        return {"fields": self._fields, "money_scale": self._money_scale, **extra}
+
+    def _iter_batches(self, rows: Iterable[tuple]) -> Iterable[dict[str, list]]:
+        """Yield rows by batches of columns"""
+
+        rows = iter(rows)
+
+        while batch := list(islice(rows, self.batch_size)):
+            columns = zip(*batch)
+            yield {
+                field: [self._encode_value(value) for value in column]
+                for field, column in zip(self._fields, columns)
+            }
+
+    @abstractmethod
+    def encode(self, rows: Iterable[tuple], **extra: Any) -> Iterable[bytes]:
+        """Must encode rows with values in fields order and extra document values"""
+
+
+class ColumnarJSONOrdersEncoder(ColumnarOrdersEncoder):
+    """Columnar orders encoder to json document with header values and batches field"""
+
+    mimetype = COLUMNAR_JSON_MIMETYPE
+
+    @staticmethod
+    def _dumps(value: Any) -> str:
+        return json.dumps(value, separators=(",", ":"))
+
+    def encode(self, rows: Iterable[tuple], **extra: Any) -> Iterable[bytes]:
+        # header object is open for batches field
+        header = self._dumps(self._make_header(extra))
+        yield (header[:-1] + ',"batches":[').encode()
+
+        separator = ""
+
+        for batch in self._iter_batches(rows):
+            yield (separator + self._dumps(batch)).encode()
+            separator = ","
+
+        yield b"]}\n"
+
+
+class MsgpackOrdersEncoder(ColumnarOrdersEncoder):
+    """Columnar orders encoder to msgpack objects stream: header map, then batch maps"""
+
+    mimetype = MSGPACK_MIMETYPE
+
+    def encode(self, rows: Iterable[tuple], **extra: Any) -> Iterable[bytes]:
+        packer = msgpack.Packer()
+        yield packer.pack(self._make_header(extra))
+
+        for batch in self._iter_batches(rows):
+            yield packer.pack(batch)
+
+
+ENCODERS = {
+    ColumnarJSONOrdersEncoder.mimetype: ColumnarJSONOrdersEncoder,
+    MsgpackOrdersEncoder.mimetype: MsgpackOrdersEncoder,
+    "application/x-msgpack": MsgpackOrdersEncoder,
+}
+
+
+def compress_stream(chunks: Iterable[bytes | str], encoding: str) -> Iterable[bytes]:
+    """Compress chunks with given content encoding on the fly"""
+
+    if encoding == "br":
+        # default quality is too slow for on the fly compression
+        compressor = brotli.Compressor(quality=5)
+        compress, flush = compressor.process, compressor.finish
+    elif encoding == "gzip":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+        compress, flush = compressor.compress, compressor.flush
+    else:
+        raise ValueError(f"Unsupported content encoding {encoding}")
+
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+
+        if compressed := compress(chunk):
+            yield compressed
+
+    yield flush()
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Compress data with given content encoding"""
+    return b"".join(compress_stream([data], encoding))
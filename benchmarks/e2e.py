@@ -0,0 +1,367 @@
+import gc
+import json
+import logging
+import os
+import random
+import threading
+import time
+from argparse import ArgumentParser
+from dataclasses import asdict, dataclass
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterable, Optional
+from urllib.parse import parse_qs, urlparse
+
+import telebot.apihelper
+from sqlalchemy import event, select, update
+from sqlalchemy.engine import Engine
+from sqlmodel import SQLModel
+
+from app.database import (
+    ORDERS_DATASET,
+    DatabaseDatasetVersion,
+    DatabaseRate,
+    DatabaseRecipient,
+    get_engine,
+)
+from app.logger import logger
+from app.migrations import migrate, migrations_table
+from app.notifier.backends import BulkDatabaseBackend as NotifierBackend
+from app.notifier.notifier import Notifier
+from app.notifier.providers import TelegramProvider
+from app.refresher.backends import BulkDatabaseBackend as RefresherBackend
+from app.refresher.extractors import BaseExtractor
+from app.refresher.rates import DatabaseRateStore
+from app.refresher.refresher import Refresher
+from app.refresher.serializers import GSOrdersBatchSerializer
+from app.schemas import BaseOrder, NotificationScope, Provider
+from app.webapp.backend import app
+
+SEED = 42
+USDRUB_RATE = "61,2345"
+CHUNK_SIZE = 1000
+
+# share of orders, which are updated, deleted and inserted between refreshes
+CHURN_SHARE = 0.01
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "e2e_baseline.json")
+
+
+@dataclass
+class StageResult:
+    """Single stage measurements"""
+
+    wall_time: float
+    queries: int
+    peak_memory: int
+
+
+class SyntheticExtractor(BaseExtractor):
+    """Extractor of generated sheet rows, serialized by chunks as google sheets' ones"""
+
+    def __init__(self, raw_orders: list[list[str]]):
+        self.raw_orders = raw_orders
+
+    def extract_orders(self) -> list[BaseOrder]:
+        return [order for chunk in self.extract_orders_chunks() for order in chunk]
+
+    def extract_orders_chunks(self) -> Iterable[list[BaseOrder]]:
+        for first_row in range(0, len(self.raw_orders), CHUNK_SIZE):
+            raw_orders = self.raw_orders[first_row : first_row + CHUNK_SIZE]
+            yield GSOrdersBatchSerializer(raw_orders, first_row + 2).serialize()[0]
+
+
+class UnlimitedTelegramProvider(TelegramProvider):
+    """Telegram provider without bots api limits, which fake api does not need"""
+
+    messages_rate = 1_000_000
+    chat_messages_rate = 1_000_000
+
+
+class FakeCbrfHandler(BaseHTTPRequestHandler):
+    """Cbrf's XML_dynamic.asp with the same rate for every day of requested range"""
+
+    def _get_value(self, rate_date: date) -> Optional[str]:
+        """Return rate value of given date, None if rate is not set on that date"""
+        return USDRUB_RATE
+
+    def do_GET(self):
+        params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        first_date = datetime.strptime(params["date_req1"], "%d/%m/%Y").date()
+        last_date = datetime.strptime(params["date_req2"], "%d/%m/%Y").date()
+
+        records = []
+
+        while first_date <= last_date:
+            value = self._get_value(first_date)
+
+            if value is not None:
+                records.append(
+                    f'<Record Date="{first_date:%d.%m.%Y}" Id="{params["VAL_NM_RQ"]}">'
+                    f"<Nominal>1</Nominal><Value>{value}</Value></Record>"
+                )
+
+            first_date += timedelta(days=1)
+
+        self._respond("application/xml", f"<ValCurs>{''.join(records)}</ValCurs>")
+
+    def _respond(self, content_type: str, body: str):
+        """Send successful response with given body"""
+
+        data = body.encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *_):
+        pass
+
+
+class FakeTelegramHandler(FakeCbrfHandler):
+    """Telegram bots api, which accepts every sent message"""
+
+    sent_counter = 0
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        params = parse_qs(urlparse(self.path).query) | parse_qs(self.rfile.read(length).decode())
+
+        FakeTelegramHandler.sent_counter += 1
+        message = {
+            "message_id": FakeTelegramHandler.sent_counter,
+            "date": int(time.time()),
+            "chat": {"id": int(params["chat_id"][0]), "type": "private"},
+            "text": "",
+        }
+        self._respond("application/json", json.dumps({"ok": True, "result": message}))
+
+    do_GET = do_POST
+
+
+def start_server(handler: type[BaseHTTPRequestHandler]) -> str:
+    """Serve handler on free local port in background thread, return its url"""
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+class Meter:
+    """
+    Measure stages' wall time, statements executed by all engines and peak resident memory,
+    which is sampled in background thread. Works on linux only
+    """
+
+    sampling_interval = 0.005
+
+    def __init__(self):
+        self._queries = 0
+        self._peak_memory = 0
+        self._page_size = os.sysconf("SC_PAGE_SIZE")
+        self._lock = threading.Lock()
+
+        event.listen(Engine, "before_cursor_execute", self._count_query)
+        threading.Thread(target=self._sample_memory, daemon=True).start()
+
+    def _count_query(self, *_):
+        with self._lock:
+            self._queries += 1
+
+    def _get_memory(self) -> int:
+        """Return current resident memory in bytes"""
+
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * self._page_size
+
+    def _sample_memory(self):
+        while True:
+            self._peak_memory = max(self._peak_memory, self._get_memory())
+            time.sleep(self.sampling_interval)
+
+    def measure(self, function: Callable) -> StageResult:
+        """Run function and measure it"""
+
+        gc.collect()
+
+        self._peak_memory = self._get_memory()
+        queries_before = self._queries
+        started_at = time.perf_counter()
+
+        function()
+
+        wall_time = time.perf_counter() - started_at
+        peak_memory = max(self._peak_memory, self._get_memory())
+
+        return StageResult(wall_time, self._queries - queries_before, peak_memory)
+
+
+def generate_raw_order(rnd: random.Random, i: int, due_share: float) -> list[str]:
+    """Generate sheet row, which is due today or earlier with due_share probability"""
+
+    today = datetime.now().date()
+
+    if rnd.random() < due_share:
+        supply_date = today - timedelta(days=rnd.randint(0, 30))
+    else:
+        supply_date = today + timedelta(days=rnd.randint(1, 365))
+
+    price_usd = f"{rnd.randint(1, 100_000)}.{rnd.randint(0, 99):02}"
+    return [str(i + 1), str(1_000_000 + i), price_usd, supply_date.strftime("%d.%m.%Y")]
+
+
+def churn_raw_orders(rnd: random.Random, raw_orders: list[list[str]], due_share: float):
+    """Update prices, delete and insert CHURN_SHARE of orders each"""
+
+    count = int(len(raw_orders) * CHURN_SHARE)
+    last_id = max(int(raw_order[0]) for raw_order in raw_orders)
+
+    for raw_order in rnd.sample(raw_orders, count):
+        raw_order[2] = f"{rnd.randint(1, 100_000)}.{rnd.randint(0, 99):02}"
+
+    for i in sorted(rnd.sample(range(len(raw_orders)), count), reverse=True):
+        del raw_orders[i]
+
+    raw_orders.extend(generate_raw_order(rnd, last_id + i, due_share) for i in range(count))
+
+
+def reset_database(engine: Engine, recipients_count: int):
+    """Drop all tables, migrate them again and add telegram recipients"""
+
+    SQLModel.metadata.drop_all(engine)
+    migrations_table.drop(engine, checkfirst=True)
+    migrate(engine)
+
+    with engine.begin() as connection:
+        recipients = [
+            {"provider": Provider.telegram, "provider_id": str(i)}
+            for i in range(1, recipients_count + 1)
+        ]
+        connection.execute(DatabaseRecipient.__table__.insert(), recipients)
+
+
+def change_rate(engine: Engine, rate_store: DatabaseRateStore):
+    """Change stored rates and forget cached ones, as if cbrf has published the next day's rate"""
+
+    with engine.begin() as connection:
+        table = DatabaseRate.__table__
+        connection.execute(update(table).values(value=table.c.value + Decimal("0.5")))
+
+    rate_store._cache.clear()
+
+
+def get_orders_version(engine: Engine) -> int:
+    """Return current orders dataset version"""
+
+    statement = select(DatabaseDatasetVersion.version)
+    statement = statement.where(DatabaseDatasetVersion.name == ORDERS_DATASET)
+
+    with engine.connect() as connection:
+        return connection.execute(statement).scalar() or 0
+
+
+def run_suite(
+    meter: Meter, orders_count: int, recipients_count: int, due_share: float
+) -> dict[str, StageResult]:
+    """Run all stages against orders_count generated orders, return results by stages"""
+
+    rnd, engine = random.Random(SEED), get_engine()
+    reset_database(engine, recipients_count)
+
+    extractor = SyntheticExtractor(
+        [generate_raw_order(rnd, i, due_share) for i in range(orders_count)]
+    )
+    rate_store = DatabaseRateStore(engine, base_url=start_server(FakeCbrfHandler))
+    refresher = Refresher(extractor, RefresherBackend(engine), rate_store)
+
+    provider = UnlimitedTelegramProvider("0:benchmark")
+    notifier = Notifier([provider], NotifierBackend(engine))
+    client = app.test_client()
+
+    results = {"refresh initial": meter.measure(refresher.refresh_orders)}
+    results["notify full"] = meter.measure(notifier.send_notifications)
+    results["refresh unchanged"] = meter.measure(refresher.refresh_orders)
+
+    churned_version = get_orders_version(engine)
+    churn_raw_orders(rnd, extractor.raw_orders, due_share)
+
+    results["refresh churned"] = meter.measure(refresher.refresh_orders)
+    scope = NotificationScope(since_version=churned_version)
+    results["notify churned"] = meter.measure(lambda: notifier.send_notifications(scope))
+    results["get all orders"] = meter.measure(
+        lambda: client.get("/give-me-everything-you-know/").get_data()
+    )
+
+    change_rate(engine, rate_store)
+    results["refresh repriced"] = meter.measure(refresher.refresh_orders)
+
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Return regressions of results' measurements, which exceed baseline more than threshold"""
+
+    regressions = []
+
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+
+        for name, value in result.items():
+            if value > baseline[key][name] * (1 + threshold):
+                regressions.append(f"{key} {name}: {value:.4g}, baseline {baseline[key][name]:.4g}")
+
+    return regressions
+
+
+def main():
+    """
+    Measure wall time, statements count and peak resident memory of refresher, notifier and
+    all orders endpoint stages with generated sheet, fake cbrf and fake telegram bots api.
+    Compare them with saved baseline. DATABASE_DSN must point to throwaway database,
+    all its tables are dropped
+    """
+
+    parser = ArgumentParser(description="End-to-end benchmark suite")
+    parser.add_argument("--orders", type=int, nargs="+", default=[10_000])
+    parser.add_argument("--recipients", type=int, default=1000)
+    parser.add_argument("--due-share", type=float, default=0.01)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    telebot.apihelper.API_URL = start_server(FakeTelegramHandler) + "/bot{0}/{1}"
+    logger.setLevel(logging.WARNING)
+    meter, results = Meter(), {}
+
+    for orders_count in args.orders:
+        stages = run_suite(meter, orders_count, args.recipients, args.due_share)
+
+        for stage, result in stages.items():
+            key = f"{orders_count} orders, {args.recipients} recipients, {stage}"
+            results[key] = asdict(result)
+            print(
+                f"{orders_count:>8} orders, {stage:18} {result.wall_time * 1000:9.1f}ms "
+                f"{result.queries:6} queries {result.peak_memory / 2**20:8.1f}MiB rss"
+            )
+
+    print(f"{FakeTelegramHandler.sent_counter} telegram messages sent")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+
+        if len(regressions):
+            raise SystemExit("\n".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
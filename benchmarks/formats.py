@@ -0,0 +1,154 @@
+import gzip
+import json
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Any, Callable
+
+import brotli
+import msgpack
+
+from app.schemas import BaseOrder, Money
+from app.webapp import formats
+
+ROWS_COUNT = 100_000
+FIELDS = sorted(BaseOrder.__fields__)
+MONEY_FIELDS = {"price_usd", "price_rub"}
+
+
+def generate_orders(count: int) -> list[dict[str, Any]]:
+    """Generate orders as database returns them"""
+
+    orders = []
+    first_date = date(2022, 1, 1)
+
+    for i in range(count):
+        price_usd = Money.validate(Decimal(random.randint(1, 10_000_000)) / 100)
+        orders.append(
+            {
+                "table_id": i + 1,
+                "order_id": 1_000_000 + i,
+                "price_usd": price_usd,
+                "price_rub": Money.validate(price_usd * Decimal("61.2345")),
+                "supply_date": first_date + timedelta(days=random.randint(0, 365)),
+            }
+        )
+
+    return orders
+
+
+def encode_json(orders: list[dict[str, Any]]) -> bytes:
+    """Encode orders as row-oriented json endpoint does"""
+
+    def default(value: Any) -> Any:
+        return value.isoformat() if isinstance(value, date) else float(value)
+
+    return json.dumps({"results": orders}, default=default, separators=(",", ":")).encode()
+
+
+def encode_columnar(encoder_class: type, orders: list[dict[str, Any]]) -> bytes:
+    """Encode orders with given columnar encoder"""
+
+    rows = [tuple(order[field] for field in FIELDS) for order in orders]
+    return b"".join(encoder_class(FIELDS).encode(rows, next=None))
+
+
+def decode_value(field: str, value: Any, money_scale: int = None) -> Any:
+    """Decode single order value into database type"""
+
+    if field in MONEY_FIELDS:
+        if money_scale is None:
+            return Money.validate(Decimal(repr(value)))
+        return Decimal(value).scaleb(-money_scale)
+    if field == "supply_date":
+        return date.fromisoformat(value)
+    return value
+
+
+def decode_json(data: bytes) -> list[dict[str, Any]]:
+    """Decode row-oriented json orders"""
+
+    return [
+        {field: decode_value(field, value) for field, value in order.items()}
+        for order in json.loads(data)["results"]
+    ]
+
+
+def decode_batches(header: dict[str, Any], batches: list[dict[str, list]]) -> list[dict]:
+    """Decode columnar orders batches"""
+
+    orders = []
+
+    for batch in batches:
+        columns = [
+            [decode_value(field, value, header["money_scale"]) for value in batch[field]]
+            for field in header["fields"]
+        ]
+        orders.extend(dict(zip(header["fields"], row)) for row in zip(*columns))
+
+    return orders
+
+
+def decode_columnar_json(data: bytes) -> list[dict[str, Any]]:
+    """Decode columnar json orders"""
+
+    document = json.loads(data)
+    return decode_batches(document, document["batches"])
+
+
+def decode_msgpack(data: bytes) -> list[dict[str, Any]]:
+    """Decode msgpack orders stream"""
+
+    unpacker = msgpack.Unpacker()
+    unpacker.feed(data)
+
+    header, *batches = unpacker
+    return decode_batches(header, batches)
+
+
+def measure(function: Callable, *args: Any) -> tuple[float, Any]:
+    """Return function's wall time and result"""
+
+    started_at = time.perf_counter()
+    result = function(*args)
+
+    return time.perf_counter() - started_at, result
+
+
+def main():
+    orders = generate_orders(ROWS_COUNT)
+
+    payloads = {
+        formats.JSON_MIMETYPE: (encode_json(orders), decode_json),
+        formats.COLUMNAR_JSON_MIMETYPE: (
+            encode_columnar(formats.ColumnarJSONOrdersEncoder, orders),
+            decode_columnar_json,
+        ),
+        formats.MSGPACK_MIMETYPE: (
+            encode_columnar(formats.MsgpackOrdersEncoder, orders),
+            decode_msgpack,
+        ),
+    }
+
+    decompressors = {"identity": bytes, "gzip": gzip.decompress, "br": brotli.decompress}
+
+    print(f"{ROWS_COUNT} orders")
+
+    for mimetype, (data, decode) in payloads.items():
+        for encoding, decompress in decompressors.items():
+            if encoding == "identity":
+                compressed = data
+            else:
+                compressed = formats.compress(data, encoding)
+
+            decode_time, _ = measure(lambda: decode(decompress(compressed)))
+
+            print(
+                f"{mimetype:40} {encoding:8} {len(compressed) / 1024:9.1f} KiB, "
+                f"decoded in {decode_time:.3f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
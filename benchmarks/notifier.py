@@ -0,0 +1,131 @@
+import random
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from statistics import median
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlmodel import SQLModel
+
+from app.database import get_engine, DatabaseOrder, DatabaseRecipient, DatabaseNotifiedState
+from app.migrations import migrate, migrations_table
+from app.notifier.backends import BulkDatabaseBackend
+from app.schemas import Provider
+
+RECIPIENTS_COUNT = 50
+ORDERS_COUNT = 2000
+# orders replaced by refresher every day
+DAILY_CHURN = 100
+MONTHS_COUNT = 6
+
+
+def reset_database(engine: Engine, foreign_keys: bool):
+    """Drop all tables and migrate them again, optionally without notified foreign keys"""
+
+    SQLModel.metadata.drop_all(engine)
+    migrations_table.drop(engine, checkfirst=True)
+    migrate(engine)
+
+    if not foreign_keys:
+        with engine.begin() as connection:
+            for constraint in DatabaseNotifiedState.__table__.foreign_key_constraints:
+                connection.execute(text(f"ALTER TABLE notified DROP CONSTRAINT {constraint.name}"))
+
+    with engine.begin() as connection:
+        recipients = [
+            {"provider": Provider.telegram, "provider_id": str(i)} for i in range(RECIPIENTS_COUNT)
+        ]
+        connection.execute(DatabaseRecipient.__table__.insert(), recipients)
+
+
+def replace_orders(engine: Engine, first_order_id: int, count: int):
+    """Delete count oldest orders and insert the same count of already due orders"""
+
+    today = datetime.now().date()
+
+    orders = [
+        {
+            "table_id": order_id,
+            "order_id": order_id,
+            "price_usd": Decimal(random.randint(1, 100_000)),
+            "price_rub": None,
+            "supply_date": today - timedelta(days=random.randint(0, 30)),
+        }
+        for order_id in range(first_order_id, first_order_id + count)
+    ]
+
+    with engine.begin() as connection:
+        deleted_ids = DatabaseOrder.order_id < first_order_id - ORDERS_COUNT + count
+        connection.execute(DatabaseOrder.__table__.delete().where(deleted_ids))
+        connection.execute(DatabaseOrder.__table__.insert(), orders)
+
+
+def notify(backend: BulkDatabaseBackend) -> float:
+    """Mark all actual notifications as sent, return scan time"""
+
+    started_at = time.perf_counter()
+    notifications = list(backend.get_notifications_for_provider(Provider.telegram))
+    scan_time = time.perf_counter() - started_at
+
+    backend.mark_notifications_sending(notifications)
+    backend.mark_notifications_sent(notifications, [])
+
+    return scan_time
+
+
+def simulate(engine: Engine, foreign_keys: bool) -> list[tuple[float, int]]:
+    """Simulate daily orders churn, return median scan time and notified size by months"""
+
+    reset_database(engine, foreign_keys)
+    backend = BulkDatabaseBackend(engine)
+
+    replace_orders(engine, 0, ORDERS_COUNT)
+    notify(backend)
+
+    next_order_id, months = ORDERS_COUNT, []
+
+    for _ in range(MONTHS_COUNT):
+        scan_times = []
+
+        for _ in range(30):
+            replace_orders(engine, next_order_id, DAILY_CHURN)
+            next_order_id += DAILY_CHURN
+            scan_times.append(notify(backend))
+
+            # keep planner statistics actual, as autovacuum would do
+            with engine.begin() as connection:
+                connection.execute(text("ANALYZE orders, notified"))
+
+        with engine.connect() as connection:
+            notified_count = connection.execute(text("SELECT count(*) FROM notified")).scalar()
+
+        months.append((median(scan_times), notified_count))
+
+    return months
+
+
+def main():
+    """
+    Compare notifier scan time over months of orders churn with and without cascade
+    foreign keys. DATABASE_DSN must point to throwaway database, all its tables are dropped
+    """
+
+    engine = get_engine()
+
+    results = {
+        "orphans kept": simulate(engine, foreign_keys=False),
+        "cascade deletes": simulate(engine, foreign_keys=True),
+    }
+
+    print(f"{RECIPIENTS_COUNT} recipients, {ORDERS_COUNT} orders, {DAILY_CHURN} replaced daily")
+
+    for name, months in results.items():
+        print(name)
+
+        for month, (scan_time, notified_count) in enumerate(months, start=1):
+            print(f"  month {month}: scan {scan_time * 1000:7.1f}ms, {notified_count} notified")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from pydantic import ValidationError
+
+from app.refresher.serializers import GSOrderSerializer, GSOrdersBatchSerializer
+from app.schemas import BaseOrder, Money
+
+ROWS_COUNT = 100_000
+USDRUB_RATE = Decimal("61.2345")
+
+
+def generate_raw_orders(count: int) -> list[list[str]]:
+    """Generate google sheet's raw orders with a few invalid rows"""
+
+    raw_orders = []
+    first_date = date(2022, 1, 1)
+
+    for i in range(count):
+        price_usd = f"{random.randint(1, 100_000)}.{random.randint(0, 999)}"
+        supply_date = (first_date + timedelta(days=random.randint(0, 365))).strftime("%d.%m.%Y")
+        raw_orders.append([str(i + 1), str(1_000_000 + i), price_usd, supply_date])
+
+    for i in range(0, count, 1000):
+        raw_orders[i] = raw_orders[i][:2] + ["invalid", "32.13.2022"]
+
+    return raw_orders
+
+
+def serialize_per_row(raw_orders: list[list[str]]) -> list[BaseOrder]:
+    """Serialize and price orders as refresher used to do it"""
+
+    orders = []
+
+    for raw_order in raw_orders:
+        try:
+            order = GSOrderSerializer(raw_order).serialize()
+        except ValidationError:
+            continue
+
+        order.price_rub = order.price_usd * USDRUB_RATE
+        orders.append(BaseOrder(**order.dict()))
+
+    return orders
+
+
+def serialize_batch(raw_orders: list[list[str]]) -> list[BaseOrder]:
+    """Serialize orders in batch and price them with explicit validation"""
+
+    orders, _ = GSOrdersBatchSerializer(raw_orders).serialize()
+
+    for order in orders:
+        order.price_rub = Money.validate(order.price_usd * USDRUB_RATE)
+
+    return orders
+
+
+def measure(function, raw_orders: list[list[str]]) -> tuple[float, list[BaseOrder]]:
+    """Return function's wall time and result"""
+
+    started_at = time.perf_counter()
+    result = function(raw_orders)
+
+    return time.perf_counter() - started_at, result
+
+
+def main():
+    raw_orders = generate_raw_orders(ROWS_COUNT)
+
+    per_row_time, per_row_orders = measure(serialize_per_row, raw_orders)
+    batch_time, batch_orders = measure(serialize_batch, raw_orders)
+
+    assert [o.dict() for o in per_row_orders] == [o.dict() for o in batch_orders]
+
+    print(f"{ROWS_COUNT} rows, {len(batch_orders)} valid")
+    print(f"per-row: {per_row_time:.3f}s")
+    print(f"batch:   {batch_time:.3f}s ({per_row_time / batch_time:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
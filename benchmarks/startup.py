@@ -0,0 +1,101 @@
+import json
+import subprocess
+import sys
+from statistics import median
+
+RUNS_COUNT = 5
+
+# entry point, its module, attribute and whether it is scheduled script or flask app
+ENTRY_POINTS = {
+    "refresh": ("scripts.refresh", "refresh_orders", "script"),
+    "notify": ("scripts.notify", "send_notifications", "script"),
+    "polling": ("scripts.polling", "start_polling", "script"),
+    "backend": ("app.webapp.backend", "app", "flask"),
+}
+
+# libraries, which entry points must import only when they are needed
+HEAVY_MODULES = {"gspread", "telebot", "flask"}
+ALLOWED_MODULES = {"backend": {"flask"}}
+
+# started in fresh interpreter, measures import and first tick, prints json result
+CHILD_CODE = """
+import importlib, json, sys, time
+
+started_at = time.perf_counter()
+module_name, attribute, kind = sys.argv[1:]
+target = getattr(importlib.import_module(module_name), attribute)
+imported_at = time.perf_counter()
+
+import app.database
+
+loaded = sorted(m for m in {heavy_modules!r} if m in sys.modules)
+engines = sorted(app.database._engines)
+
+if kind == "script":
+    from utils.scheduler import Scheduler
+
+    scheduler, ticks = Scheduler(), []
+
+    def first_tick():
+        ticks.append(time.perf_counter())
+        scheduler.stop()
+
+    scheduler.add_job(first_tick, target.interval, jitter=0)
+    scheduler.run()
+    ticked_at = ticks[0]
+else:
+    target.test_client().get("/orders/aggregates/")
+    ticked_at = time.perf_counter()
+
+print(json.dumps({{
+    "import_time": imported_at - started_at,
+    "first_tick_time": ticked_at - started_at,
+    "loaded_modules": loaded,
+    "engines": engines,
+}}))
+"""
+
+
+def measure(module_name: str, attribute: str, kind: str) -> dict:
+    """Start entry point in fresh interpreter, return its startup measurements"""
+
+    code = CHILD_CODE.format(heavy_modules=HEAVY_MODULES)
+    result = subprocess.run(
+        [sys.executable, "-c", code, module_name, attribute, kind],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def main():
+    """
+    Measure import time and time to first scheduler tick or first backend request of every
+    entry point. Fail if entry point imports unneeded heavy library or connects to database
+    at import. DATABASE_DSN must point to migrated database
+    """
+
+    failures = []
+
+    for name, (module_name, attribute, kind) in ENTRY_POINTS.items():
+        runs = [measure(module_name, attribute, kind) for _ in range(RUNS_COUNT)]
+
+        import_time = median(run["import_time"] for run in runs) * 1000
+        first_tick_time = median(run["first_tick_time"] for run in runs) * 1000
+        print(f"{name:8} import {import_time:7.1f}ms, first tick {first_tick_time:7.1f}ms")
+
+        unneeded_modules = set(runs[0]["loaded_modules"]) - ALLOWED_MODULES.get(name, set())
+
+        if len(unneeded_modules):
+            failures.append(f"{name} imports {', '.join(sorted(unneeded_modules))}")
+        if len(runs[0]["engines"]):
+            failures.append(f"{name} creates {', '.join(runs[0]['engines'])} engine(s) at import")
+
+    if len(failures):
+        sys.exit("\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+from app.database import get_engine
+from app.migrations import migrate
+
+
+def migrate_database():
+    """Create or migrate database models, run it once before starting scripts and backend"""
+    migrate(get_engine("migrations"))
+
+
+if __name__ == "__main__":
+    migrate_database()
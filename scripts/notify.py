@@ -1,22 +1,59 @@
 from datetime import timedelta
+from functools import lru_cache
 
-from app.database import engine
-from app.notifier.backends import DatabaseBackend
+from app import events
+from app.database import get_engine
+from app.notifier.backends import BulkDatabaseBackend
 from app.notifier.notifier import Notifier
 from app.notifier.providers import TelegramProvider
-from app.settings import settings
+from app.notifier.triggers import NotificationTrigger
+from app.settings import get_settings
 from utils.scripts import script
 
 
-@script(interval=timedelta(seconds=10))
-def send_notifications():
-    """Notify all telegram recipients using data from DatabaseBackend"""
+@lru_cache(maxsize=1)
+def get_notifier() -> Notifier:
+    """Create Notifier with TelegramProvider and BulkDatabaseBackend"""
 
+    settings = get_settings()
     provider = TelegramProvider(settings.telegram_bot_token)
-    backend = DatabaseBackend(engine)
+    backend = BulkDatabaseBackend(get_engine("notifier"))
+
+    return Notifier(
+        [provider],
+        backend,
+        workers=settings.notifier_workers,
+        batch_size=settings.notifier_batch_size,
+        sending_timeout=timedelta(seconds=settings.notifier_sending_timeout),
+    )
+
+
+# trigger must live between runs to collect events
+@lru_cache(maxsize=1)
+def get_trigger() -> NotificationTrigger:
+    """Create NotificationTrigger, which listens orders and recipients channels"""
+
+    channels = [events.ORDERS_CHANNEL, events.RECIPIENTS_CHANNEL]
+    return NotificationTrigger(events.Listener(get_settings().database_dsn, channels))
+
+
+@script(interval=timedelta(seconds=1))
+def send_notifications():
+    """Notify telegram recipients affected by refresher and polling events since last run"""
+
+    trigger = get_trigger()
+    scope = trigger.get_scope()
+
+    if not scope:
+        return
+
+    try:
+        failed_recipients = get_notifier().send_notifications(scope)
+    except Exception:
+        trigger.reset()
+        raise
 
-    notifier = Notifier([provider], backend)
-    notifier.send_notifications()
+    trigger.retry(failed_recipients)
 
 
 if __name__ == "__main__":
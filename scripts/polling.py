@@ -1,9 +1,9 @@
 from datetime import timedelta
 
-from app.database import engine
+from app.database import get_engine
 from app.notifier.backends import DatabaseBackend
 from app.notifier.providers import TelegramPollingClient
-from app.settings import settings
+from app.settings import get_settings
 from utils.scripts import script
 
 
@@ -11,8 +11,8 @@ from utils.scripts import script
 def start_polling():
     """Start telegram bot polling and save all contacted users as recipients"""
 
-    backend = DatabaseBackend(engine)
-    polling_client = TelegramPollingClient(backend, settings.telegram_bot_token)
+    backend = DatabaseBackend(get_engine("polling"))
+    polling_client = TelegramPollingClient(backend, get_settings().telegram_bot_token)
 
     polling_client.start_polling()
 
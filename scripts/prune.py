@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import inspect
+
+from app.database import get_engine
+from app.logger import logger
+from app.migrations import prune_notified_states, prune_order_tombstones
+from app.settings import get_settings
+
+BATCH_SIZE = 10_000
+
+
+def prune_orphaned_notified_states():
+    """Delete orphaned notified states by batches in separate transactions"""
+
+    pruned_counter = 0
+
+    while True:
+        with get_engine("migrations").begin() as connection:
+            pruned = prune_notified_states(connection, BATCH_SIZE)
+
+        pruned_counter += pruned
+        logger.info(f"Pruned {pruned_counter} orphaned notified state(s)")
+
+        if pruned < BATCH_SIZE:
+            break
+
+
+def prune_expired_order_tombstones():
+    """
+    Delete tombstones of orders deleted before retention by batches in separate
+    transactions. Tombstones are kept until migrations add time of deletion
+    """
+
+    inspector = inspect(get_engine("migrations"))
+
+    if not inspector.has_table("order_tombstones"):
+        return
+
+    if "deleted_at" not in {c["name"] for c in inspector.get_columns("order_tombstones")}:
+        logger.info("Order tombstones have no time of deletion before migrations, they are kept")
+        return
+
+    retention_days = get_settings().order_tombstones_retention_days
+    deleted_before = datetime.now() - timedelta(days=retention_days)
+    pruned_counter = 0
+
+    while True:
+        with get_engine("migrations").begin() as connection:
+            pruned = prune_order_tombstones(connection, deleted_before, BATCH_SIZE)
+
+        pruned_counter += pruned
+        logger.info(f"Pruned {pruned_counter} order tombstone(s) older than {retention_days} days")
+
+        if pruned < BATCH_SIZE:
+            break
+
+
+def prune():
+    """
+    Delete orphaned notified states and expired order tombstones, so pruning of large
+    tables does not hold long locks. Run it before migrations, which add foreign keys,
+    and then periodically
+    """
+
+    prune_orphaned_notified_states()
+    prune_expired_order_tombstones()
+
+
+if __name__ == "__main__":
+    prune()
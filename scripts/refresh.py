@@ -1,22 +1,54 @@
 from datetime import timedelta
+from functools import lru_cache
 
-from app.database import engine
-from app.refresher.backends import DatabaseBackend
+from app.database import get_engine
+from app.refresher import cbrf
+from app.refresher.backends import BulkDatabaseBackend
 from app.refresher.extractors import GSExtractor
-from app.refresher.refresher import Refresher
-from app.settings import settings
+from app.refresher.rates import DatabaseRateStore
+from app.refresher.refresher import MultiSourceRefresher, Refresher
+from app.settings import get_settings
 from utils.scripts import script
 
 
-@script(interval=timedelta(seconds=5))
-def refresh_orders():
-    """Refresh orders with GSExtractor and DatabaseBackend"""
+# refresher must live between runs to keep applied orders' fingerprints
+@lru_cache(maxsize=1)
+def get_refresher() -> Refresher | MultiSourceRefresher:
+    """
+    Create Refresher with GSExtractor, BulkDatabaseBackend and DatabaseRateStore,
+    or MultiSourceRefresher with GSExtractor of every sheet source if they are set
+    """
+
+    settings, engine = get_settings(), get_engine("refresher")
+    backend = BulkDatabaseBackend(engine)
+    rate_store = DatabaseRateStore(
+        engine,
+        base_url=settings.cbrf_url or cbrf.BASE_URL,
+        timeout=settings.cbrf_timeout or cbrf.TIMEOUT,
+        prefetch_days=settings.cbrf_prefetch_days,
+        use_last_known_rate=settings.cbrf_use_last_known_rate,
+    )
+
+    if len(settings.google_sheets):
+        extractors = [
+            GSExtractor(
+                sheet.sheet_key,
+                chunk_size=1000,
+                worksheet=sheet.worksheet,
+                source=sheet.source,
+            )
+            for sheet in settings.google_sheets
+        ]
+        return MultiSourceRefresher(extractors, backend, rate_store, settings.refresher_workers)
 
-    extractor = GSExtractor(settings.google_sheet_key)
-    backend = DatabaseBackend(engine)
+    extractor = GSExtractor(settings.google_sheet_key, chunk_size=1000)
+    return Refresher(extractor, backend, rate_store)
 
-    refresher = Refresher(extractor, backend)
-    refresher.refresh_orders()
+
+@script(interval=timedelta(seconds=5))
+def refresh_orders():
+    """Refresh changed orders with long-lived refresher"""
+    get_refresher().refresh_orders()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,38 @@
+from argparse import ArgumentParser
+
+from app import metrics
+from scripts.notify import send_notifications
+from scripts.polling import start_polling
+from scripts.refresh import refresh_orders
+from utils.scheduler import Scheduler
+
+SCRIPTS = {
+    "refresh": refresh_orders,
+    "notify": send_notifications,
+    "polling": start_polling,
+}
+
+
+def run_scripts(names: list[str]):
+    """Run given scripts as jobs of single scheduler, so they share process"""
+
+    metrics.setup(serve=True)
+    scheduler = Scheduler()
+
+    for name in names:
+        script = SCRIPTS[name]
+        scheduler.add_job(script.__wrapped__, script.interval, name=name)
+
+    scheduler.run()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Run several scripts in one process")
+    parser.add_argument("scripts", nargs="*", help=f"any of {', '.join(SCRIPTS)}, all by default")
+    names = parser.parse_args().scripts or list(SCRIPTS)
+
+    # choices of optional positional argument do not work with empty list
+    if unknown_names := set(names) - set(SCRIPTS):
+        parser.error(f"unknown scripts: {', '.join(sorted(unknown_names))}")
+
+    run_scripts(names)
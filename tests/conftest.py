@@ -0,0 +1,141 @@
+import os
+from decimal import Decimal
+from typing import Optional
+
+import pytest
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlmodel import SQLModel
+
+from app.database import DEFAULT_SOURCE, get_engine
+from app.migrations import migrate, migrations_table
+from app.refresher.backends import BaseBackend
+from app.refresher.extractors import BaseExtractor
+from app.refresher.rates import BaseRateStore
+from app.schemas import BaseOrder, Money
+
+
+class MemoryBackend(BaseBackend):
+    """Backend, which keeps orders of every source in memory"""
+
+    def __init__(self):
+        self.orders: dict[str, dict[int, BaseOrder]] = {}
+        self.rates: dict[str, Decimal] = {}
+        self.refreshed_ids: list[int] = []
+        self.deleted_ids: list[int] = []
+
+    def _clear_unlisted_orders(self, listed_ids: list[int], source: str):
+        unlisted_ids = set(self.orders.get(source, {})) - set(listed_ids)
+        self._delete_orders(list(unlisted_ids), source)
+
+    def _delete_orders(self, order_ids: list[int], source: str):
+        for order_id in order_ids:
+            if self.orders.get(source, {}).pop(order_id, None) is not None:
+                self.deleted_ids.append(order_id)
+
+    def _refresh_order(self, order: BaseOrder, source: str) -> bool:
+        other_sources = (s for s, orders in self.orders.items() if s != source)
+
+        if any(order.order_id in self.orders[s] for s in other_sources):
+            return False
+
+        self.orders.setdefault(source, {})[order.order_id] = order.copy()
+        self.refreshed_ids.append(order.order_id)
+
+        return True
+
+    def _save_applied_rate(self, usdrub_rate: Decimal, source: str):
+        self.rates[source] = usdrub_rate
+
+    def get_fingerprints(self, source: str = DEFAULT_SOURCE) -> dict[int, tuple]:
+        orders = self.orders.get(source, {})
+        return {order_id: order.get_fingerprint() for order_id, order in orders.items()}
+
+    def get_applied_rate(self, source: str = DEFAULT_SOURCE) -> Optional[Decimal]:
+        return self.rates.get(source)
+
+    def reprice_orders(self, usdrub_rate: Decimal, source: str = DEFAULT_SOURCE) -> int:
+        orders = self.orders.get(source, {}).values()
+
+        for order in orders:
+            order.price_rub = Money.validate(order.price_usd * usdrub_rate)
+
+        self.rates[source] = usdrub_rate
+        return len(orders)
+
+
+class MemoryExtractor(BaseExtractor):
+    """Extractor of orders list, which is changed by tests with its version"""
+
+    def __init__(self, orders: list[BaseOrder] = None, source: str = DEFAULT_SOURCE):
+        self.source = source
+        self.orders = orders or []
+        self.version = 0
+        self.error: Optional[Exception] = None
+        self.extractions = 0
+
+        self._extracted_version = None
+
+    def extract_orders(self) -> list[BaseOrder]:
+        if self.error is not None:
+            raise self.error
+
+        self.extractions += 1
+        self._extracted_version = self.version
+
+        return [order.copy() for order in self.orders]
+
+    def is_modified(self) -> bool:
+        return self._extracted_version != self.version
+
+
+class FixedRateStore(BaseRateStore):
+    """Rate store with the same rate for every date"""
+
+    def __init__(self, rate: Decimal = Decimal("60")):
+        super().__init__()
+        self.rate = rate
+
+    def _get_rate(self, *_) -> Decimal:
+        return self.rate
+
+    def get_rate(self, *_) -> Decimal:
+        return self.rate
+
+
+@pytest.fixture
+def memory_backend() -> MemoryBackend:
+    return MemoryBackend()
+
+
+@pytest.fixture
+def rate_store() -> FixedRateStore:
+    return FixedRateStore()
+
+
+@pytest.fixture
+def empty_engine() -> Engine:
+    """Engine of database without tables, test is skipped without DATABASE_DSN"""
+
+    if not os.environ.get("DATABASE_DSN"):
+        pytest.skip("DATABASE_DSN is not set")
+
+    engine = get_engine()
+
+    try:
+        engine.connect().close()
+    except OperationalError as e:
+        pytest.skip(f"Database is unavailable: {e}")
+
+    SQLModel.metadata.drop_all(engine)
+    migrations_table.drop(engine, checkfirst=True)
+
+    return engine
+
+
+@pytest.fixture
+def engine(empty_engine: Engine) -> Engine:
+    """Engine of empty migrated database, test is skipped without DATABASE_DSN"""
+
+    migrate(empty_engine)
+    return empty_engine
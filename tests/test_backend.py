@@ -0,0 +1,162 @@
+import gzip
+import json
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import brotli
+import pytest
+from flask.testing import FlaskClient
+from sqlalchemy.engine import Engine
+from sqlmodel import Session
+
+from app.database import (
+    ORDERS_DATASET,
+    DatabaseDatasetVersion,
+    DatabaseOrder,
+    DatabaseOrderTombstone,
+)
+from app.migrations import prune_order_tombstones
+from app.webapp import backend, formats
+from benchmarks.formats import decode_columnar_json, decode_msgpack, decode_value
+
+TODAY = date(2022, 6, 6)
+
+MIMETYPES = [formats.JSON_MIMETYPE, formats.COLUMNAR_JSON_MIMETYPE, formats.MSGPACK_MIMETYPE]
+DECOMPRESSORS = {"identity": bytes, "gzip": gzip.decompress, "br": brotli.decompress}
+
+# orders endpoints with field of orders in json response
+ORDERS_URLS = [
+    ("/give-me-everything-you-know/", "results"),
+    ("/orders/", "results"),
+    ("/orders/changes/?since=0", "upserted"),
+]
+
+
+class FrozenDatetime(datetime):
+    """Datetime, which date is changed by tests"""
+
+    today = TODAY
+
+    @classmethod
+    def now(cls, *_) -> datetime:
+        return datetime.combine(cls.today, datetime.min.time())
+
+
+@pytest.fixture
+def client(engine: Engine, monkeypatch) -> FlaskClient:
+    with Session(engine) as session:
+        for order_id in range(1, 6):
+            order = DatabaseOrder(
+                table_id=order_id % 2,
+                order_id=order_id,
+                price_usd=f"{order_id}.25",
+                price_rub=f"{order_id * 60}.75",
+                supply_date=TODAY + timedelta(days=order_id - 3),
+                version=1,
+            )
+            session.add(order)
+
+        session.add(DatabaseDatasetVersion(name=ORDERS_DATASET, version=1))
+        session.commit()
+
+    monkeypatch.setattr(FrozenDatetime, "today", TODAY)
+    monkeypatch.setattr(backend, "datetime", FrozenDatetime)
+    # test responses are small, but they are compressed as large ones
+    monkeypatch.setattr(backend, "compression_min_size", 0)
+
+    return backend.app.test_client()
+
+
+def test_overdue_page_is_modified_next_day(client):
+    response = client.get("/orders/?overdue=true")
+    assert sorted(o["order_id"] for o in response.json["results"]) == [1, 2]
+
+    etag = response.headers["ETag"]
+    assert client.get("/orders/?overdue=true", headers={"If-None-Match": etag}).status_code == 304
+
+    FrozenDatetime.today = TODAY + timedelta(days=1)
+    response = client.get("/orders/?overdue=true", headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert sorted(o["order_id"] for o in response.json["results"]) == [1, 2, 3]
+
+
+def test_page_is_not_modified_next_day_without_overdue_filter(client):
+    etag = client.get("/orders/").headers["ETag"]
+
+    FrozenDatetime.today = TODAY + timedelta(days=1)
+    assert client.get("/orders/", headers={"If-None-Match": etag}).status_code == 304
+
+
+def decode(mimetype: str, data: bytes, orders_field: str) -> list[dict]:
+    if mimetype == formats.MSGPACK_MIMETYPE:
+        return decode_msgpack(data)
+    if mimetype == formats.COLUMNAR_JSON_MIMETYPE:
+        return decode_columnar_json(data)
+
+    orders = json.loads(data)[orders_field]
+    return [{field: decode_value(field, value) for field, value in o.items()} for o in orders]
+
+
+@pytest.mark.parametrize("url, orders_field", ORDERS_URLS)
+def test_formats_decode_to_same_orders(client, url, orders_field):
+    decoded = []
+
+    for mimetype in MIMETYPES:
+        for encoding, decompress in DECOMPRESSORS.items():
+            headers = {"Accept": mimetype, "Accept-Encoding": encoding}
+            response = client.get(url, headers=headers)
+
+            assert response.mimetype == mimetype
+            assert response.headers.get("Content-Encoding", "identity") == encoding
+
+            decoded.append(decode(mimetype, decompress(response.data), orders_field))
+
+    orders = decoded[0]
+
+    assert sorted(o["order_id"] for o in orders) == [1, 2, 3, 4, 5]
+    assert orders[0]["price_rub"] == Decimal("120.75")
+    assert all(d == orders for d in decoded)
+
+
+@pytest.mark.parametrize("url, _", ORDERS_URLS)
+def test_etag_differs_by_format(client, url, _):
+    etags = {m: client.get(url, headers={"Accept": m}).headers["ETag"] for m in MIMETYPES}
+    assert len(set(etags.values())) == len(MIMETYPES)
+
+    headers = {"Accept": formats.MSGPACK_MIMETYPE, "If-None-Match": etags[formats.JSON_MIMETYPE]}
+    response = client.get(url, headers=headers)
+
+    assert response.status_code == 200
+    assert response.mimetype == formats.MSGPACK_MIMETYPE
+
+    headers["If-None-Match"] = etags[formats.MSGPACK_MIMETYPE]
+    response = client.get(url, headers=headers)
+
+    assert response.status_code == 304
+    assert set(response.vary) == {"Accept", "Accept-Encoding"}
+
+
+def test_changes_since_pruned_tombstones_require_full_reload(engine, client):
+    with Session(engine) as session:
+        for order_id, version, days in ((10, 2, 3), (11, 3, 1)):
+            deleted_at = datetime.now() - timedelta(days=days)
+            session.add(
+                DatabaseOrderTombstone(order_id=order_id, version=version, deleted_at=deleted_at)
+            )
+
+        session.get(DatabaseDatasetVersion, ORDERS_DATASET).version = 3
+        session.commit()
+
+    with engine.begin() as connection:
+        assert prune_order_tombstones(connection, datetime.now() - timedelta(days=2)) == 1
+
+    response = client.get("/orders/changes/?since=1")
+
+    assert response.status_code == 410
+    assert response.json["pruned_version"] == 2
+
+    response = client.get("/orders/changes/?since=2")
+
+    assert response.status_code == 200
+    assert response.json["deleted"] == [11]
@@ -0,0 +1,77 @@
+import json
+import time
+from typing import Iterator
+
+import pytest
+from flask.testing import FlaskClient
+from sqlalchemy.engine import Engine
+from sqlmodel import Session
+
+from app import events
+from app.webapp import backend
+
+
+@pytest.fixture
+def client(engine: Engine, monkeypatch) -> FlaskClient:
+    # fresh listener reports connection with an event, then it gets every notification
+    backend.get_orders_listener.cache_clear()
+    monkeypatch.setattr(backend, "events_keepalive_interval", 0.1)
+
+    return backend.app.test_client()
+
+
+def iter_events(chunks: Iterator[bytes], timeout: float = 5) -> Iterator[dict]:
+    """Yield data of events from stream's chunks, skip keepalive comments"""
+
+    deadline = time.monotonic() + timeout
+
+    for chunk in chunks:
+        assert time.monotonic() < deadline, "no event in time"
+
+        if chunk.startswith(b"event: orders\n"):
+            yield json.loads(chunk.split(b"data: ", 1)[1])
+
+
+def test_notification_is_streamed(engine, client):
+    response = client.get("/orders/events/")
+
+    assert response.mimetype == "text/event-stream"
+    assert response.headers["Cache-Control"] == "no-cache"
+
+    stream = iter_events(response.response)
+
+    try:
+        # current version, then current version again once listener is connected
+        assert next(stream) == {"version": 0}
+        assert next(stream) == {"version": 0}
+
+        summary = {"version": 2, "upserted": 10, "deleted": 1}
+
+        with Session(engine) as session:
+            events.publish(session, events.ORDERS_CHANNEL, summary)
+            session.commit()
+
+        assert next(stream) == summary
+    finally:
+        response.close()
+
+
+def test_listener_reconnects_after_any_error():
+    attempts = []
+
+    class FlakyListener(events.Listener):
+        reconnect_delay = 0
+
+        def _listen(self):
+            attempts.append(len(attempts))
+
+            if len(attempts) == 1:
+                raise ValueError("file descriptor cannot be a negative integer")
+
+            self._fan_out(events.ORDERS_CHANNEL, "{}")
+            time.sleep(60)
+
+    queue = FlakyListener("postgresql://", [events.ORDERS_CHANNEL]).subscribe()
+
+    assert queue.get(timeout=5) == (events.ORDERS_CHANNEL, "{}")
+    assert attempts == [0, 1]
@@ -0,0 +1,208 @@
+import json
+import re
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import unquote, urlparse
+
+import gspread
+import pytest
+import requests
+
+from app.refresher.extractors import GSExtractor
+from app.refresher.refresher import Refresher
+from benchmarks.e2e import start_server
+
+SHEET_KEY = "sheet-key"
+HEADER = ["table_id", "order_id", "price_usd", "supply_date"]
+
+
+class FakeSheetsHandler(BaseHTTPRequestHandler):
+    """Sheets and drive apis of single spreadsheet with one worksheet"""
+
+    version = 1
+    rows: list[list[str]] = []
+    paths: list[str] = []
+
+    def do_GET(self):
+        path = unquote(urlparse(self.path).path)
+        self.paths.append(path)
+
+        if path == f"/drive/v3/files/{SHEET_KEY}":
+            self._respond({"version": str(self.version)})
+        elif path == f"/v4/spreadsheets/{SHEET_KEY}":
+            self._respond(self._get_metadata())
+        elif path.startswith(f"/v4/spreadsheets/{SHEET_KEY}/values/"):
+            self._respond(self._get_values(path.rsplit("/", 1)[1]))
+        else:
+            self.send_error(404)
+
+    def _get_metadata(self) -> dict:
+        properties = {
+            "sheetId": 0,
+            "title": "Sheet1",
+            "index": 0,
+            "gridProperties": {"rowCount": len(self.rows) + 1, "columnCount": 4},
+        }
+        return {"properties": {"title": "Orders"}, "sheets": [{"properties": properties}]}
+
+    def _get_values(self, range_name: str) -> dict:
+        rows = [HEADER, *self.rows]
+        match = re.search(r"!A(\d+):D(\d+)$", range_name)
+
+        if match is not None:
+            rows = rows[int(match[1]) - 1 : int(match[2])]
+
+        return {"range": range_name, "majorDimension": "ROWS", "values": rows}
+
+    def _respond(self, data: dict):
+        body = json.dumps(data).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_):
+        pass
+
+
+class LocalSession(requests.Session):
+    """Session, which sends google apis' requests to local server"""
+
+    def __init__(self, base_url: str):
+        super().__init__()
+        self.base_url = base_url
+
+    def request(self, method: str, url: str, *args, **kwargs) -> requests.Response:
+        url = url.replace("https://sheets.googleapis.com", self.base_url)
+        url = url.replace("https://www.googleapis.com", self.base_url)
+        return super().request(method, url, *args, **kwargs)
+
+
+@pytest.fixture
+def sheets() -> type[FakeSheetsHandler]:
+    rows = [[str(i % 3 + 1), str(i), f"{i}.50", "01.01.2030"] for i in range(1, 26)]
+    handler = type("Handler", (FakeSheetsHandler,), {"version": 1, "rows": rows, "paths": []})
+    handler.base_url = start_server(handler)
+
+    return handler
+
+
+@pytest.fixture
+def extractor(sheets: type[FakeSheetsHandler]) -> GSExtractor:
+    clients = []
+
+    class LocalGSExtractor(GSExtractor):
+        def _get_client(self) -> gspread.Client:
+            if self._client is None:
+                self._client = gspread.Client(None, LocalSession(sheets.base_url))
+                clients.append(self._client)
+
+            return self._client
+
+    extractor = LocalGSExtractor(SHEET_KEY, chunk_size=10)
+    extractor.clients = clients
+
+    return extractor
+
+
+def extract(extractor: GSExtractor) -> list[int]:
+    return [order.order_id for chunk in extractor.extract_orders_chunks() for order in chunk]
+
+
+def test_extracts_all_rows_by_chunks(sheets, extractor):
+    assert extract(extractor) == list(range(1, 26))
+
+    values_paths = [path for path in sheets.paths if "/values/" in path]
+    assert values_paths[0].endswith("'Sheet1'!A2:D11")
+    assert len(values_paths) == 3
+
+
+def test_is_modified_before_first_extraction(sheets, extractor):
+    assert extractor.is_modified()
+    assert sheets.paths == []
+
+
+def test_unmodified_sheet_is_not_downloaded(sheets, extractor):
+    extract(extractor)
+    sheets.paths.clear()
+
+    assert not extractor.is_modified()
+    assert sheets.paths == [f"/drive/v3/files/{SHEET_KEY}"]
+
+
+def test_changed_version_is_modified(sheets, extractor):
+    extract(extractor)
+    sheets.version += 1
+
+    assert extractor.is_modified()
+
+    extract(extractor)
+    assert not extractor.is_modified()
+
+
+def test_client_and_sheet_are_reused(sheets, extractor):
+    extract(extractor)
+    sheets.paths.clear()
+
+    extractor.is_modified()
+    extract(extractor)
+
+    metadata_paths = [path for path in sheets.paths if path == f"/v4/spreadsheets/{SHEET_KEY}"]
+
+    assert len(extractor.clients) == 1
+    # sheet is not opened again, only its actual row count is fetched
+    assert len(metadata_paths) == 1
+
+
+def test_refresher_skips_unmodified_sheet(sheets, extractor, memory_backend, rate_store):
+    refresher = Refresher(extractor, memory_backend, rate_store)
+
+    refresher.refresh_orders()
+    assert len(memory_backend.orders["default"]) == 25
+
+    sheets.paths.clear()
+    refresher.refresh_orders()
+
+    assert sheets.paths == [f"/drive/v3/files/{SHEET_KEY}"]
+
+    sheets.version += 1
+    sheets.rows.pop()
+    refresher.refresh_orders()
+
+    assert len(memory_backend.orders["default"]) == 24
+    assert memory_backend.deleted_ids == [25]
+
+
+def test_sheet_changed_while_extraction_deletes_nothing(
+    sheets, extractor, memory_backend, rate_store
+):
+    refresher = Refresher(extractor, memory_backend, rate_store)
+    refresher.refresh_orders()
+
+    values_requests = []
+
+    def shift_rows(range_name: str) -> dict:
+        values_requests.append(range_name)
+
+        # the first row is deleted after the first range is read, next rows shift up
+        if len(values_requests) == 2:
+            sheets.rows.pop(0)
+            sheets.version += 1
+
+        return FakeSheetsHandler._get_values(sheets, range_name)
+
+    sheets._get_values = staticmethod(shift_rows)
+    sheets.version += 1
+    refresher.refresh_orders()
+
+    # row 11 has shifted into already read range, but it is not deleted
+    assert not extractor.is_consistent()
+    assert memory_backend.deleted_ids == []
+    assert len(memory_backend.orders["default"]) == 25
+
+    refresher.refresh_orders()
+
+    assert extractor.is_consistent()
+    assert memory_backend.deleted_ids == [1]
+    assert len(memory_backend.orders["default"]) == 24
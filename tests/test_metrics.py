@@ -0,0 +1,45 @@
+import socket
+from types import SimpleNamespace
+
+from app import metrics
+from app.database import CheckoutStats
+
+
+def test_families_are_rendered_as_blocks(monkeypatch):
+    stats = {"backend": CheckoutStats(3, 0.5), "notifier": CheckoutStats(1, 0.25)}
+    monkeypatch.setattr(metrics, "get_checkout_stats", lambda: stats)
+
+    metrics.NOTIFIER_NOTIFICATIONS.inc(provider="telegram", result="sent")
+    metrics.TICK_SECONDS.observe(0.1, job="notifier")
+
+    families, family = [], None
+
+    for line in metrics.render().splitlines():
+        if line.startswith("# HELP "):
+            family = line.split()[2]
+            families.append(family)
+        elif not line.startswith("# TYPE "):
+            # histograms' samples have suffixes of their family
+            assert line.startswith(family), f"{line} is out of {family} block"
+
+    # every family has single block
+    assert len(families) == len(set(families))
+    assert 'db_pool_checkout_wait_seconds_total{role="notifier"} 0.25' in metrics.render()
+
+
+def test_taken_port_is_not_fatal(monkeypatch, caplog):
+    with socket.socket() as taken:
+        taken.bind(("127.0.0.1", 0))
+        taken.listen()
+
+        settings = SimpleNamespace(
+            metrics_enabled=True, metrics_host="127.0.0.1", metrics_port=taken.getsockname()[1]
+        )
+        monkeypatch.setattr(metrics, "get_settings", lambda: settings)
+        monkeypatch.setattr(metrics, "_enabled", False)
+        monkeypatch.setattr(metrics.event, "listen", lambda *_: None)
+
+        metrics.setup(serve=True)
+
+    assert metrics.is_enabled()
+    assert "Unable to serve metrics" in caplog.text
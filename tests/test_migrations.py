@@ -0,0 +1,67 @@
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from app.migrations import MIGRATIONS, migrate
+
+# schema of the first release, which had no migrations
+INITIAL_SCHEMA = (
+    """
+    CREATE TABLE orders (
+        table_id INTEGER NOT NULL,
+        order_id INTEGER NOT NULL PRIMARY KEY,
+        price_usd NUMERIC NOT NULL,
+        price_rub NUMERIC,
+        supply_date DATE NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE recipients (
+        provider VARCHAR NOT NULL,
+        provider_id VARCHAR NOT NULL,
+        PRIMARY KEY (provider, provider_id)
+    )
+    """,
+    """
+    CREATE TABLE notified (
+        order_id INTEGER NOT NULL,
+        recipient_provider VARCHAR NOT NULL,
+        recipient_provider_id VARCHAR NOT NULL,
+        PRIMARY KEY (order_id, recipient_provider, recipient_provider_id)
+    )
+    """,
+    "INSERT INTO orders VALUES (1, 10, 1.5, 90, '2022-06-06'), (1, 11, 2.5, 150, '2022-06-07')",
+    "INSERT INTO recipients VALUES ('telegram', '1')",
+    "INSERT INTO notified VALUES (10, 'telegram', '1'), (12, 'telegram', '1')",
+)
+
+
+def test_initial_schema_is_migrated(empty_engine: Engine):
+    with empty_engine.begin() as connection:
+        for statement in INITIAL_SCHEMA:
+            connection.execute(text(statement))
+
+    migrate(empty_engine)
+
+    with empty_engine.connect() as connection:
+        versions = connection.execute(text("SELECT version FROM schema_migrations")).scalars()
+        assert sorted(versions) == sorted(m.version for m in MIGRATIONS)
+
+        statement = text("SELECT indexname FROM pg_indexes WHERE tablename = 'orders'")
+        assert {"orders_source_idx", "orders_version_idx"} <= set(
+            connection.execute(statement).scalars()
+        )
+
+        statement = text("SELECT order_id, source, version FROM orders ORDER BY order_id")
+        assert connection.execute(statement).all() == [(10, "default", 0), (11, "default", 0)]
+
+        # orphaned state of deleted order is pruned, existing one has been sent
+        statement = text("SELECT order_id, status FROM notified")
+        assert connection.execute(statement).all() == [(10, "sent")]
+
+
+def test_migrations_are_applied_once(engine: Engine):
+    migrate(engine)
+
+    with engine.connect() as connection:
+        statement = text("SELECT count(*) FROM schema_migrations")
+        assert connection.execute(statement).scalar() == len(MIGRATIONS)
@@ -0,0 +1,156 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlmodel import Session
+
+from app.database import DatabaseNotifiedState, DatabaseOrder, DatabaseRecipient
+from app.notifier.backends import BulkDatabaseBackend
+from app.notifier.notifier import Notifier
+from app.notifier.providers import BaseProvider
+from app.schemas import NotificationData, NotificationScope, NotifiedStatus, Provider
+
+
+@pytest.fixture
+def backend(engine: Engine) -> BulkDatabaseBackend:
+    with Session(engine) as session:
+        for order_id in range(1, 5):
+            order = DatabaseOrder(
+                table_id=1,
+                order_id=order_id,
+                price_usd=1,
+                price_rub=60,
+                supply_date=date.today(),
+            )
+            session.add(order)
+
+        for provider_id in ("1", "2"):
+            session.add(DatabaseRecipient(provider=Provider.telegram, provider_id=provider_id))
+
+        session.commit()
+
+    return BulkDatabaseBackend(engine)
+
+
+def get_notifications(backend: BulkDatabaseBackend) -> dict[str, list[int]]:
+    notifications = backend.get_notifications_for_provider(Provider.telegram)
+    return {n.recipient.provider_id: [o.order_id for o in n.today_orders] for n in notifications}
+
+
+def get_states(engine: Engine) -> list[tuple]:
+    with engine.connect() as connection:
+        statement = text(
+            "SELECT recipient_provider_id, order_id, status FROM notified "
+            "ORDER BY recipient_provider_id, order_id"
+        )
+        return [tuple(row) for row in connection.execute(statement)]
+
+
+def split(notification: NotificationData, order_ids: set[int]) -> NotificationData:
+    orders = [o for o in notification.today_orders if o.order_id in order_ids]
+    return NotificationData(notification.recipient, orders, [])
+
+
+def test_only_sent_orders_are_marked_sent(engine, backend):
+    notifications = list(backend.get_notifications_for_provider(Provider.telegram))
+    backend.mark_notifications_sending(notifications)
+
+    first, second = notifications
+    backend.mark_notifications_sent([split(first, {1, 2}), second], [split(first, {3, 4})])
+
+    assert get_notifications(backend) == {"1": [3, 4]}
+    assert get_states(engine) == [("1", 1, "sent"), ("1", 2, "sent")] + [
+        ("2", order_id, "sent") for order_id in range(1, 5)
+    ]
+
+
+def test_stale_sending_state_is_not_marked_sent(engine, backend):
+    notifications = list(backend.get_notifications_for_provider(Provider.telegram))
+
+    # sending state left by crashed run, it is not a part of sent notification
+    backend.mark_notifications_sending([split(notifications[0], {4})])
+    backend.mark_notifications_sending([split(notifications[0], {1, 2, 3})])
+    backend.mark_notifications_sent([split(notifications[0], {1, 2, 3})], [])
+
+    assert ("1", 4, "sending") in get_states(engine)
+
+
+def test_sending_states_are_expired(engine, backend):
+    notifications = list(backend.get_notifications_for_provider(Provider.telegram))
+    backend.mark_notifications_sending(notifications[:1])
+
+    assert backend.expire_sending_notifications(timedelta(minutes=1)) == []
+    assert get_notifications(backend) == {"2": [1, 2, 3, 4]}
+
+    with Session(engine) as session:
+        sending_at = datetime.now() - timedelta(minutes=2)
+        session.query(DatabaseNotifiedState).update({"sending_at": sending_at})
+        session.commit()
+
+    (recipient,) = backend.expire_sending_notifications(timedelta(minutes=1))
+
+    assert recipient.provider_id == "1"
+    assert get_notifications(backend) == {"1": [1, 2, 3, 4], "2": [1, 2, 3, 4]}
+
+
+def test_deleted_order_is_not_marked_sending(engine, backend):
+    notifications = list(backend.get_notifications_for_provider(Provider.telegram))
+
+    with Session(engine) as session:
+        session.query(DatabaseOrder).where(DatabaseOrder.order_id == 2).delete()
+        session.commit()
+
+    backend.mark_notifications_sending(notifications)
+
+    states = get_states(engine)
+    assert len(states) == 6
+    assert all(order_id != 2 and status == NotifiedStatus.sending for _, order_id, status in states)
+
+
+class FailingProvider(BaseProvider):
+    """Provider, which fails notifications of given recipients"""
+
+    name = Provider.telegram
+
+    def __init__(self, failing_ids: set[str]):
+        self.failing_ids = failing_ids
+        self.sent: list[NotificationData] = []
+
+    def send_notification(self, notification: NotificationData):
+        if notification.recipient.provider_id in self.failing_ids:
+            raise RuntimeError("recipient is unavailable")
+
+        self.sent.append(notification)
+
+
+def test_notifier_resends_expired_notifications(engine, backend):
+    notifications = list(backend.get_notifications_for_provider(Provider.telegram))
+    backend.mark_notifications_sending(notifications[:1])
+
+    provider = FailingProvider({"2"})
+    notifier = Notifier([provider], backend, sending_timeout=timedelta(0))
+
+    # expired recipient is out of scope of recipients' events, but it is notified again
+    scope = NotificationScope(recipients={(Provider.telegram, "2")})
+    failed_recipients = notifier.send_notifications(scope)
+
+    assert [r.provider_id for r in failed_recipients] == ["2"]
+    assert [n.recipient.provider_id for n in provider.sent] == ["1"]
+    assert get_notifications(backend) == {"2": [1, 2, 3, 4]}
+
+
+def test_large_batch_is_marked_sent(engine, backend):
+    notification, _ = backend.get_notifications_for_provider(Provider.telegram)
+    backend.mark_notifications_sending([notification])
+
+    # long lists of orders' keys must not exceed postgres' expression depth
+    order = notification.today_orders[0]
+    deleted_orders = [order.copy(update={"order_id": i}) for i in range(10, 100_000)]
+    notification.today_orders.extend(deleted_orders)
+
+    backend.mark_notifications_sent([notification], [])
+    assert get_notifications(backend) == {"2": [1, 2, 3, 4]}
+
+    backend.mark_notifications_sent([], [notification])
+    assert get_states(engine)[:4] == [("1", order_id, "sent") for order_id in range(1, 5)]
@@ -0,0 +1,136 @@
+import json
+import threading
+import time
+from datetime import date, timedelta
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import telebot.apihelper
+
+from app.notifier.dispatcher import Dispatcher
+from app.notifier.providers import PartiallySentError
+from app.notifier.serializers import TelegramNotificationSerializer
+from app.schemas import BaseOrder, BaseRecipient, NotificationData, Provider
+from benchmarks.e2e import FakeTelegramHandler, UnlimitedTelegramProvider, start_server
+
+
+class FailingTelegramHandler(FakeTelegramHandler):
+    """Telegram bots api, which fails messages by their order number"""
+
+    errors: dict[int, dict] = {}
+    requests: list[tuple[float, str]] = []
+    failed = threading.Event()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode()
+        params = parse_qs(urlparse(self.path).query) | parse_qs(body)
+
+        self.requests.append((time.monotonic(), params["chat_id"][0]))
+        error = self.errors.get(len(self.requests))
+
+        if error is None:
+            return self._accept(params)
+
+        self._respond("application/json", json.dumps({"ok": False, **error}))
+        self.failed.set()
+
+    def _accept(self, params: dict):
+        message = {
+            "message_id": len(self.requests),
+            "date": int(time.time()),
+            "chat": {"id": int(params["chat_id"][0]), "type": "private"},
+            "text": "",
+        }
+        self._respond("application/json", json.dumps({"ok": True, "result": message}))
+
+
+FLOOD_CONTROL = {
+    "error_code": 429,
+    "description": "Too Many Requests",
+    "parameters": {"retry_after": 1},
+}
+BAD_REQUEST = {"error_code": 400, "description": "Bad Request: chat not found"}
+
+
+@pytest.fixture
+def telegram(monkeypatch) -> type[FailingTelegramHandler]:
+    attributes = {"errors": {}, "requests": [], "failed": threading.Event()}
+    handler = type("Handler", (FailingTelegramHandler,), attributes)
+
+    monkeypatch.setattr(telebot.apihelper, "API_URL", start_server(handler) + "/bot{0}/{1}")
+
+    return handler
+
+
+def make_notification(chat_id: str, orders_count: int) -> NotificationData:
+    today = date.today()
+    orders = [
+        BaseOrder(table_id=1, order_id=i, price_usd=1, supply_date=today - timedelta(days=i % 5))
+        for i in range(1, orders_count + 1)
+    ]
+
+    return NotificationData(
+        recipient=BaseRecipient(provider=Provider.telegram, provider_id=chat_id),
+        today_orders=[o for o in orders if o.supply_date == today],
+        overdue_orders=[o for o in orders if o.supply_date != today],
+    )
+
+
+def get_order_ids(notification: NotificationData) -> list[int]:
+    return sorted(o.order_id for o in notification.today_orders + notification.overdue_orders)
+
+
+def test_flood_control_pauses_all_chats(telegram):
+    telegram.errors = {1: FLOOD_CONTROL}
+    provider = UnlimitedTelegramProvider("0:test")
+
+    thread = threading.Thread(target=provider.send_notification, args=(make_notification("1", 1),))
+    thread.start()
+
+    # once first chat hits flood control, message to another chat waits for retry_after too
+    telegram.failed.wait(1)
+    time.sleep(0.1)
+    provider.send_notification(make_notification("2", 1))
+    thread.join()
+
+    (failed_at, _), *sent = telegram.requests
+
+    assert sorted(chat_id for _, chat_id in sent) == ["1", "2"]
+    assert all(sent_at - failed_at >= 0.9 for sent_at, _ in sent)
+
+
+def test_failed_first_message_fails_whole_notification(telegram):
+    telegram.errors = {1: BAD_REQUEST}
+    notification = make_notification("1", 1000)
+
+    result = Dispatcher(workers=1).dispatch(UnlimitedTelegramProvider("0:test"), [notification])
+
+    assert result.sent == []
+    assert result.failed == [notification]
+
+
+def test_partially_sent_notification_is_split(telegram):
+    telegram.errors = {2: BAD_REQUEST}
+    notification = make_notification("1", 1000)
+    parts = TelegramNotificationSerializer(notification).serialize_parts()
+
+    assert len(parts) > 2
+
+    result = Dispatcher(workers=1).dispatch(UnlimitedTelegramProvider("0:test"), [notification])
+    (sent,), (failed,) = result.sent, result.failed
+
+    assert get_order_ids(sent) == sorted(parts[0][1])
+    assert sorted(get_order_ids(sent) + get_order_ids(failed)) == get_order_ids(notification)
+
+
+def test_partially_sent_error_is_raised(telegram):
+    telegram.errors = {3: BAD_REQUEST}
+    notification = make_notification("1", 1000)
+
+    with pytest.raises(PartiallySentError) as error:
+        UnlimitedTelegramProvider("0:test").send_notification(notification)
+
+    parts = TelegramNotificationSerializer(notification).serialize_parts()
+    assert get_order_ids(error.value.sent) == sorted(parts[0][1] + parts[1][1])
+    assert len(telegram.requests) == 3
@@ -0,0 +1,135 @@
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+from app.database import DatabaseRate
+from app.refresher import cbrf
+from app.refresher.rates import DatabaseRateStore, RateNotFoundError
+from benchmarks.e2e import FakeCbrfHandler, start_server
+
+# monday, the previous saturday and sunday are non-working days
+MONDAY = date(2022, 6, 6)
+
+
+class WorkingDaysCbrfHandler(FakeCbrfHandler):
+    """Cbrf's XML_dynamic.asp, which sets rates on working days only"""
+
+    delay = 0
+    status = 200
+    empty = False
+    queries: list[dict] = []
+
+    def _get_value(self, rate_date: date) -> Optional[str]:
+        if self.empty or rate_date.weekday() >= 5:
+            return None
+
+        return f"{60 + rate_date.day},5"
+
+    def do_GET(self):
+        self.queries.append({k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()})
+        time.sleep(self.delay)
+
+        if self.status != 200:
+            self.send_error(self.status)
+            return
+
+        super().do_GET()
+
+
+@pytest.fixture
+def cbrf_server() -> type[WorkingDaysCbrfHandler]:
+    handler = type("Handler", (WorkingDaysCbrfHandler,), {"queries": []})
+    handler.base_url = start_server(handler)
+
+    return handler
+
+
+def create_store(engine, cbrf_server, **kwargs) -> DatabaseRateStore:
+    return DatabaseRateStore(engine, base_url=cbrf_server.base_url, prefetch_days=7, **kwargs)
+
+
+def test_prefetches_range(engine, cbrf_server):
+    assert create_store(engine, cbrf_server).get_rate(cbrf.USD_ID, MONDAY) == Decimal("66.5")
+
+    assert cbrf_server.queries == [
+        {"date_req1": "30/05/2022", "date_req2": "06/06/2022", "VAL_NM_RQ": cbrf.USD_ID}
+    ]
+
+    # rates of prefetched range are stored, new store does not fetch them again
+    store = create_store(engine, cbrf_server)
+
+    for days in range(8):
+        store.get_rate(cbrf.USD_ID, MONDAY - timedelta(days=days))
+
+    assert len(cbrf_server.queries) == 1
+
+
+def test_non_working_days_get_last_set_rate(engine, cbrf_server):
+    store = create_store(engine, cbrf_server)
+
+    assert store.get_rate(cbrf.USD_ID, MONDAY - timedelta(days=1)) == Decimal("63.5")
+    assert store.get_rate(cbrf.USD_ID, MONDAY - timedelta(days=2)) == Decimal("63.5")
+    assert store.get_rate(cbrf.USD_ID, MONDAY - timedelta(days=3)) == Decimal("63.5")
+
+
+def test_rates_are_cached_in_process(engine, cbrf_server):
+    store = create_store(engine, cbrf_server)
+    store.get_rate(cbrf.USD_ID, MONDAY)
+
+    cbrf_server.status = 500
+
+    with engine.begin() as connection:
+        connection.execute(DatabaseRate.__table__.delete())
+
+    assert store.get_rate(cbrf.USD_ID, MONDAY) == Decimal("66.5")
+
+
+def test_timeout(engine, cbrf_server):
+    cbrf_server.delay = 0.5
+
+    with pytest.raises(requests.Timeout):
+        create_store(engine, cbrf_server, timeout=0.1).get_rate(cbrf.USD_ID, MONDAY)
+
+
+def test_last_known_rate_fallback(engine, cbrf_server):
+    create_store(engine, cbrf_server).get_rate(cbrf.USD_ID, MONDAY)
+
+    cbrf_server.delay = 0.5
+    next_day = MONDAY + timedelta(days=1)
+    store = create_store(engine, cbrf_server, timeout=0.1, use_last_known_rate=True)
+
+    assert store.get_rate(cbrf.USD_ID, next_day) == Decimal("66.5")
+
+    # fallback rate is not cached, actual one is fetched next time
+    cbrf_server.delay = 0
+    assert store.get_rate(cbrf.USD_ID, next_day) == Decimal("67.5")
+
+
+def test_unavailable_cbrf_without_last_known_rate(engine, cbrf_server):
+    cbrf_server.status = 500
+
+    with pytest.raises(requests.HTTPError):
+        create_store(engine, cbrf_server).get_rate(cbrf.USD_ID, MONDAY)
+
+    store = create_store(engine, cbrf_server, use_last_known_rate=True)
+
+    with pytest.raises(requests.HTTPError):
+        store.get_rate(cbrf.USD_ID, MONDAY)
+
+
+def test_empty_range_falls_back_to_last_known_rate(engine, cbrf_server):
+    create_store(engine, cbrf_server).get_rate(cbrf.USD_ID, MONDAY)
+
+    cbrf_server.empty = True
+    next_day = MONDAY + timedelta(days=1)
+
+    with pytest.raises(RateNotFoundError):
+        create_store(engine, cbrf_server).get_rate(cbrf.USD_ID, next_day)
+
+    store = create_store(engine, cbrf_server, use_last_known_rate=True)
+    assert store.get_rate(cbrf.USD_ID, next_day) == Decimal("66.5")
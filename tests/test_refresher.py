@@ -0,0 +1,137 @@
+from decimal import Decimal
+
+import pytest
+
+from app.refresher.refresher import MultiSourceRefresher, Refresher
+from app.schemas import BaseOrder, Money
+from tests.conftest import MemoryExtractor
+
+
+def make_orders(*order_ids: int) -> list[BaseOrder]:
+    return [
+        BaseOrder(table_id=i, order_id=i, price_usd=f"{i}.15", supply_date="01.01.2030")
+        for i in order_ids
+    ]
+
+
+def test_applied_rate_is_saved_with_diffs(memory_backend, rate_store):
+    refresher = Refresher(MemoryExtractor(make_orders(1, 2)), memory_backend, rate_store)
+    refresher.refresh_orders()
+
+    assert memory_backend.rates == {"default": Decimal("60")}
+    assert memory_backend.orders["default"][1].price_rub == Decimal("69.00")
+
+
+def test_rate_change_reprices_unmodified_source(memory_backend, rate_store):
+    extractor = MemoryExtractor(make_orders(1, 2, 3))
+    refresher = Refresher(extractor, memory_backend, rate_store)
+    refresher.refresh_orders()
+
+    rate_store.rate = Decimal("61.3")
+    memory_backend.refreshed_ids.clear()
+    refresher.refresh_orders()
+
+    # unmodified source is repriced by backend, it is not extracted again
+    assert extractor.extractions == 1
+    assert memory_backend.refreshed_ids == []
+    assert memory_backend.rates == {"default": Decimal("61.3")}
+
+    for order in memory_backend.orders["default"].values():
+        assert order.price_rub == Money.validate(order.price_usd * Decimal("61.3"))
+
+    # repriced orders match extracted ones, so only changed order is applied
+    extractor.orders[0].price_usd = Decimal("10")
+    extractor.version += 1
+    refresher.refresh_orders()
+
+    assert extractor.extractions == 2
+    assert memory_backend.refreshed_ids == [1]
+
+
+def test_repriced_fingerprints_are_reloaded(memory_backend, rate_store):
+    Refresher(MemoryExtractor(make_orders(1, 2)), memory_backend, rate_store).refresh_orders()
+
+    # new process knows neither fingerprints nor rate of stored orders
+    rate_store.rate = Decimal("59.5")
+    extractor = MemoryExtractor(make_orders(1, 2))
+    Refresher(extractor, memory_backend, rate_store).refresh_orders()
+
+    assert memory_backend.rates == {"default": Decimal("59.5")}
+    assert memory_backend.refreshed_ids == [1, 2]
+    assert memory_backend.orders["default"][2].price_rub == Decimal("127.93")
+
+
+@pytest.fixture
+def extractors() -> dict[str, MemoryExtractor]:
+    return {
+        "default": MemoryExtractor(make_orders(1, 2, 3)),
+        "east": MemoryExtractor(make_orders(4, 5), source="east"),
+        "west": MemoryExtractor(make_orders(6, 7), source="west"),
+    }
+
+
+def get_order_ids(backend) -> dict[str, list[int]]:
+    return {source: sorted(orders) for source, orders in backend.orders.items()}
+
+
+def test_deletion_is_scoped_to_source(memory_backend, rate_store, extractors):
+    refresher = MultiSourceRefresher(list(extractors.values()), memory_backend, rate_store)
+    refresher.refresh_orders()
+
+    extractors["east"].orders = make_orders(4)
+    extractors["east"].version += 1
+    refresher.refresh_orders()
+
+    assert memory_backend.deleted_ids == [5]
+    assert get_order_ids(memory_backend) == {"default": [1, 2, 3], "east": [4], "west": [6, 7]}
+
+
+def test_failed_source_keeps_its_orders(memory_backend, rate_store, extractors):
+    refresher = MultiSourceRefresher(list(extractors.values()), memory_backend, rate_store)
+    refresher.refresh_orders()
+
+    for extractor in extractors.values():
+        extractor.orders = extractor.orders[:1]
+        extractor.version += 1
+
+    extractors["east"].error = RuntimeError("sheet is unavailable")
+    refresher.refresh_orders()
+
+    assert get_order_ids(memory_backend) == {"default": [1], "east": [4, 5], "west": [6]}
+
+
+def test_every_failed_source_fails_refresh(memory_backend, rate_store, extractors):
+    for extractor in extractors.values():
+        extractor.error = RuntimeError("sheet is unavailable")
+
+    refresher = MultiSourceRefresher(list(extractors.values()), memory_backend, rate_store)
+
+    with pytest.raises(RuntimeError, match="Unable to refresh any source"):
+        refresher.refresh_orders()
+
+
+def test_order_of_another_source_is_rejected(memory_backend, rate_store, extractors):
+    # single worker applies sources in their order
+    _, east, west = extractors.values()
+    refresher = MultiSourceRefresher(
+        list(extractors.values()), memory_backend, rate_store, workers=1
+    )
+    refresher.refresh_orders()
+
+    # the same id is listed by two sheets, it stays with the first one
+    west.orders.extend(make_orders(4))
+    west.version += 1
+    refresher.refresh_orders()
+
+    assert get_order_ids(memory_backend) == {"default": [1, 2, 3], "east": [4, 5], "west": [6, 7]}
+
+    # rejected order is retried without sheet's modification, once it is free
+    east.orders = make_orders(5)
+    east.version += 1
+    refresher.refresh_orders()
+
+    assert get_order_ids(memory_backend) == {"default": [1, 2, 3], "east": [5], "west": [4, 6, 7]}
+    assert west.extractions == 3
+
+    refresher.refresh_orders()
+    assert west.extractions == 3
@@ -0,0 +1,79 @@
+from datetime import date
+from decimal import Decimal
+
+import pytest
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, select
+
+from app.database import DatabaseOrder
+from app.refresher.backends import BulkDatabaseBackend, DatabaseBackend
+from app.schemas import BaseOrder, Money, OrdersDiff
+
+# prices, which are ties or negative after multiplication by rates
+PRICES_USD = ["0.01", "-0.01", "1.01", "-1.01", "1.23", "-1.23", "2.15", "-2.15", "0.03"]
+
+
+@pytest.fixture
+def backend(engine: Engine) -> DatabaseBackend:
+    with Session(engine) as session:
+        for order_id, price_usd in enumerate(PRICES_USD, start=1):
+            order = DatabaseOrder(
+                table_id=order_id,
+                order_id=order_id,
+                price_usd=price_usd,
+                price_rub=0,
+                supply_date=date(2030, 1, 1),
+            )
+            session.add(order)
+
+        session.commit()
+
+    return DatabaseBackend(engine)
+
+
+def get_prices(engine: Engine) -> list[tuple[Decimal, Decimal]]:
+    with Session(engine) as session:
+        statement = select(DatabaseOrder.price_usd, DatabaseOrder.price_rub)
+        return [tuple(row) for row in session.execute(statement.order_by(DatabaseOrder.order_id))]
+
+
+@pytest.mark.parametrize("rate", ["60.5", "50.5", "0.5", "61.1667"])
+def test_reprice_rounds_as_money(engine, backend, rate):
+    rate = Decimal(rate)
+
+    assert backend.reprice_orders(rate) == len(PRICES_USD)
+
+    for price_usd, price_rub in get_prices(engine):
+        assert price_rub == Money.validate(price_usd * rate), price_usd
+
+    assert backend.get_applied_rate() == rate
+
+
+def test_reprice_with_same_rate_keeps_versions(engine, backend):
+    backend.reprice_orders(Decimal("60.5"))
+
+    with Session(engine) as session:
+        versions = sorted(session.execute(select(DatabaseOrder.version)).scalars())
+
+    assert backend.reprice_orders(Decimal("60.5")) == 0
+    assert backend.reprice_orders(Decimal("60.5"), source="other") == 0
+
+    with Session(engine) as session:
+        assert sorted(session.execute(select(DatabaseOrder.version)).scalars()) == versions
+
+
+@pytest.mark.parametrize("backend_class", [DatabaseBackend, BulkDatabaseBackend])
+def test_order_of_another_source_is_rejected(engine, backend, backend_class):
+    orders = [
+        BaseOrder(table_id=1, order_id=order_id, price_usd=1, supply_date="01.01.2030")
+        for order_id in (1, 100)
+    ]
+
+    backend = backend_class(engine)
+    diff = OrdersDiff(inserted=orders)
+
+    assert backend.apply_orders_diffs([diff], source="other") == [1]
+    assert backend.refresh_orders(orders, source="other") == [1]
+
+    assert list(backend.get_fingerprints("other")) == [100]
+    assert len(backend.get_fingerprints()) == len(PRICES_USD)
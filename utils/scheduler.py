@@ -0,0 +1,156 @@
+import random
+import signal
+import threading
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Callable
+
+from app import metrics
+from app.logger import logger
+
+
+@dataclass
+class JobStats:
+    """Job's run-time stats since last report"""
+
+    runs: int = 0
+    failures: int = 0
+    skipped_ticks: int = 0
+    total_time: float = 0
+    max_time: float = 0
+
+    def add_run(self, duration: float, failed: bool):
+        self.runs += 1
+        self.failures += failed
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+
+    def __str__(self) -> str:
+        average_time = self.total_time / self.runs if self.runs else 0
+
+        return (
+            f"{self.runs} run(s), {self.failures} failed, {self.skipped_ticks} tick(s) skipped, "
+            f"avg {average_time:.3f}s, max {self.max_time:.3f}s"
+        )
+
+
+@dataclass
+class Job:
+    """Scheduled job"""
+
+    function: Callable
+    interval: timedelta
+    name: str
+    # random delay of every run as a fraction of interval
+    jitter: float = 0.1
+    max_backoff: timedelta = timedelta(minutes=5)
+
+
+class Scheduler:
+    """
+    Run several jobs in one process, every job in its own thread. Jobs run at fixed rate,
+    ticks, which come while previous run is still running, are skipped. Repeated failures
+    back off exponentially up to job's max_backoff. SIGINT and SIGTERM stop scheduler
+    after current runs
+    """
+
+    def __init__(
+        self,
+        stats_interval: timedelta = timedelta(minutes=5),
+        shutdown_timeout: timedelta = timedelta(seconds=30),
+    ):
+        self._stats_interval = stats_interval.total_seconds()
+        self._shutdown_timeout = shutdown_timeout.total_seconds()
+        self._jobs = []
+        self._stopped = threading.Event()
+
+    def add_job(self, function: Callable, interval: timedelta, name: str = None, **kwargs) -> Job:
+        """Add job, which runs function every interval, see Job for other parameters"""
+
+        job = Job(function, interval, name or function.__name__, **kwargs)
+        self._jobs.append(job)
+
+        return job
+
+    def _wait(self, run_at: float) -> bool:
+        """Wait until given monotonic time, return False if scheduler has been stopped"""
+        return not self._stopped.wait(max(run_at - time.monotonic(), 0))
+
+    def _run_job(self, job: Job):
+        """Run job at fixed rate until scheduler is stopped"""
+
+        interval = job.interval.total_seconds()
+        max_backoff = job.max_backoff.total_seconds()
+
+        stats, reported_at = JobStats(), time.monotonic()
+        tick, failures = time.monotonic(), 0
+
+        while self._wait(tick + random.uniform(0, job.jitter * interval)):
+            started_at = time.monotonic()
+
+            try:
+                job.function()
+            except Exception as e:
+                failures += 1
+                metrics.JOB_FAILURES.inc(job=job.name)
+                logger.error(
+                    f"Job {job.name} failed {failures} time(s) in a row: {e}", exc_info=True
+                )
+            else:
+                failures = 0
+
+            finished_at = time.monotonic()
+            stats.add_run(finished_at - started_at, failed=bool(failures))
+            metrics.JOB_SECONDS.observe(finished_at - started_at, job=job.name)
+
+            # next tick is on the fixed grid, so run time does not shift the schedule
+            earliest_run = finished_at
+
+            if failures:
+                earliest_run += min(interval * 2 ** (failures - 1), max_backoff)
+
+            skipped_ticks = max(int((earliest_run - tick) // interval), 0)
+            tick += (skipped_ticks + 1) * interval
+
+            # ticks passed during backoff are not skipped because of overlapping
+            if not failures:
+                stats.skipped_ticks += skipped_ticks
+
+            if finished_at - reported_at >= self._stats_interval:
+                logger.info(f"Job {job.name} stats: {stats}")
+                stats, reported_at = JobStats(), finished_at
+
+    def stop(self, *_):
+        """Stop scheduler, running jobs are finished first"""
+
+        if not self._stopped.is_set():
+            logger.info("Stopping scheduler")
+            self._stopped.set()
+
+    def run(self):
+        """Start jobs and block until scheduler is stopped by signal or stop call"""
+
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, self.stop)
+            signal.signal(signal.SIGTERM, self.stop)
+
+        # long-running jobs must not keep stopped process alive, so threads are daemons
+        threads = [
+            threading.Thread(target=self._run_job, args=(job,), name=job.name, daemon=True)
+            for job in self._jobs
+        ]
+
+        for thread in threads:
+            thread.start()
+
+        logger.info(f"Scheduler started {', '.join(job.name for job in self._jobs)} job(s)")
+        self._stopped.wait()
+
+        deadline = time.monotonic() + self._shutdown_timeout
+
+        for thread in threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+
+            if thread.is_alive():
+                logger.warning(f"Job {thread.name} has not finished in time")
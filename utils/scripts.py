@@ -1,33 +1,28 @@
-import time
 from datetime import timedelta
 from functools import wraps
 from typing import Callable
 
-from sqlmodel import SQLModel
-
-from app.database import engine
-from app.logger import logger
+from app import metrics
+from utils.scheduler import Scheduler
 
 
 def script(interval: timedelta):
     """
-    Decorator for entrypoint scripts. Create models in database if they not exist,
-    start safe busy-loop with given interval, logs raised errors
+    Decorator for entrypoint scripts. Run function as the only scheduler's job with given
+    interval. Wrapped function and interval are kept to schedule several scripts in one
+    process. Database must be migrated with scripts/migrate.py beforehand
     """
 
-    SQLModel.metadata.create_all(engine)
-
     def decorator(function: Callable) -> Callable:
         @wraps(function)
-        def wrapper(*args, **kwargs):
-            while True:
-                try:
-                    function(*args, **kwargs)
-                except Exception as e:
-                    logger.error(e, exc_info=True)
+        def wrapper():
+            metrics.setup(serve=True)
 
-                time.sleep(interval.total_seconds())
+            scheduler = Scheduler()
+            scheduler.add_job(function, interval)
+            scheduler.run()
 
+        wrapper.interval = interval
         return wrapper
 
     return decorator